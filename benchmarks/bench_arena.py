@@ -0,0 +1,61 @@
+"""
+Compare decoding through a `Program` tree, the streaming decoder and a
+`NodeArena`, in time and in peak memory.
+
+The raw `SerdeCoinSpends` tuples are decoded, as decoding a full
+`UnsignedSpend` is dominated by tree hashing puzzle reveals. Peak memory is
+measured with `tracemalloc`, which doesn't see the memory `klvm_rs` allocates
+natively for `Program` nodes, so the "program" row understates its peak.
+
+Run with `python -m benchmarks.bench_arena [coin-count ...]`.
+"""
+
+import sys
+import tracemalloc
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.core.unsigned_spend import SerdeCoinSpends, from_storage
+from hsmk.klvm_serde import from_program_for_type, to_program_for_type
+from hsmk.klvm_serde.arena import NodeArena, from_arena_for_type
+from hsmk.klvm_serde.stream import BufferReader, from_stream_for_type
+
+from .bench_klvm_serde import best_of
+from .sample_spends import unsigned_spend_for_coin_count
+
+
+def peak_memory(f) -> int:
+    tracemalloc.start()
+    try:
+        r = f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del r
+    return peak
+
+
+def main(args=sys.argv[1:]):
+    coin_counts = [int(_) for _ in args] or [10, 100, 500]
+    from_program = from_program_for_type(SerdeCoinSpends)
+    from_stream = from_stream_for_type(SerdeCoinSpends)
+    from_arena = from_arena_for_type(SerdeCoinSpends)
+    print(f"{'coins':>6} {'target':>8} {'ms':>9} {'peak KiB':>9}")
+    for coin_count in coin_counts:
+        us = unsigned_spend_for_coin_count(coin_count)
+        value = from_storage(us.coin_spends)
+        blob = bytes(to_program_for_type(SerdeCoinSpends)(value))
+        rows = [
+            ("program", lambda: from_program(Program.from_bytes(blob))),
+            ("stream", lambda: from_stream(BufferReader(blob))),
+            ("arena", lambda: from_arena(NodeArena.from_bytes(blob), 0)),
+        ]
+        for target, f in rows:
+            assert f() == value
+            t = best_of(f)
+            peak = peak_memory(f)
+            print(f"{coin_count:>6} {target:>8} {t * 1e3:>9.3f} {peak / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare the closure-based serializers in `hsmk.klvm_serde` with the
+code-generated ones in `hsmk.klvm_serde.codegen` or the explicit-stack ones in
+`hsmk.klvm_serde.iterative`.
+
+Decoding a full `UnsignedSpend` is dominated by `to_storage` calculating the
+tree hash of every puzzle reveal, so the raw `SerdeCoinSpends` tuples are
+measured too to show the cost of the serde machinery by itself.
+
+Run with `python -m benchmarks.bench_klvm_serde [compiled|iterative] [coin-count ...]`.
+"""
+
+import sys
+import timeit
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.core.unsigned_spend import SerdeCoinSpends, UnsignedSpend, from_storage
+from hsmk.klvm_serde import from_program_for_type, to_program_for_type
+from hsmk.klvm_serde.codegen import (
+    compiled_from_program_for_type,
+    compiled_to_program_for_type,
+)
+from hsmk.klvm_serde.iterative import (
+    iterative_from_program_for_type,
+    iterative_to_program_for_type,
+)
+
+from .sample_spends import unsigned_spend_for_coin_count
+
+
+def best_of(f, repeat: int = 5) -> float:
+    timer = timeit.Timer(f)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+TARGETS = {
+    "compiled": (compiled_to_program_for_type, compiled_from_program_for_type),
+    "iterative": (iterative_to_program_for_type, iterative_from_program_for_type),
+}
+
+
+def compare(label: str, t, value, target: str = "compiled") -> None:
+    closure_to = to_program_for_type(t)
+    closure_from = from_program_for_type(t)
+    to_program_for_target, from_program_for_target = TARGETS[target]
+    compiled_to = to_program_for_target(t)
+    compiled_from = from_program_for_target(t)
+
+    blob = bytes(closure_to(value))
+    assert bytes(compiled_to(value)) == blob
+    assert compiled_from(Program.from_bytes(blob)) == value
+
+    # deserialize from a fresh `Program` each time so cached `pair`
+    # wrappers from a previous run don't skew the numbers
+    rows = [
+        ("ser", lambda: closure_to(value), lambda: compiled_to(value)),
+        (
+            "deser",
+            lambda: closure_from(Program.from_bytes(blob)),
+            lambda: compiled_from(Program.from_bytes(blob)),
+        ),
+    ]
+    for op, closure_f, compiled_f in rows:
+        t_closure = best_of(closure_f)
+        t_compiled = best_of(compiled_f)
+        print(
+            f"{label:>22} {op:>6} {t_closure * 1e3:>11.3f}"
+            f" {t_compiled * 1e3:>12.3f} {t_closure / t_compiled:>7.2f}x"
+        )
+
+
+def main(argv=sys.argv[1:]):
+    target = "compiled"
+    if argv and argv[0] in TARGETS:
+        target, argv = argv[0], argv[1:]
+    coin_counts = [int(_) for _ in argv] or [10, 100, 1000]
+    print(
+        f"{'type (coins)':>22} {'op':>6} {'closure ms':>11}"
+        f" {target + ' ms':>12} {'speedup':>8}"
+    )
+    for coin_count in coin_counts:
+        us = unsigned_spend_for_coin_count(coin_count)
+        compare(f"UnsignedSpend ({coin_count})", UnsignedSpend, us, target)
+        compare(
+            f"SerdeCoinSpends ({coin_count})",
+            SerdeCoinSpends,
+            from_storage(us.coin_spends),
+            target,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Measure the size of an `UnsignedSpend` in each encoding version, with and
+without back-references, in bytes and in QR chunks, with and without zlib
+compression.
+
+Run with `python -m benchmarks.encoding_sizes [coin-count ...]`.
+"""
+
+import sys
+import zlib
+
+from hsmk.core.unsigned_spend import ENCODINGS, UnsignedSpend
+from hsmk.util.byte_chunks import (
+    create_chunks_for_blob,
+    optimal_chunk_size_for_max_chunk_size,
+)
+
+from .sample_spends import unsigned_spend_for_coin_count
+
+MAX_CHUNK_SIZES = [256, 1024]
+
+
+def chunk_count(blob: bytes, max_chunk_size: int) -> int:
+    size = optimal_chunk_size_for_max_chunk_size(len(blob), max_chunk_size)
+    return len(create_chunks_for_blob(blob, size))
+
+
+def main(args=sys.argv[1:]):
+    coin_counts = [int(_) for _ in args] or [1, 10, 100]
+    chunk_headers = "".join(f" {f'chunks@{_}':>12}" for _ in MAX_CHUNK_SIZES)
+    print(f"{'coins':>6} {'version':>8} {'mode':>14} {'bytes':>8}{chunk_headers}")
+    for coin_count in coin_counts:
+        us = unsigned_spend_for_coin_count(coin_count)
+        for version in range(len(ENCODINGS)):
+            plain = us.to_bytes(version=version)
+            backrefs = us.to_bytes(backrefs=True, version=version)
+            assert UnsignedSpend.from_bytes(plain) == us
+            assert UnsignedSpend.from_bytes(backrefs) == us
+            rows = [
+                ("plain", plain),
+                ("backrefs", backrefs),
+                ("zlib", zlib.compress(plain, level=9)),
+                ("zlib+backrefs", zlib.compress(backrefs, level=9)),
+            ]
+            for mode, blob in rows:
+                chunks = "".join(
+                    f" {chunk_count(blob, _):>12}" for _ in MAX_CHUNK_SIZES
+                )
+                print(
+                    f"{coin_count:>6} {version:>8} {mode:>14}"
+                    f" {len(blob):>8}{chunks}"
+                )
+
+
+if __name__ == "__main__":
+    main()
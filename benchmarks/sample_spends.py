@@ -0,0 +1,60 @@
+"""
+Build realistic `UnsignedSpend` objects of arbitrary size for benchmarking.
+
+Each coin is a standard `p2_delegated_puzzle_or_hidden_puzzle` coin locked to
+the sum of two derived public keys, spent with a `p2_conditions` delegated
+puzzle, just like the spends `hsm_test_spend` generates.
+"""
+
+import hashlib
+
+from klvm_rs import Program  # type: ignore
+
+from chik_base.bls12_381 import BLSSecretExponent
+from chik_base.core import Coin, CoinSpend
+
+from hsmk.core.signing_hints import PathHint, SumHint
+from hsmk.core.unsigned_spend import UnsignedSpend
+from hsmk.puzzles.conlang import CREATE_COIN
+from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    DEFAULT_HIDDEN_PUZZLE,
+    DEFAULT_HIDDEN_PUZZLE_HASH,
+    calculate_synthetic_offset,
+    puzzle_for_public_key_and_hidden_puzzle,
+    solution_for_conditions,
+)
+
+AGG_SIG_ME_ADDITIONAL_DATA = bytes.fromhex(
+    "ccd5bb71183532bff220ba46c268991a3ff07eb358e8255a65c30a2dce0e5fbb"
+)
+
+SECRET_A = BLSSecretExponent.from_int(100)
+SECRET_B = BLSSecretExponent.from_int(200)
+
+
+def sha256(*args) -> bytes:
+    return hashlib.sha256(b"".join(str(_).encode() for _ in args)).digest()
+
+
+def unsigned_spend_for_coin_count(coin_count: int) -> UnsignedSpend:
+    coin_spends = []
+    sum_hints = []
+    path_hints = []
+    for idx in range(coin_count):
+        path_a = [1, 5, idx]
+        path_b = [2, 7, idx]
+        pk_a = SECRET_A.child_for_path(path_a).public_key()
+        pk_b = SECRET_B.child_for_path(path_b).public_key()
+        sum_pk = pk_a + pk_b
+        puzzle = puzzle_for_public_key_and_hidden_puzzle(sum_pk, DEFAULT_HIDDEN_PUZZLE)
+        coin = Coin(sha256("parent", idx), puzzle.tree_hash(), 1000 + idx)
+        conditions = Program.to([[CREATE_COIN, sha256("dest", idx), coin.amount]])
+        solution = solution_for_conditions(conditions)
+        coin_spends.append(CoinSpend(coin, puzzle, solution))
+        synthetic_offset = calculate_synthetic_offset(
+            sum_pk, DEFAULT_HIDDEN_PUZZLE_HASH
+        )
+        sum_hints.append(SumHint([pk_a, pk_b], synthetic_offset))
+        path_hints.append(PathHint(SECRET_A.public_key(), path_a))
+        path_hints.append(PathHint(SECRET_B.public_key(), path_b))
+    return UnsignedSpend(coin_spends, sum_hints, path_hints, AGG_SIG_ME_ADDITIONAL_DATA)
@@ -4,6 +4,7 @@ from chik_base.cbincode import from_bytes
 from chik_base.core import SpendBundle
 
 from hsmk.debug.debug_spend_bundle import debug_spend_bundle
+from hsmk.process.conditions_cache import CONDITIONS_CACHE
 
 
 def file_or_string(p) -> str:
@@ -16,6 +17,8 @@ def file_or_string(p) -> str:
 
 
 def hsmk_dump_sb(args, parser):
+    if args.conditions_cache:
+        CONDITIONS_CACHE.attach(args.conditions_cache)
     blob = bytes.fromhex(file_or_string(args.spend_bundle))
     spend_bundle = from_bytes(SpendBundle, blob)
     validates = debug_spend_bundle(spend_bundle)
@@ -24,6 +27,11 @@ def hsmk_dump_sb(args, parser):
 
 def create_parser():
     parser = argparse.ArgumentParser(description="Dump information about `SpendBundle`")
+    parser.add_argument(
+        "--conditions-cache",
+        metavar="path-to-sqlite-file",
+        help="cache puzzle results in this file, so they're reused across runs",
+    )
     parser.add_argument(
         "spend_bundle",
         metavar="hex-encoded-spend-bundle-or-file",
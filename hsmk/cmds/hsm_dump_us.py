@@ -2,8 +2,18 @@ import argparse
 import sys
 import zlib
 
+from klvm_rs import Program  # type: ignore
+
 from hsmk.cmds.hsmk import summarize_unsigned_spend
-from hsmk.core.unsigned_spend import UnsignedSpend
+from hsmk.core.unsigned_spend import (
+    TUPLE_LABELS,
+    UnsignedSpend,
+    encoding_for_keys,
+    encoding_for_unsigned_spend,
+    keys_for_program,
+)
+from hsmk.klvm_serde.sizes import size_report_for_type
+from hsmk.process.conditions_cache import CONDITIONS_CACHE
 from hsmk.util.qrint_encoding import a2b_qrint
 
 
@@ -28,19 +38,55 @@ def hsmk_dump_us(args, parser):
     """
     Try to handle input in qrint or hex, with or without zlib compression
     """
+    if args.conditions_cache:
+        CONDITIONS_CACHE.attach(args.conditions_cache)
     blob = fromhex_or_qrint(file_or_string(args.unsigned_spend))
     try:
         blob = zlib.decompress(blob)
     except zlib.error:
         pass
-    unsigned_spend = UnsignedSpend.from_bytes(blob)
-    summarize_unsigned_spend(unsigned_spend)
+    unsigned_spend = UnsignedSpend.from_bytes(blob, lazy=True)
+    summarize_unsigned_spend(unsigned_spend, sys.stdout)
+    if args.sizes:
+        print_sizes(unsigned_spend, blob)
+
+
+def print_sizes(unsigned_spend: UnsignedSpend, blob: bytes):
+    """
+    Print the serialized size of each field, coin spend and hint, in the
+    encoding version of `blob` (but without any back-references), then the
+    totals across all coin spends and hints.
+    """
+    encoding = encoding_for_keys(keys_for_program(Program.from_bytes(blob)))
+    size_report = size_report_for_type(encoding, TUPLE_LABELS)
+    report = size_report(
+        encoding_for_unsigned_spend(encoding, unsigned_spend), "UnsignedSpend"
+    )
+    for line in report.lines(max_depth=3):
+        print(line)
+    print()
+    print(f"{'raw':>10} {'zlib':>10} {'raw %':>7}  total for")
+    totals = sorted(report.totals().items(), key=lambda _: -_[1][0])
+    for path, (raw, compressed) in totals:
+        if "[*]" in path:
+            print(f"{raw:>10} {compressed:>10} {100 * raw / report.raw:>6.1f}%  {path}")
 
 
 def create_parser():
     parser = argparse.ArgumentParser(
         description="Dump information about `UnsignedSpend`"
     )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        action="store_true",
+        help="report the serialized size of each part, raw and zlib-compressed",
+    )
+    parser.add_argument(
+        "--conditions-cache",
+        metavar="path-to-sqlite-file",
+        help="cache puzzle results in this file, so they're reused across runs",
+    )
     parser.add_argument(
         "unsigned_spend",
         metavar="hex-encoded-unsigned-spend-or-file",
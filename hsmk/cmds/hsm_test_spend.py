@@ -9,7 +9,7 @@ from chik_base.bls12_381 import BLSPublicKey
 from chik_base.core import Coin, CoinSpend
 
 from hsmk.core.signing_hints import SumHint, PathHint
-from hsmk.core.unsigned_spend import UnsignedSpend
+from hsmk.core.unsigned_spend import ENCODINGS, UnsignedSpend
 from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
     DEFAULT_HIDDEN_PUZZLE,
     puzzle_for_public_key_and_hidden_puzzle,
@@ -78,7 +78,7 @@ def hsm_test_spend(args, parser):
         [coin_spend], sum_hints, path_hints, MAINNET_AGG_SIG_ME_ADDITIONAL_DATA
     )
 
-    b = bytes(unsigned_spend)
+    b = unsigned_spend.to_bytes(backrefs=args.backrefs, version=args.encoding_version)
     if args.hex:
         print(b.hex())
     else:
@@ -94,7 +94,7 @@ def hsm_test_spend(args, parser):
             print(b2a_qrint(chunk))
 
     us = UnsignedSpend.from_bytes(b)
-    assert bytes(us) == b
+    assert us.to_bytes(backrefs=args.backrefs, version=args.encoding_version) == b
 
 
 def create_parser():
@@ -121,6 +121,20 @@ def create_parser():
         action="store_true",
         help="don't compress or chunk output",
     )
+    parser.add_argument(
+        "-b",
+        "--backrefs",
+        action="store_true",
+        help="serialize repeated subtrees as back-references",
+    )
+    parser.add_argument(
+        "-e",
+        "--encoding-version",
+        default=0,
+        choices=range(len(ENCODINGS)),
+        help="`UnsignedSpend` encoding version",
+        type=int,
+    )
     parser.add_argument(
         "public_key",
         metavar="public-key",
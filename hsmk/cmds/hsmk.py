@@ -16,8 +16,20 @@ from chik_base.util.bech32 import bech32_encode
 import segno
 
 from hsmk.consensus.conditions import conditions_by_opcode
+from hsmk.core.spend_table import SpendTable
 from hsmk.core.unsigned_spend import UnsignedSpend
-from hsmk.process.sign import conditions_for_coin_spend, sign
+from hsmk.process.conditions_cache import (
+    CONDITIONS_CACHE,
+    CostBudget,
+    CostBudgetExceeded,
+)
+from hsmk.process.parallel_sign import sign_in_parallel
+from hsmk.process.sign import conditions_for_coin_spends
+from hsmk.process.wallet_index import (
+    INDEX_FILE_SUFFIX,
+    WalletIndex,
+    load_or_build_wallet_index,
+)
 from hsmk.puzzles import conlang
 from hsmk.util.byte_chunks import ChunkAssembler
 from hsmk.util.qrint_encoding import a2b_qrint, b2a_qrint
@@ -91,17 +103,33 @@ def parse_private_key_file(args) -> List[BLSSecretExponent]:
     return secret_exponents
 
 
+def wallet_index_for_secrets(
+    args, secret_exponents: List[BLSSecretExponent], f=sys.stderr
+) -> WalletIndex:
+    if not args.index:
+        return WalletIndex.for_secrets(secret_exponents, args.gap)
+    path = args.private_key_file[0].name + INDEX_FILE_SUFFIX
+    wallet_index, is_new = load_or_build_wallet_index(path, secret_exponents, args.gap)
+    if is_new:
+        try:
+            wallet_index.save(path)
+        except OSError as ex:
+            print(f"can't save wallet index: {ex}", file=f)
+    return wallet_index
+
+
 def summarize_unsigned_spend(unsigned_spend: UnsignedSpend, f=sys.stdout):
     print(file=f)
-    for coin_spend in unsigned_spend.coin_spends:
-        xck_amount = Decimal(coin_spend.coin.amount) / XCK_PER_MOJO
-        address = address_for_puzzle_hash(coin_spend.coin.puzzle_hash)
+    table = SpendTable.for_coin_spends(unsigned_spend.coin_spends)
+    for index in range(len(table)):
+        xck_amount = Decimal(table.amount(index)) / XCK_PER_MOJO
+        address = address_for_puzzle_hash(table.puzzle_hash(index))
         print(f"COIN SPENT: {xck_amount:0.12f} xck at address {address}", file=f)
-        conditions = conditions_for_coin_spend(coin_spend)
+    if len(table) > 1:
+        summarize_spend_table(table, f)
 
     print(file=f)
-    for coin_spend in unsigned_spend.coin_spends:
-        conditions = conditions_for_coin_spend(coin_spend)
+    for conditions in conditions_for_coin_spends(unsigned_spend.coin_spends):
         conditions_lookup = conditions_by_opcode(conditions)
         for create_coin in conditions_lookup.get(conlang.CREATE_COIN, []):
             puzzle_hash = create_coin.at("rf").atom
@@ -112,6 +140,23 @@ def summarize_unsigned_spend(unsigned_spend: UnsignedSpend, f=sys.stdout):
     print(file=f)
 
 
+def summarize_spend_table(table: SpendTable, f=sys.stdout):
+    print(file=f)
+    totals = table.totals_by_puzzle_hash()
+    if len(totals) < len(table):
+        # several coins share an address, so show what each address spends
+        for puzzle_hash, amount in totals.items():
+            xck_amount = Decimal(amount) / XCK_PER_MOJO
+            address = address_for_puzzle_hash(puzzle_hash)
+            print(f"ADDRESS SPENT: {xck_amount:0.12f} xck at address {address}", file=f)
+    xck_amount = Decimal(table.total_amount()) / XCK_PER_MOJO
+    print(
+        f"TOTAL SPENT: {xck_amount:0.12f} xck in {len(table)} coins"
+        f" at {len(totals)} addresses",
+        file=f,
+    )
+
+
 def address_for_puzzle_hash(puzzle_hash: bytes32) -> str:
     return bech32_encode("xck", puzzle_hash)
 
@@ -121,16 +166,37 @@ def check_ok():
     return text.lower() == "ok"
 
 
+def print_costs(budget: CostBudget, ex: CostBudgetExceeded, f=sys.stderr):
+    print("cost of each coin spend run so far:", file=f)
+    for coin_name, cost in budget.costs.items():
+        print(f"  {coin_name.hex()}: {cost}", file=f)
+    more_than = "more than " if ex.stopped else ""
+    print(f"  {ex.coin_name.hex()}: {more_than}{ex.cost} (over budget)", file=f)
+
+
 def hsmk(args, parser):
-    wallet = parse_private_key_file(args)
     f = sys.stderr
+    if args.conditions_cache:
+        CONDITIONS_CACHE.attach(args.conditions_cache)
+    wallet = wallet_index_for_secrets(args, parse_private_key_file(args), f)
     unsigned_spend_pipeline = create_unsigned_spend_pipeline(args.nochunks, f)
     for unsigned_spend in unsigned_spend_pipeline:
+        if args.max_cost is not None:
+            # run the puzzles against the budget before anything else does
+            budget = CostBudget(args.max_cost)
+            try:
+                conditions_for_coin_spends(unsigned_spend.coin_spends, budget=budget)
+            except CostBudgetExceeded as ex:
+                print(f"rejecting signing request: {ex}", file=f)
+                print_costs(budget, ex, f)
+                continue
         if not args.yes:
             summarize_unsigned_spend(unsigned_spend, f)
             if not check_ok():
                 continue
-        signature_info = sign(unsigned_spend, wallet)
+        signature_info = sign_in_parallel(
+            unsigned_spend, wallet, args.workers or None, args.max_cost
+        )
         if signature_info:
             signature = sum(
                 [_.signature for _ in signature_info], start=BLSSignature.zero()
@@ -168,6 +234,41 @@ def create_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "-g", "--gpg-argument", help="argument to pass to gpg (besides -d).", default=""
     )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        help="sign with this many processes (0 for one per cpu)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--max-cost",
+        help="reject signing requests whose puzzles cost more than this in total",
+        type=int,
+    )
+    parser.add_argument(
+        "--conditions-cache",
+        metavar="path-to-sqlite-file",
+        help="cache puzzle results in this file, so they're reused across runs",
+    )
+    parser.add_argument(
+        "--gap",
+        help=(
+            "also index the child keys at paths [0] to [GAP - 1] of each secret, "
+            "so they're found without path hints"
+        ),
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--index",
+        help=(
+            "keep an encrypted index of the wallet's public keys next to the "
+            f"first key file (with a `{INDEX_FILE_SUFFIX}` suffix), so it's only "
+            "built once"
+        ),
+        action="store_true",
+    )
     parser.add_argument(
         # "-f",
         "private_key_file",
@@ -12,14 +12,33 @@ from hsmk.util.qrint_encoding import a2b_qrint
 
 
 def create_spend_bundle(unsigned_spend: UnsignedSpend, signatures: List[BLSSignature]):
-    extra_signatures = generate_synthetic_offset_signatures(unsigned_spend)
+    return create_spend_bundle_for_shards([unsigned_spend], signatures)
+
+
+def create_spend_bundle_for_shards(
+    unsigned_spends: List[UnsignedSpend], signatures: List[BLSSignature]
+):
+    """
+    Combine the shards of a split `UnsignedSpend` (see
+    `hsmk.process.shard.split_unsigned_spend`) and the signatures for all of
+    them, in any order, into one `SpendBundle`.
+    """
+    coin_spends = []
+    extra_signatures = []
+    for unsigned_spend in unsigned_spends:
+        coin_spends.extend(unsigned_spend.coin_spends)
+        extra_signatures.extend(generate_synthetic_offset_signatures(unsigned_spend))
+
+    coin_names = set(_.coin.name() for _ in coin_spends)
+    if len(coin_names) != len(coin_spends):
+        raise ValueError("the same coin is spent in more than one shard")
 
     # now let's try adding them all together and creating a `SpendBundle`
 
     all_signatures = signatures + [sig_info.signature for sig_info in extra_signatures]
     total_signature = sum(all_signatures, start=all_signatures[0].zero())
 
-    return SpendBundle(unsigned_spend.coin_spends, total_signature)
+    return SpendBundle(coin_spends, total_signature)
 
 
 def file_or_string(p) -> str:
@@ -32,12 +51,14 @@ def file_or_string(p) -> str:
 
 
 def hsmkmerge(args, parser):
-    blob = a2b_qrint(file_or_string(args.unsigned_spend))
-    unsigned_spend = UnsignedSpend.from_bytes(blob)
+    unsigned_spends = [
+        UnsignedSpend.from_bytes(a2b_qrint(file_or_string(_)))
+        for _ in [args.unsigned_spend] + args.shard
+    ]
     signatures = [
         BLSSignature.from_bytes(a2b_qrint(file_or_string(_))) for _ in args.signature
     ]
-    spend_bundle = create_spend_bundle(unsigned_spend, signatures)
+    spend_bundle = create_spend_bundle_for_shards(unsigned_spends, signatures)
     print(to_bytes(spend_bundle).hex())
 
 
@@ -58,6 +79,17 @@ def create_parser():
         nargs="+",
         help="qrint-encoded signature",
     )
+    parser.add_argument(
+        "-s",
+        "--shard",
+        metavar="qrint-encoded-unsigned-spend-or-file",
+        action="append",
+        default=[],
+        help=(
+            "another shard of the same `UnsignedSpend`, signed separately, as the"
+            " qrint text `hsms` takes, or a file containing it"
+        ),
+    )
     return parser
 
 
@@ -2,6 +2,9 @@ from typing import Dict, List
 
 from klvm_rs import Program  # type: ignore
 
+# the most a coin spend's puzzle may cost to run
+MAX_COST = 1 << 34
+
 
 def conditions_by_opcode(conditions: Program) -> Dict[int, List[Program]]:
     d: Dict[int, List[Program]] = {}
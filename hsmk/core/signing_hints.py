@@ -1,6 +1,9 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Sequence, Tuple, TypeVar
+
+import threading
 
 from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent
 
@@ -13,7 +16,7 @@ class SumHint(Frugal):
     synthetic_offset: BLSSecretExponent
 
     def final_public_key(self) -> BLSPublicKey:
-        return sum(self.public_keys, start=self.synthetic_offset.public_key())
+        return FINAL_PUBLIC_KEY_CACHE.final_public_keys([self])[0]
 
 
 @dataclass
@@ -22,8 +25,189 @@ class PathHint(Frugal):
     path: List[int]
 
     def public_key(self) -> BLSPublicKey:
-        return self.root_public_key.child_for_path(self.path)
+        return public_child_for_path(self.root_public_key, self.path)
 
 
 PathHints = Dict[BLSPublicKey, PathHint]
 SumHints = Dict[BLSPublicKey, SumHint]
+
+
+class FinalPublicKeyCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class FinalPublicKeyCache:
+    """
+    A bounded, thread-safe LRU cache of `SumHint` final public keys, keyed by
+    the serialized public keys and synthetic offset, so equal hints share an
+    entry however many times they're built or decoded.
+
+    Most of the cost of a final public key is the scalar multiplication for
+    `synthetic_offset.public_key()`; the additions are cheap.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def final_public_keys(self, sum_hints: List[SumHint]) -> List[BLSPublicKey]:
+        """
+        Return the final public key of each of `sum_hints`, computing all the
+        missing ones in one pass. Each distinct synthetic offset in the batch
+        is multiplied out once.
+        """
+        cache_keys: List[Tuple[Tuple[bytes, ...], bytes]] = [
+            (
+                tuple(bytes(_) for _ in sum_hint.public_keys),
+                bytes(sum_hint.synthetic_offset),
+            )
+            for sum_hint in sum_hints
+        ]
+        final_public_keys = []
+        with self.lock:
+            for cache_key in cache_keys:
+                final_public_key = self.entries.get(cache_key)
+                if final_public_key is None:
+                    self.misses += 1
+                else:
+                    self.entries.move_to_end(cache_key)
+                    self.hits += 1
+                final_public_keys.append(final_public_key)
+
+        offset_public_keys: Dict[bytes, BLSPublicKey] = {}
+        computed = {}
+        for idx, (sum_hint, cache_key) in enumerate(zip(sum_hints, cache_keys)):
+            if final_public_keys[idx] is not None:
+                continue
+            final_public_key = computed.get(cache_key)
+            if final_public_key is None:
+                offset_blob = cache_key[1]
+                offset_public_key = offset_public_keys.get(offset_blob)
+                if offset_public_key is None:
+                    offset_public_key = sum_hint.synthetic_offset.public_key()
+                    offset_public_keys[offset_blob] = offset_public_key
+                final_public_key = sum(sum_hint.public_keys, start=offset_public_key)
+                computed[cache_key] = final_public_key
+            final_public_keys[idx] = final_public_key
+
+        if computed:
+            with self.lock:
+                self.entries.update(computed)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return final_public_keys
+
+    def cache_info(self) -> FinalPublicKeyCacheInfo:
+        with self.lock:
+            return FinalPublicKeyCacheInfo(
+                self.hits, self.misses, self.maxsize, len(self.entries)
+            )
+
+    def cache_clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+FINAL_PUBLIC_KEY_CACHE = FinalPublicKeyCache()
+
+
+def final_public_keys_for_sum_hints(sum_hints: List[SumHint]) -> List[BLSPublicKey]:
+    return FINAL_PUBLIC_KEY_CACHE.final_public_keys(sum_hints)
+
+
+K = TypeVar("K", BLSPublicKey, BLSSecretExponent)
+
+
+class DerivationTrieInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class DerivationTrie:
+    """
+    A bounded, thread-safe LRU cache of unhardened child keys, public or
+    secret, for every prefix of every path derived.
+
+    The nodes of the trie are keyed by the serialized root key and a path
+    prefix, so `[1, 5, 10]` and `[1, 5, 11]` from the same root share the
+    `[1]` and `[1, 5]` nodes, and only the last step of each is derived.
+    Least recently used nodes are evicted first, and a lookup refreshes every
+    node on its path.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.nodes: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def child_for_path(self, root: K, path: Sequence[int]) -> K:
+        path = tuple(path)
+        root_blob = bytes(root)
+        key = root
+        depth = 0
+        with self.lock:
+            for prefix_size in range(len(path), 0, -1):
+                node = self.nodes.get((root_blob, path[:prefix_size]))
+                if node is not None:
+                    key = node
+                    depth = prefix_size
+                    break
+            self.hits += depth
+            self.misses += len(path) - depth
+
+        new_nodes = {}
+        for prefix_size in range(depth + 1, len(path) + 1):
+            key = key.child(path[prefix_size - 1])
+            new_nodes[prefix_size] = key
+
+        with self.lock:
+            # deepest first, so a node is always more recently used than its
+            # children, and is never evicted before them
+            for prefix_size in range(len(path), 0, -1):
+                node_key = (root_blob, path[:prefix_size])
+                if prefix_size in new_nodes:
+                    self.nodes[node_key] = new_nodes[prefix_size]
+                elif node_key not in self.nodes:
+                    continue
+                self.nodes.move_to_end(node_key)
+            while len(self.nodes) > self.maxsize:
+                self.nodes.popitem(last=False)
+        return key
+
+    def cache_info(self) -> DerivationTrieInfo:
+        with self.lock:
+            return DerivationTrieInfo(
+                self.hits, self.misses, self.maxsize, len(self.nodes)
+            )
+
+    def cache_clear(self) -> None:
+        with self.lock:
+            self.nodes.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+PUBLIC_KEY_TRIE = DerivationTrie()
+SECRET_KEY_TRIE = DerivationTrie()
+
+
+def public_child_for_path(root: BLSPublicKey, path: Sequence[int]) -> BLSPublicKey:
+    return PUBLIC_KEY_TRIE.child_for_path(root, path)
+
+
+def secret_child_for_path(
+    root: BLSSecretExponent, path: Sequence[int]
+) -> BLSSecretExponent:
+    return SECRET_KEY_TRIE.child_for_path(root, path)
@@ -0,0 +1,151 @@
+"""
+A columnar view of the coins spent by an `UnsignedSpend`, for summaries and
+checks that look at every coin at once.
+
+Parent ids, puzzle hashes and coin ids are each stored in one contiguous
+`bytes` of 32-byte entries, and amounts in an unsigned 64-bit integer array.
+Coin ids are computed once, when the table is built. If NumPy is installed,
+amounts are a NumPy array and totals and group-by queries are vectorized;
+otherwise they're an `array` and the same queries run in pure python.
+
+Consensus rejects amounts that don't fit in 64 bits, but a request can still
+carry them, and a summary must show them rather than fail. If any amount is
+negative or too big, amounts are a `list` of python ints instead, and queried
+in pure python.
+"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from chik_base.atoms import bytes32
+from chik_base.core import CoinSpend
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+
+HASH_SIZE = 32
+
+LOW_32_BITS = 0xFFFFFFFF
+
+
+class SpendTable:
+    def __init__(
+        self,
+        parent_ids: bytes,
+        puzzle_hashes: bytes,
+        coin_ids: bytes,
+        amounts,
+    ):
+        self.parent_ids = parent_ids
+        self.puzzle_hashes = puzzle_hashes
+        self.coin_ids = coin_ids
+        self.amounts = amounts
+        self._index_for_coin_id: Optional[Dict[bytes, int]] = None
+
+    @classmethod
+    def for_coin_spends(
+        cls, coin_spends: Iterable[CoinSpend], use_numpy: bool = True
+    ) -> "SpendTable":
+        parent_ids = bytearray()
+        puzzle_hashes = bytearray()
+        coin_ids = bytearray()
+        amount_list = []
+        for coin_spend in coin_spends:
+            coin = coin_spend.coin
+            parent_ids.extend(coin.parent_coin_info)
+            puzzle_hashes.extend(coin.puzzle_hash)
+            coin_ids.extend(coin.name())
+            amount_list.append(coin.amount)
+        try:
+            amounts = array("Q", amount_list)
+        except OverflowError:
+            amounts = amount_list
+        else:
+            if use_numpy and numpy is not None:
+                amounts = numpy.frombuffer(amounts, dtype=numpy.uint64)
+        return cls(bytes(parent_ids), bytes(puzzle_hashes), bytes(coin_ids), amounts)
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def parent_id(self, index: int) -> bytes32:
+        return bytes32(entry(self.parent_ids, index))
+
+    def puzzle_hash(self, index: int) -> bytes32:
+        return bytes32(entry(self.puzzle_hashes, index))
+
+    def coin_id(self, index: int) -> bytes32:
+        return bytes32(entry(self.coin_ids, index))
+
+    def amount(self, index: int) -> int:
+        return int(self.amounts[index])
+
+    def total_amount(self) -> int:
+        amounts = self.amounts
+        if isinstance(amounts, (array, list)):
+            return sum(amounts)
+        # sum the high and low 32 bits separately so 64-bit sums can't overflow
+        high = int((amounts >> 32).sum())
+        low = int((amounts & LOW_32_BITS).sum())
+        return (high << 32) + low
+
+    def totals_by_puzzle_hash(self) -> Dict[bytes32, int]:
+        """
+        Return the total amount spent from each puzzle hash (that is, each
+        address), in order of first appearance.
+        """
+        amounts = self.amounts
+        if isinstance(amounts, (array, list)) or len(amounts) == 0:
+            puzzle_hashes = self.puzzle_hashes
+            totals: Dict[bytes, int] = {}
+            for start, amount in zip(range(0, len(puzzle_hashes), HASH_SIZE), amounts):
+                puzzle_hash = puzzle_hashes[start : start + HASH_SIZE]
+                totals[puzzle_hash] = totals.get(puzzle_hash, 0) + amount
+            return {bytes32(k): v for k, v in totals.items()}
+        keys = numpy.frombuffer(self.puzzle_hashes, dtype=f"V{HASH_SIZE}")
+        _, firsts, groups = numpy.unique(keys, return_index=True, return_inverse=True)
+        group_count = len(firsts)
+        high = numpy.zeros(group_count, dtype=numpy.uint64)
+        low = numpy.zeros(group_count, dtype=numpy.uint64)
+        numpy.add.at(high, groups, amounts >> 32)
+        numpy.add.at(low, groups, amounts & LOW_32_BITS)
+        return {
+            self.puzzle_hash(int(firsts[group])): (int(high[group]) << 32)
+            + int(low[group])
+            for group in numpy.argsort(firsts)
+        }
+
+    def index_for_coin_id(self, coin_id: bytes) -> Optional[int]:
+        if self._index_for_coin_id is None:
+            self._index_for_coin_id = {
+                entry(self.coin_ids, index): index for index in range(len(self))
+            }
+        return self._index_for_coin_id.get(bytes(coin_id))
+
+    def __contains__(self, coin_id: bytes) -> bool:
+        return self.index_for_coin_id(coin_id) is not None
+
+    def indices_for_puzzle_hash(self, puzzle_hash: bytes) -> List[int]:
+        puzzle_hashes = self.puzzle_hashes
+        indices: List[int] = []
+        if len(puzzle_hash) != HASH_SIZE:
+            return indices
+        start = puzzle_hashes.find(puzzle_hash)
+        while start >= 0:
+            # only matches aligned to an entry count
+            if start % HASH_SIZE == 0:
+                indices.append(start // HASH_SIZE)
+                start = puzzle_hashes.find(puzzle_hash, start + HASH_SIZE)
+            else:
+                start = puzzle_hashes.find(puzzle_hash, start + 1)
+        return indices
+
+
+def entry(blob: bytes, index: int) -> bytes:
+    if not 0 <= index < len(blob) // HASH_SIZE:
+        raise IndexError(index)
+    start = index * HASH_SIZE
+    return blob[start : start + HASH_SIZE]
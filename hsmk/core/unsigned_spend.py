@@ -1,15 +1,38 @@
-from dataclasses import dataclass, field
-from typing import List, Tuple
+from collections import Counter
+from dataclasses import dataclass, field, fields
+from itertools import chain
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from chik_base.bls12_381 import BLSPublicKey, BLSSignature
+from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent, BLSSignature
 from chik_base.core import Coin, CoinSpend
 
 from klvm_rs import Program  # type: ignore
+from klvm_rs.serde import klvm_tree_to_lazy_node, ser_backrefs  # type: ignore
 
+from hsmk.klvm.tree_hash import tree_hash
 from hsmk.klvm_serde import (
+    EncodingError,
     to_program_for_type,
     from_program_for_type,
 )
+from hsmk.klvm_serde.iterative import default_for_field
+from hsmk.klvm_serde.lazy import lazy_from_program_for_type
+from hsmk.klvm_serde.stream import (
+    CONS_BOX,
+    CONS_BOX_MARKER,
+    NULL,
+    BackReferenceError,
+    BufferReader,
+    FileReader,
+    Reader,
+    expect_cons_box,
+    from_stream_for_type,
+    read_keys,
+    reader_for_source,
+    to_stream_for_type,
+    write_atom,
+    write_for_sink,
+)
 from .signing_hints import PathHint, SumHint
 
 
@@ -25,7 +48,7 @@ def to_storage(
     coin_spend_tuples: SerdeCoinSpends,
 ) -> List[CoinSpend]:
     return [
-        CoinSpend(Coin(_[0], _[1].tree_hash(), _[2]), _[1], _[3])
+        CoinSpend(Coin(_[0], tree_hash(_[1]), _[2]), _[1], _[3])
         for _ in coin_spend_tuples
     ]
 
@@ -44,6 +67,256 @@ def from_storage(
     ]
 
 
+# `ModTableCoinSpends` stores each distinct mod once. Each coin spend refers to
+# its mod by index, along with the arguments curried into it (or `None` if the
+# puzzle isn't curried, in which case the mod is the whole puzzle). Each mod
+# is only tree hashed once on decode.
+
+ModCSTuple = Tuple[bytes, int, Optional[List[Program]], int, Program]
+ModTableCoinSpends = Tuple[List[Program], List[ModCSTuple]]
+
+
+def mod_table_to_storage(
+    mod_table_coin_spends: ModTableCoinSpends,
+) -> List[CoinSpend]:
+    mods, coin_spend_tuples = mod_table_coin_spends
+    coin_spends = []
+    for parent_coin_info, mod_index, args, amount, solution in coin_spend_tuples:
+        if not 0 <= mod_index < len(mods):
+            raise EncodingError(f"bad mod index {mod_index}")
+        mod = mods[mod_index]
+        if args is None:
+            puzzle = mod
+            puzzle_hash = tree_hash(mod)
+        else:
+            # `mod` caches its own tree hash, so only the arguments are hashed
+            puzzle = mod.curry(*args)
+            puzzle_hash = mod.curry_hash(*[_.tree_hash() for _ in args])
+        coin = Coin(parent_coin_info, puzzle_hash, amount)
+        coin_spends.append(CoinSpend(coin, puzzle, solution))
+    return coin_spends
+
+
+def mod_table_from_storage(
+    coin_spends: List[CoinSpend],
+) -> ModTableCoinSpends:
+    mods: List[Program] = []
+    index_for_mod: Dict[bytes, int] = {}
+    coin_spend_tuples: List[ModCSTuple] = []
+    for coin_spend in coin_spends:
+        puzzle = coin_spend.puzzle_reveal
+        mod, args = puzzle.uncurry()
+        if args is not None and bytes(mod.curry(*args)) != bytes(puzzle):
+            # not in canonical curried form, so it can't be rebuilt exactly
+            mod, args = puzzle, None
+        mod_blob = bytes(mod)
+        mod_index = index_for_mod.get(mod_blob)
+        if mod_index is None:
+            mod_index = len(mods)
+            index_for_mod[mod_blob] = mod_index
+            mods.append(mod)
+        coin_spend_tuples.append(
+            (
+                coin_spend.coin.parent_coin_info,
+                mod_index,
+                args,
+                coin_spend.coin.amount,
+                coin_spend.solution,
+            )
+        )
+    return mods, coin_spend_tuples
+
+
+# `CompactCoinSpends` adds a table of parent coin ids to `ModTableCoinSpends`,
+# as coins created by the same transaction share a parent. A table entry costs
+# as much as the parent itself, so only parents of more than one coin spend go
+# in it. Each coin spend stores its parent as the 32-byte id if it's the only
+# coin spend with that parent, or as its index in the table, packed into
+# minimal big-endian bytes, if not. Its amount is stored with `compact_amount`.
+
+CompactCSTuple = Tuple[bytes, int, Optional[List[Program]], bytes, Program]
+CompactCoinSpends = Tuple[List[bytes], List[Program], List[CompactCSTuple]]
+
+PARENT_SIZE = 32
+
+# amounts are stored as `m * 10 ** e` with `e` in the low four bits
+MAX_AMOUNT_EXPONENT = 15
+
+
+def compact_amount(amount: int) -> bytes:
+    """
+    Amounts are often round numbers. Store `amount` as `m * 10 ** e`, for the
+    largest `e` up to 15, packed into the unsigned integer `m << 4 | e` as
+    minimal big-endian bytes. Unlike a klvm integer, there's never a leading
+    zero byte to keep it positive.
+    """
+    if amount < 0:
+        raise EncodingError(f"negative amount {amount}")
+    exponent = 0
+    while amount and amount % 10 == 0 and exponent < MAX_AMOUNT_EXPONENT:
+        amount //= 10
+        exponent += 1
+    packed = amount << 4 | exponent
+    return packed.to_bytes((packed.bit_length() + 7) // 8, "big")
+
+
+def amount_for_compact_amount(blob: bytes) -> int:
+    packed = int.from_bytes(blob, "big")
+    return (packed >> 4) * 10 ** (packed & 0xF)
+
+
+def compact_to_storage(
+    compact_coin_spends: CompactCoinSpends,
+) -> List[CoinSpend]:
+    parents, mods, coin_spend_tuples = compact_coin_spends
+    mod_coin_spend_tuples: List[ModCSTuple] = []
+    for parent, mod_index, args, amount, solution in coin_spend_tuples:
+        if len(parent) != PARENT_SIZE:
+            parent_index = int.from_bytes(parent, "big")
+            if parent_index >= len(parents):
+                raise EncodingError(f"bad parent index {parent_index}")
+            parent = parents[parent_index]
+        mod_coin_spend_tuples.append(
+            (
+                parent,
+                mod_index,
+                args,
+                amount_for_compact_amount(amount),
+                solution,
+            )
+        )
+    return mod_table_to_storage((mods, mod_coin_spend_tuples))
+
+
+def compact_from_storage(
+    coin_spends: List[CoinSpend],
+) -> CompactCoinSpends:
+    mods, mod_coin_spend_tuples = mod_table_from_storage(coin_spends)
+    parent_counts = Counter(_[0] for _ in mod_coin_spend_tuples)
+    parents: List[bytes] = []
+    index_for_parent: Dict[bytes, int] = {}
+    coin_spend_tuples: List[CompactCSTuple] = []
+    for parent_coin_info, mod_index, args, amount, solution in mod_coin_spend_tuples:
+        parent = parent_coin_info
+        if parent_counts[parent_coin_info] > 1:
+            parent_index = index_for_parent.get(parent_coin_info)
+            if parent_index is None:
+                parent_index = len(parents)
+                index_for_parent[parent_coin_info] = parent_index
+                parents.append(parent_coin_info)
+            parent = parent_index.to_bytes((parent_index.bit_length() + 7) // 8, "big")
+        coin_spend_tuples.append(
+            (parent, mod_index, args, compact_amount(amount), solution)
+        )
+    return parents, mods, coin_spend_tuples
+
+
+# `CompactHints` stores the sum hints and path hints together, so the public
+# keys in sum hints can refer to the path hints that derive them. It's
+# `(keys, path_hints, sum_hints)`:
+#
+# - `keys` is a table of public keys: the root public keys of the path hints,
+#   and any keys in sum hints that aren't derived by a path hint
+# - each path hint is the index of its root public key in `keys`, the number
+#   of leading indices its path shares with the path hint before it, and the
+#   rest of its path
+# - each sum hint is a list of key indices and the synthetic offset. Index
+#   `i` is the key derived by path hint `i` if there are more than `i` path
+#   hints, and otherwise `keys[i - len(path_hints)]`
+
+CompactPathHint = Tuple[int, int, List[int]]
+CompactSumHint = Tuple[List[int], BLSSecretExponent]
+CompactHints = Tuple[List[BLSPublicKey], List[CompactPathHint], List[CompactSumHint]]
+
+
+def compact_hints_to_storage(
+    compact_hints: CompactHints,
+) -> Tuple[List[SumHint], List[PathHint]]:
+    keys, compact_path_hints, compact_sum_hints = compact_hints
+    path_hints = []
+    path: List[int] = []
+    for key_index, prefix_size, rest in compact_path_hints:
+        if not 0 <= key_index < len(keys):
+            raise EncodingError(f"bad key index {key_index}")
+        if not 0 <= prefix_size <= len(path):
+            raise EncodingError(f"bad path prefix size {prefix_size}")
+        path = path[:prefix_size] + rest
+        path_hints.append(PathHint(keys[key_index], path))
+    # each derivation is an EC operation, so only derive the keys that sum
+    # hints refer to
+    derived_keys: Dict[int, BLSPublicKey] = {}
+
+    def key_for_index(key_index: int) -> BLSPublicKey:
+        if not 0 <= key_index < len(path_hints) + len(keys):
+            raise EncodingError(f"bad key index {key_index}")
+        if key_index >= len(path_hints):
+            return keys[key_index - len(path_hints)]
+        key = derived_keys.get(key_index)
+        if key is None:
+            key = path_hints[key_index].public_key()
+            derived_keys[key_index] = key
+        return key
+
+    sum_hints = []
+    for key_indices, synthetic_offset in compact_sum_hints:
+        public_keys = [key_for_index(_) for _ in key_indices]
+        sum_hints.append(SumHint(public_keys, synthetic_offset))
+    return sum_hints, path_hints
+
+
+def compact_hints_from_storage(
+    hints: Tuple[List[SumHint], List[PathHint]],
+) -> CompactHints:
+    sum_hints, path_hints = hints
+    keys: List[BLSPublicKey] = []
+    index_for_key: Dict[bytes, int] = {}
+
+    def key_index_for_key(key: BLSPublicKey) -> int:
+        blob = bytes(key)
+        key_index = index_for_key.get(blob)
+        if key_index is None:
+            key_index = len(keys)
+            index_for_key[blob] = key_index
+            keys.append(key)
+        return key_index
+
+    compact_path_hints: List[CompactPathHint] = []
+    index_for_derived_key: Dict[bytes, int] = {}
+    path: List[int] = []
+    for path_hint_index, path_hint in enumerate(path_hints):
+        prefix_size = 0
+        max_prefix_size = min(len(path), len(path_hint.path))
+        while (
+            prefix_size < max_prefix_size
+            and path[prefix_size] == path_hint.path[prefix_size]
+        ):
+            prefix_size += 1
+        path = path_hint.path
+        compact_path_hints.append(
+            (
+                key_index_for_key(path_hint.root_public_key),
+                prefix_size,
+                path[prefix_size:],
+            )
+        )
+        index_for_derived_key.setdefault(bytes(path_hint.public_key()), path_hint_index)
+
+    def index_for_sum_hint_key(key: BLSPublicKey) -> int:
+        derived_index = index_for_derived_key.get(bytes(key))
+        if derived_index is not None:
+            return derived_index
+        return len(path_hints) + key_index_for_key(key)
+
+    compact_sum_hints: List[CompactSumHint] = [
+        (
+            [index_for_sum_hint_key(_) for _ in sum_hint.public_keys],
+            sum_hint.synthetic_offset,
+        )
+        for sum_hint in sum_hints
+    ]
+    return keys, compact_path_hints, compact_sum_hints
+
+
 @dataclass
 class SignatureInfo:
     signature: BLSSignature
@@ -78,12 +351,326 @@ class UnsignedSpend:
     )
 
     def __bytes__(self):
-        return bytes(TO_PROGRAM(self))
+        b = bytearray()
+        TO_STREAM(self, b.extend)
+        return bytes(b)
+
+    def to_bytes(self, backrefs: bool = False, version: int = 0) -> bytes:
+        """
+        With `backrefs`, repeated subtrees (like the standard puzzle mod shared
+        by every puzzle reveal) are serialized once and then referred back to.
+
+        `version` picks an entry in `ENCODINGS`. Version 0 is understood by
+        every release; later ones are more compact.
+
+        `from_bytes` accepts any of these, but `parse` only the plain
+        version 0 form.
+        """
+        encoding = ENCODINGS[version]
+        value = encoding_for_unsigned_spend(encoding, self)
+        if backrefs:
+            p = to_program_for_type(encoding)(value)
+            return ser_backrefs(klvm_tree_to_lazy_node(p))
+        if version == 0:
+            return bytes(self)
+        b = bytearray()
+        to_stream_for_type(encoding)(value, b.extend)
+        return bytes(b)
+
+    def stream(self, f: BinaryIO) -> None:
+        TO_STREAM(self, write_for_sink(f))
+
+    @classmethod
+    def parse(cls, f: BinaryIO):
+        return FROM_STREAM(FileReader(f))
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, lazy: bool = False):
+        """
+        With `lazy`, fields and individual coin spends and hints are only
+        deserialized when first accessed.
+        """
+        if lazy:
+            p = Program.from_bytes(blob)
+            encoding = encoding_for_keys(keys_for_program(p))
+            return unsigned_spend_for_encoding(lazy_from_program_for_type(encoding)(p))
+        try:
+            try:
+                return FROM_STREAM(BufferReader(blob))
+            except EncodingError:
+                # maybe a later version
+                encoding = encoding_for_keys(read_keys(BufferReader(blob)))
+                if encoding is cls:
+                    raise
+            return unsigned_spend_for_encoding(
+                from_stream_for_type(encoding)(BufferReader(blob))
+            )
+        except BackReferenceError:
+            p = Program.from_bytes(blob)
+            encoding = encoding_for_keys(keys_for_program(p))
+            return unsigned_spend_for_encoding(from_program_for_type(encoding)(p))
+
+
+@dataclass
+class ModTableUnsignedSpend(UnsignedSpend):
+    """
+    Version 1 wire schema: coin spends are stored with a table of mods.
+    """
+
+    coin_spends: List[CoinSpend] = field(
+        metadata=dict(
+            key="m",
+            alt_serde_type=(
+                ModTableCoinSpends,
+                mod_table_from_storage,
+                mod_table_to_storage,
+            ),
+        ),
+    )
+
+
+@dataclass
+class CompactUnsignedSpend(UnsignedSpend):
+    """
+    Version 2 wire schema: coin spends are stored with a table of repeated
+    parent coin ids and a table of mods, with compact amounts.
+    """
+
+    coin_spends: List[CoinSpend] = field(
+        metadata=dict(
+            key="t",
+            alt_serde_type=(
+                CompactCoinSpends,
+                compact_from_storage,
+                compact_to_storage,
+            ),
+        ),
+    )
+
+
+@dataclass
+class CompactHintsUnsignedSpend:
+    """
+    Version 3 wire schema: coin spends are stored like version 2, and the sum
+    hints and path hints are stored together as `CompactHints`.
+
+    As the hints are one field here, this isn't an `UnsignedSpend` subclass;
+    convert with `from_unsigned_spend` and `unsigned_spend`.
+    """
+
+    coin_spends: List[CoinSpend] = field(
+        metadata=dict(
+            key="h",
+            alt_serde_type=(
+                CompactCoinSpends,
+                compact_from_storage,
+                compact_to_storage,
+            ),
+        ),
+    )
+    hints: Tuple[List[SumHint], List[PathHint]] = field(
+        default_factory=lambda: ([], []),
+        metadata=dict(
+            key="i",
+            alt_serde_type=(
+                CompactHints,
+                compact_hints_from_storage,
+                compact_hints_to_storage,
+            ),
+        ),
+    )
+    agg_sig_me_network_suffix: bytes = field(
+        default=b"",
+        metadata=dict(key="a"),
+    )
 
     @classmethod
-    def from_bytes(cls, blob: bytes):
-        return FROM_PROGRAM(Program.from_bytes(blob))
+    def from_unsigned_spend(cls, unsigned_spend: UnsignedSpend):
+        return cls(
+            unsigned_spend.coin_spends,
+            (unsigned_spend.sum_hints, unsigned_spend.path_hints),
+            unsigned_spend.agg_sig_me_network_suffix,
+        )
+
+    def unsigned_spend(self) -> UnsignedSpend:
+        sum_hints, path_hints = self.hints
+        return UnsignedSpend(
+            self.coin_spends, sum_hints, path_hints, self.agg_sig_me_network_suffix
+        )
+
+
+# Each version is identified by the key its coin spends are stored under.
+
+ENCODINGS: List[type] = [
+    UnsignedSpend,
+    ModTableUnsignedSpend,
+    CompactUnsignedSpend,
+    CompactHintsUnsignedSpend,
+]
+
+ENCODING_FOR_KEY: Dict[bytes, type] = {
+    fields(_)[0].metadata["key"].encode(): _ for _ in ENCODINGS
+}
+
+
+def keys_for_program(p: Program) -> List[bytes]:
+    return [_.pair[0].atom for _ in p.as_iter() if _.pair is not None]
+
+
+def encoding_for_keys(keys: List[bytes]) -> type:
+    for key in keys:
+        encoding = ENCODING_FOR_KEY.get(key)
+        if encoding is not None:
+            return encoding
+    return UnsignedSpend
+
+
+# names for the items of the tuples in `ENCODINGS`, for size reports
+
+TUPLE_LABELS: Dict[Any, Tuple[str, ...]] = {
+    CSTuple: ("parent_coin_info", "puzzle_reveal", "amount", "solution"),
+    ModCSTuple: ("parent_coin_info", "mod_index", "curried_args", "amount", "solution"),
+    ModTableCoinSpends: ("mods", "coin_spends"),
+    CompactCSTuple: ("parent", "mod_index", "curried_args", "amount", "solution"),
+    CompactCoinSpends: ("parents", "mods", "coin_spends"),
+    CompactPathHint: ("key_index", "prefix_size", "rest_of_path"),
+    CompactSumHint: ("key_indices", "synthetic_offset"),
+    CompactHints: ("keys", "path_hints", "sum_hints"),
+}
+
+
+def encoding_for_unsigned_spend(encoding: type, unsigned_spend: UnsignedSpend) -> Any:
+    """
+    Return `unsigned_spend` in a form the serializers for `encoding` accept.
+    """
+    if issubclass(encoding, UnsignedSpend):
+        return unsigned_spend
+    return encoding.from_unsigned_spend(unsigned_spend)  # type: ignore
+
+
+def unsigned_spend_for_encoding(obj: Any) -> UnsignedSpend:
+    if isinstance(obj, CompactHintsUnsignedSpend):
+        return obj.unsigned_spend()
+    if isinstance(obj, tuple(ENCODINGS[1:])):
+        return UnsignedSpend(*[getattr(obj, _.name) for _ in fields(UnsignedSpend)])
+    return obj
 
 
 TO_PROGRAM = to_program_for_type(UnsignedSpend)
 FROM_PROGRAM = from_program_for_type(UnsignedSpend)
+TO_STREAM = to_stream_for_type(UnsignedSpend)
+FROM_STREAM = from_stream_for_type(UnsignedSpend)
+LAZY_FROM_PROGRAM = lazy_from_program_for_type(UnsignedSpend)
+
+
+# A streamed `UnsignedSpend` is an ordinary version 0 `UnsignedSpend` with its
+# coin spends stored after the other fields, so the hints and network suffix
+# can be read first and the coin spends one at a time after that.
+# `UnsignedSpend.from_bytes` reads it like any other.
+
+COIN_SPENDS_KEY = fields(UnsignedSpend)[0].metadata["key"].encode()
+
+HEADER_FIELDS = [
+    (
+        f.metadata["key"].encode(),
+        f.name,
+        default_for_field(f),
+        to_stream_for_type(f.type),
+        from_stream_for_type(f.type),
+    )
+    for f in fields(UnsignedSpend)[1:]
+]
+
+HEADER_FIELD_FOR_KEY = {_[0]: _ for _ in HEADER_FIELDS}
+
+TO_STREAM_CS_TUPLE = to_stream_for_type(CSTuple)
+FROM_STREAM_CS_TUPLE = from_stream_for_type(CSTuple)
+
+
+def stream_unsigned_spend(
+    header: UnsignedSpend, coin_spends: Iterable[CoinSpend], f: BinaryIO
+) -> None:
+    """
+    Write `header` with its coin spends followed by those of `coin_spends`,
+    which are written as they're iterated, so they can come from a generator.
+    """
+    write = write_for_sink(f)
+    for key, name, default_value, to_stream, _from_stream in HEADER_FIELDS:
+        value = getattr(header, name)
+        if value == default_value:
+            continue
+        write(CONS_BOX + CONS_BOX)
+        write_atom(key, write)
+        to_stream(value, write)
+    write(CONS_BOX + CONS_BOX)
+    write_atom(COIN_SPENDS_KEY, write)
+    for coin_spend in chain(header.coin_spends, coin_spends):
+        write(CONS_BOX)
+        TO_STREAM_CS_TUPLE(from_storage([coin_spend])[0], write)
+    write(NULL)
+    write(NULL)
+
+
+def iter_unsigned_spend(source) -> Tuple[UnsignedSpend, Iterator[CoinSpend]]:
+    """
+    Read a streamed `UnsignedSpend` from `source` (a buffer, a binary file or a
+    `Reader`), returning a header with every field but the coin spends, and
+    a generator of the coin spends, which are read as it's iterated.
+
+    A buffer can hold any version 0 `UnsignedSpend`. A file has to hold one
+    written by `stream_unsigned_spend`, as the hints can't be read ahead of
+    coin spends that come before them.
+    """
+    reader = reader_for_source(source)
+    kwargs: Dict[str, Any] = {}
+    while reader.peek_byte() == CONS_BOX_MARKER:
+        reader.read_byte()
+        expect_cons_box(reader)
+        key = reader.read_atom()
+        if key == COIN_SPENDS_KEY:
+            break
+        read_header_value(reader, key, kwargs)
+    else:
+        reader.read_atom()
+        return UnsignedSpend([], **kwargs), iter(())
+
+    is_buffer = isinstance(reader, BufferReader)
+    if is_buffer:
+        # read the fields after the coin spends first, then come back
+        cursor = reader.cursor
+        reader.skip()
+        read_header_values(reader, kwargs)
+        reader = BufferReader(reader.buffer, cursor)
+
+    def coin_spends() -> Iterator[CoinSpend]:
+        while reader.peek_byte() == CONS_BOX_MARKER:
+            reader.read_byte()
+            yield to_storage([FROM_STREAM_CS_TUPLE(reader)])[0]
+        reader.read_atom()
+        if not is_buffer and read_header_values(reader, {}):
+            raise EncodingError("hints must come before coin spends to stream")
+
+    return UnsignedSpend([], **kwargs), coin_spends()
+
+
+def read_header_value(reader: Reader, key: bytes, kwargs: Dict[str, Any]) -> None:
+    if key == COIN_SPENDS_KEY:
+        raise EncodingError(f"repeated key {key!r}")
+    header_field = HEADER_FIELD_FOR_KEY.get(key)
+    if header_field is None:
+        reader.skip()
+        return
+    _key, name, _default_value, _to_stream, from_stream = header_field
+    kwargs[name] = from_stream(reader)
+
+
+def read_header_values(reader: Reader, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Read the rest of a list of `(key . value)` pairs into `kwargs`.
+    """
+    while reader.peek_byte() == CONS_BOX_MARKER:
+        reader.read_byte()
+        expect_cons_box(reader)
+        read_header_value(reader, reader.read_atom(), kwargs)
+    reader.read_atom()
+    return kwargs
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional, Tuple
 
 from chik_base.core import Coin
 from chik_base.util.std_hash import std_hash
@@ -6,8 +6,11 @@ from chik_base.util.std_hash import std_hash
 from klvm_rs import Program  # type: ignore
 
 from hsmk.klvm.disasm import disassemble as bu_disassemble, KEYWORD_FROM_ATOM
+from hsmk.klvm.tree_hash import tree_hash
+from hsmk.klvm_serde.stream import program_for_blob
 from hsmk.consensus.conditions import conditions_by_opcode
-from hsmk.process.sign import generate_verify_pairs
+from hsmk.process.conditions_cache import CostBudget, run_puzzle_for_blob
+from hsmk.process.sign import generate_verify_pairs, run_with_budget
 from hsmk.puzzles import conlang
 
 KFA = {bytes([getattr(conlang, k)]): k for k in dir(conlang) if k[0] in "ACR"}
@@ -16,8 +19,6 @@ AGG_SIG_ME_ADDITIONAL_DATA = bytes.fromhex(
     "ccd5bb71183532bff220ba46c268991a3ff07eb358e8255a65c30a2dce0e5fbb"
 )
 
-MAX_COST = 1 << 34
-
 
 # information needed to spend a cc
 # if we ever support more genesis conditions, like a re-issuable coin,
@@ -46,12 +47,18 @@ def dump_coin(coin: Coin) -> str:
 
 
 def debug_spend_bundle(
-    spend_bundle, agg_sig_additional_data=AGG_SIG_ME_ADDITIONAL_DATA
+    spend_bundle,
+    agg_sig_additional_data=AGG_SIG_ME_ADDITIONAL_DATA,
+    max_cost: Optional[int] = None,
 ) -> None:
     """
     Print a lot of useful information about a `SpendBundle` that might help with
     debugging its klvm.
+
+    With `max_cost`, the puzzles may cost at most that in total, and
+    `CostBudgetExceeded` is raised as soon as they cost more.
     """
+    budget = None if max_cost is None else CostBudget(max_cost)
 
     pks = []
     msgs = []
@@ -64,16 +71,14 @@ def debug_spend_bundle(
     print("=" * 80)
     for coin_spend in spend_bundle.coin_spends:
         coin = coin_spend.coin
-        puzzle_reveal = Program.from_bytes(bytes(coin_spend.puzzle_reveal))
+        puzzle_reveal = program_for_blob(bytes(coin_spend.puzzle_reveal))
         solution = Program.from_bytes(bytes(coin_spend.solution))
         coin_name = coin.name()
+        puzzle_hash = tree_hash(puzzle_reveal)
 
-        if puzzle_reveal.tree_hash() != coin_spend.coin.puzzle_hash:
+        if puzzle_hash != coin_spend.coin.puzzle_hash:
             print("*** BAD PUZZLE REVEAL")
-            print(
-                f"{puzzle_reveal.tree_hash().hex()} vs"
-                f" {coin_spend.coin.puzzle_hash.hex()}"
-            )
+            print(f"{puzzle_hash.hex()} vs {coin_spend.coin.puzzle_hash.hex()}")
             print("*" * 80)
             continue
 
@@ -84,7 +89,12 @@ def debug_spend_bundle(
             f"\nbrun -y main.sym '{bu_disassemble(puzzle_reveal)}'"
             f" '{bu_disassemble(solution)}'"
         )
-        cost, r = puzzle_reveal.run_with_cost(solution, max_cost=MAX_COST)
+
+        def run(max_cost: int) -> Tuple[int, bytes]:
+            return run_puzzle_for_blob(puzzle_reveal, solution, max_cost)
+
+        cost, blob = run_with_budget(coin_name, run, budget)
+        r = program_for_blob(blob)
         conditions = conditions_by_opcode(r)
         error = None
         if error:
@@ -116,7 +126,7 @@ def debug_spend_bundle(
                     ]
                 )
                 created_puzzle_announcements.extend(
-                    [puzzle_reveal.tree_hash()] + _.vars
+                    [puzzle_hash] + _.vars
                     for _ in conditions.get(conlang.CREATE_PUZZLE_ANNOUNCEMENT, [])
                 )
                 asserted_puzzle_announcements.extend(
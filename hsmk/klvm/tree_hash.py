@@ -0,0 +1,226 @@
+"""
+A content-addressed cache of klvm tree hashes.
+
+Puzzle reveals are mostly the same few mods with different arguments curried
+in, so hashing every reveal from scratch hashes the same subtrees over and
+over. `TreeHashCache` hashes serialized klvm directly, remembering the hash of
+each whole blob and, if the blob is a curried puzzle, of its mod, keyed by
+their serializations. When a later blob is, or curries, the same bytes, that
+tree is skipped and its hash reused, so a shared mod is hashed once per
+process rather than once per coin. Other subtrees are never cached, as they
+are rarely seen twice and caching each would copy every suffix of a list.
+
+Entries are bucketed by the first `PREFIX_SIZE` bytes of their serialization,
+so a lookup is a dictionary lookup and a few `startswith` comparisons. Memory
+is bounded by both `maxsize` entries and `max_bytes` bytes of serialization,
+evicted least recently used first. Blobs over `max_blob_size` bytes, which
+are request data rather than puzzles, skip the cache and are hashed natively.
+"""
+
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import threading
+
+from klvm_rs import Program  # type: ignore
+from klvm_rs.curry_and_treehash import shatree_atom, shatree_pair  # type: ignore
+
+from hsmk.klvm_serde import EncodingError
+from hsmk.klvm_serde.stream import (
+    BACK_REFERENCE_MARKER,
+    CONS_BOX_MARKER,
+    MAX_SINGLE_BYTE,
+    BackReferenceError,
+    atom_size_for_blob,
+)
+
+PREFIX_SIZE = 32
+
+# how many subtrees with the same prefix are remembered
+BUCKET_SIZE = 8
+
+# a curried puzzle is `(a (q . mod) args)`, so its mod starts after this
+CURRIED_PREFIX = bytes.fromhex("ff02ffff01")
+
+
+class TreeHashCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class TreeHashCache:
+    """
+    A bounded, thread-safe LRU cache of the tree hashes of serialized puzzles
+    and curried mods at least `min_size` bytes long.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        min_size: int = 64,
+        max_bytes: int = 1 << 22,
+        max_blob_size: int = 1 << 16,
+    ):
+        self.maxsize = maxsize
+        self.min_size = max(min_size, PREFIX_SIZE)
+        self.max_bytes = max_bytes
+        self.max_blob_size = max_blob_size
+        self.lock = threading.Lock()
+        self.buckets: OrderedDict = OrderedDict()
+        self.currsize = 0
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, blob: bytes, cursor: int) -> Optional[Tuple[bytes, int]]:
+        prefix = blob[cursor : cursor + PREFIX_SIZE]
+        with self.lock:
+            bucket = self.buckets.get(prefix)
+            if bucket is None:
+                return None
+            for idx, (serialized, tree_hash) in enumerate(bucket):
+                if blob.startswith(serialized, cursor):
+                    self.buckets.move_to_end(prefix)
+                    if idx:
+                        bucket.insert(0, bucket.pop(idx))
+                    self.hits += 1
+                    return tree_hash, len(serialized)
+        return None
+
+    def add(self, serialized: bytes, tree_hash: bytes) -> None:
+        prefix = serialized[:PREFIX_SIZE]
+        with self.lock:
+            self.misses += 1
+            bucket: List[Tuple[bytes, bytes]] = self.buckets.setdefault(prefix, [])
+            self.buckets.move_to_end(prefix)
+            bucket.insert(0, (serialized, tree_hash))
+            self.currsize += 1
+            self.currbytes += len(serialized)
+            if len(bucket) > BUCKET_SIZE:
+                self.currsize -= 1
+                self.currbytes -= len(bucket.pop()[0])
+            while self.currsize > self.maxsize or self.currbytes > self.max_bytes:
+                _, evicted = self.buckets.popitem(last=False)
+                self.currsize -= len(evicted)
+                self.currbytes -= sum(len(_[0]) for _ in evicted)
+
+    def tree_hash_for_blob(self, blob: bytes) -> bytes:
+        """
+        Return the tree hash of the tree serialized at the start of `blob`.
+        Trailing bytes are ignored, like `Program.from_bytes`.
+        """
+        blob = bytes(blob)
+        blob_size = len(blob)
+        if blob_size > self.max_blob_size:
+            return Program.from_bytes(blob).tree_hash()
+        min_size = self.min_size
+        # the only offsets looked up and cached: the whole blob, and the mod
+        # if it's curried
+        boundaries: Tuple[int, ...] = (0,)
+        if blob.startswith(CURRIED_PREFIX):
+            boundaries = (0, len(CURRIED_PREFIX))
+        hash_stack: List[bytes] = []
+        # offsets of pairs still being hashed, and whether their first child
+        # is done
+        open_pairs: List[int] = []
+        firsts_done: List[bool] = []
+        cursor = 0
+        while True:
+            if cursor >= blob_size:
+                raise EncodingError("bad encoding")
+            b = blob[cursor]
+            if b == CONS_BOX_MARKER:
+                cached = None
+                if cursor in boundaries:
+                    cached = self.lookup(blob, cursor)
+                if cached is None:
+                    open_pairs.append(cursor)
+                    firsts_done.append(False)
+                    cursor += 1
+                    continue
+                tree_hash, size = cached
+                cursor += size
+            elif b == BACK_REFERENCE_MARKER:
+                raise BackReferenceError("back references aren't supported")
+            else:
+                cursor += 1
+                if b <= MAX_SINGLE_BYTE:
+                    atom = blob[cursor - 1 : cursor]
+                elif b == 0x80:
+                    atom = b""
+                else:
+                    size, cursor = atom_size_for_blob(blob, cursor, b)
+                    atom = blob[cursor : cursor + size]
+                    cursor += size
+                    if cursor > blob_size:
+                        raise EncodingError("bad encoding")
+                tree_hash = shatree_atom(atom)
+            hash_stack.append(tree_hash)
+
+            # complete any pairs that were only waiting on this node
+            while open_pairs:
+                if not firsts_done[-1]:
+                    firsts_done[-1] = True
+                    break
+                start = open_pairs.pop()
+                firsts_done.pop()
+                rest = hash_stack.pop()
+                first = hash_stack.pop()
+                tree_hash = shatree_pair(first, rest)
+                hash_stack.append(tree_hash)
+                if start in boundaries and cursor - start >= min_size:
+                    self.add(blob[start:cursor], tree_hash)
+            if not open_pairs:
+                return hash_stack[0]
+
+    def tree_hash(self, program: Program) -> bytes:
+        """
+        Return the tree hash of `program`, remembering it on the `Program`.
+
+        A `Program` with a known serialization (see `program_for_blob`) no
+        larger than `max_blob_size` is hashed through the cache; any other is
+        hashed with `tree_hash` as usual, as serializing it first would cost
+        more than it saves.
+
+        Only pass puzzles here. Solutions are rarely seen twice, so hash them
+        with `tree_hash`.
+        """
+        # these are the attributes `Program` itself caches these values in
+        tree_hash = program._cached_sha256_treehash
+        if tree_hash is None:
+            blob = program._cached_serialization
+            if blob is None or len(blob) > self.max_blob_size:
+                return program.tree_hash()
+            try:
+                tree_hash = self.tree_hash_for_blob(blob)
+            except BackReferenceError:
+                return program.tree_hash()
+            program._cached_sha256_treehash = tree_hash
+        return tree_hash
+
+    def cache_info(self) -> TreeHashCacheInfo:
+        with self.lock:
+            return TreeHashCacheInfo(
+                self.hits, self.misses, self.maxsize, self.currsize
+            )
+
+    def cache_clear(self) -> None:
+        with self.lock:
+            self.buckets.clear()
+            self.currsize = 0
+            self.currbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+TREE_HASH_CACHE = TreeHashCache()
+
+
+def tree_hash(program: Program) -> bytes:
+    return TREE_HASH_CACHE.tree_hash(program)
+
+
+def tree_hash_for_blob(blob: bytes) -> bytes:
+    return TREE_HASH_CACHE.tree_hash_for_blob(blob)
@@ -6,6 +6,8 @@ from chik_base.meta.typing import GenericAlias
 
 from klvm_rs import Program  # type: ignore
 
+from .serde_cache import SerdeCache, allow_recursion
+
 ToProgram = Callable[[Any], Program]
 FromProgram = Callable[[Program], Any]
 
@@ -142,6 +144,7 @@ def types_for_fields(t: type, call_morpher, type_tree: TypeTree):
     return location_based, key_based
 
 
+@allow_recursion
 def ser_dataclass(origin: Type, args_type: ArgsType, type_tree: TypeTree) -> Program:
     def morph_call(call, f):
         alt_serde_type = f.metadata.get("alt_serde_type")
@@ -203,6 +206,7 @@ def fail_ser(
     return None
 
 
+@allow_recursion
 def deser_dataclass(origin: Type, args_type: ArgsType, type_tree: TypeTree):
     def morph_call(call, f):
         alt_serde_type = f.metadata.get("alt_serde_type")
@@ -275,7 +279,7 @@ def fail_deser(origin: Type, args_type: ArgsType, type_tree: TypeTree):
     return None
 
 
-def to_program_for_type(t: type) -> Callable[[Any], Program]:
+def build_to_program_for_type(t: type) -> ToProgram:
     return TypeTree(
         {(Program, None): lambda x: x},
         SERIALIZER_COMPOUND_TYPE_LOOKUP,
@@ -283,6 +287,13 @@ def to_program_for_type(t: type) -> Callable[[Any], Program]:
     )(t)
 
 
+TO_PROGRAM_CACHE: SerdeCache[ToProgram] = SerdeCache(build_to_program_for_type)
+
+
+def to_program_for_type(t: type) -> Callable[[Any], Program]:
+    return TO_PROGRAM_CACHE(t)
+
+
 def deser_for_list(origin, args, type_tree: TypeTree):
     read_item = type_tree(args[0])
 
@@ -345,7 +356,7 @@ DESERIALIZER_COMPOUND_TYPE_LOOKUP: CompoundLookup[FromProgram] = {
 }
 
 
-def from_program_for_type(t: type) -> FromProgram:
+def build_from_program_for_type(t: type) -> FromProgram:
     simple_lookup: dict[OriginArgsType, FromProgram] = {
         (Program, None): lambda x: x,
     }
@@ -354,3 +365,10 @@ def from_program_for_type(t: type) -> FromProgram:
         DESERIALIZER_COMPOUND_TYPE_LOOKUP,
         fail_deser,
     )(t)
+
+
+FROM_PROGRAM_CACHE: SerdeCache[FromProgram] = SerdeCache(build_from_program_for_type)
+
+
+def from_program_for_type(t: type) -> FromProgram:
+    return FROM_PROGRAM_CACHE(t)
@@ -0,0 +1,336 @@
+"""
+Decode serialized klvm into a flat node arena.
+
+`NodeArena.from_bytes` parses a blob into four parallel `array`s indexed by
+node number, rather than a `Program` per node. Node 0 is the root. For every
+node, `starts` and `ends` hold the span of its serialization in the blob. For
+a pair, `firsts` and `rests` hold the node numbers of its children; for an
+atom, `firsts` is -1 and `rests` is the offset of its contents in the blob.
+Atoms are never copied until they are asked for.
+
+`from_arena_for_type` builds deserializers that read values straight from an
+arena. Only the values typed as `Program` (like puzzles and solutions, which
+get run) are turned into `Program` objects, each parsed from its own span of
+the blob.
+"""
+
+from array import array
+from dataclasses import MISSING, is_dataclass
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Type, Union
+
+from chik_base.meta.type_tree import ArgsType, CompoundLookup, TypeTree
+from chik_base.meta.typing import GenericAlias
+
+from klvm_rs import Program  # type: ignore
+
+from . import (
+    EncodingError,
+    Frugal,
+    tuple_frugal,
+    types_for_fields,
+)
+from .serde_cache import SerdeCache, allow_recursion
+from .stream import (
+    BACK_REFERENCE_MARKER,
+    CONS_BOX_MARKER,
+    MAX_SINGLE_BYTE,
+    BackReferenceError,
+    atom_size_for_blob,
+    program_for_blob,
+)
+
+
+class NodeArena:
+    def __init__(self, blob: bytes, starts, ends, firsts, rests):
+        self.blob = blob
+        self.starts = starts
+        self.ends = ends
+        self.firsts = firsts
+        self.rests = rests
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "NodeArena":
+        """
+        Parse one serialized tree from the start of `blob`. Trailing bytes are
+        ignored, like `Program.from_bytes`.
+        """
+        blob = bytes(blob)
+        # 32-bit offsets and node numbers keep the arena compact
+        starts = array("i")
+        ends = array("i")
+        firsts = array("i")
+        rests = array("i")
+        add_start = starts.append
+        add_end = ends.append
+        add_first = firsts.append
+        add_rest = rests.append
+        blob_size = len(blob)
+        if blob_size >= 1 << 31:
+            raise ValueError("blob too large for an arena")
+        # pairs waiting for their first (if `firsts` is -1) or rest child
+        open_pairs: List[int] = []
+        cursor = 0
+        index = -1
+        while True:
+            if cursor >= blob_size:
+                raise EncodingError("bad encoding")
+            index += 1
+            add_start(cursor)
+            b = blob[cursor]
+            cursor += 1
+            if b == CONS_BOX_MARKER:
+                add_end(-1)
+                add_first(-1)
+                add_rest(-1)
+                open_pairs.append(index)
+                continue
+            if b <= MAX_SINGLE_BYTE:
+                add_rest(cursor - 1)
+            elif b == 0x80:
+                add_rest(cursor)
+            else:
+                if b == BACK_REFERENCE_MARKER:
+                    raise BackReferenceError("back references aren't supported")
+                size, cursor = atom_size_for_blob(blob, cursor, b)
+                add_rest(cursor)
+                cursor += size
+                if cursor > blob_size:
+                    raise EncodingError("bad encoding")
+            add_end(cursor)
+            add_first(-1)
+
+            # attach the completed node to its parent, completing any pairs
+            # that were only waiting on this node
+            node = index
+            while open_pairs:
+                parent = open_pairs[-1]
+                if firsts[parent] == -1:
+                    firsts[parent] = node
+                    break
+                rests[parent] = node
+                ends[parent] = cursor
+                node = open_pairs.pop()
+            if not open_pairs:
+                return cls(blob, starts, ends, firsts, rests)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def is_pair(self, index: int) -> bool:
+        return self.firsts[index] >= 0
+
+    def pair(self, index: int) -> Optional[Tuple[int, int]]:
+        first = self.firsts[index]
+        if first < 0:
+            return None
+        return first, self.rests[index]
+
+    def atom(self, index: int) -> Optional[bytes]:
+        if self.firsts[index] >= 0:
+            return None
+        return self.blob[self.rests[index] : self.ends[index]]
+
+    def as_iter(self, index: int) -> Iterator[int]:
+        firsts = self.firsts
+        rests = self.rests
+        while firsts[index] >= 0:
+            yield firsts[index]
+            index = rests[index]
+
+    def serialized(self, index: int) -> bytes:
+        return self.blob[self.starts[index] : self.ends[index]]
+
+    def to_program(self, index: int) -> Program:
+        return program_for_blob(self.serialized(index))
+
+
+FromArena = Callable[[NodeArena, int], Any]
+
+
+def expect_pair(arena: NodeArena, index: int, message: str = "expected pair"):
+    pair = arena.pair(index)
+    if pair is None:
+        raise EncodingError(message)
+    return pair
+
+
+def arena_bytes(arena: NodeArena, index: int) -> bytes:
+    atom = arena.atom(index)
+    if atom is None:
+        raise EncodingError("expected atom")
+    return atom
+
+
+def arena_str(arena: NodeArena, index: int) -> str:
+    return arena_bytes(arena, index).decode()
+
+
+def arena_int(arena: NodeArena, index: int) -> int:
+    return Program.int_from_bytes(arena_bytes(arena, index))
+
+
+def arena_program(arena: NodeArena, index: int) -> Program:
+    return arena.to_program(index)
+
+
+def de_arena_for_list(origin, args, type_tree: TypeTree) -> FromArena:
+    read_item = type_tree(args[0])
+
+    def read_list(arena: NodeArena, index: int) -> list:
+        return [read_item(arena, _) for _ in arena.as_iter(index)]
+
+    return read_list
+
+
+def de_arena_for_tuple(origin, args, type_tree: TypeTree) -> FromArena:
+    read_items = [type_tree(_) for _ in args]
+
+    def read_tuple(arena: NodeArena, index: int) -> Tuple[Any, ...]:
+        values = []
+        for read_item in read_items:
+            first, index = expect_pair(arena, index, "wrong size program")
+            values.append(read_item(arena, first))
+        if arena.is_pair(index):
+            raise EncodingError("wrong size program")
+        return tuple(values)
+
+    return read_tuple
+
+
+def de_arena_for_tuple_frugal(origin, args, type_tree: TypeTree) -> FromArena:
+    read_items = [type_tree(_) for _ in args]
+    first_read_items = read_items[:-1]
+    last_read_item = read_items[-1]
+
+    def read_tuple_frugal(arena: NodeArena, index: int) -> Tuple[Any, ...]:
+        values = []
+        for read_item in first_read_items:
+            first, index = expect_pair(arena, index)
+            values.append(read_item(arena, first))
+        values.append(last_read_item(arena, index))
+        return tuple(values)
+
+    return read_tuple_frugal
+
+
+def de_arena_for_optional(origin, args, type_tree: TypeTree) -> FromArena:
+    if len(args) == 2 and type(None) is args[1]:
+        read_item = type_tree(args[0])
+
+        def read_optional(arena: NodeArena, index: int):
+            first, rest = expect_pair(arena, index)
+            if arena.atom(first) == b"":
+                return None
+            return read_item(arena, rest)
+
+        return read_optional
+    else:
+        raise ValueError("No serialization support for Union types (besides Optional)")
+
+
+DE_ARENA_COMPOUND_TYPE_LOOKUP: CompoundLookup[FromArena] = {
+    list: de_arena_for_list,
+    tuple: de_arena_for_tuple,
+    tuple_frugal: de_arena_for_tuple_frugal,
+    Union: de_arena_for_optional,
+}
+
+
+@allow_recursion
+def de_arena_dataclass(origin: Type, args_type: ArgsType, type_tree: TypeTree):
+    def morph_call(call, f):
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            _type, _from_storage, to_storage = alt_serde_type
+
+            def f(arena: NodeArena, index: int):
+                return to_storage(call(arena, index))
+
+            return f
+        return call
+
+    location_based, key_based = types_for_fields(origin, morph_call, type_tree)
+
+    types = tuple(type_hint for name, type_hint in location_based)
+    is_frugal = bool(key_based) or issubclass(origin, Frugal)
+    if not key_based:
+        tuple_type = GenericAlias(tuple_frugal if is_frugal else tuple, types)
+        read_tuple = type_tree(tuple_type)
+
+        def de(arena: NodeArena, index: int):
+            return origin(*read_tuple(arena, index))
+
+        return de
+
+    read_items = [type_tree(_) for _ in types]
+    key_lookup = {key.encode(): (name, call) for key, name, call, _ in key_based}
+
+    def de_with_keys(arena: NodeArena, index: int):
+        args = []
+        for read_item in read_items:
+            first, index = expect_pair(arena, index)
+            args.append(read_item(arena, first))
+        kwargs = {}
+        for entry in arena.as_iter(index):
+            key_index, value_index = expect_pair(arena, entry)
+            key = arena_bytes(arena, key_index)
+            if key in key_lookup:
+                name, call = key_lookup[key]
+                kwargs[name] = call(arena, value_index)
+        for key, name, call, default_value in key_based:
+            if name not in kwargs:
+                if default_value == MISSING:
+                    raise EncodingError(
+                        f"missing required field for {name} with key {key}"
+                    )
+                kwargs[name] = default_value
+        return origin(*args, **kwargs)
+
+    return de_with_keys
+
+
+def fail_de_arena(
+    origin: Type, args_type: ArgsType, type_tree: TypeTree
+) -> Optional[FromArena]:
+    if issubclass(origin, int):
+        return arena_int
+
+    if issubclass(origin, bytes):
+        return arena_bytes
+
+    if issubclass(origin, str):
+        return arena_str
+
+    if is_dataclass(origin):
+        return de_arena_dataclass(origin, args_type, type_tree)
+
+    if hasattr(origin, "from_bytes"):
+        return lambda arena, index: origin.from_bytes(arena_bytes(arena, index))
+
+    return None
+
+
+def build_from_arena_for_type(t: type) -> FromArena:
+    return TypeTree(
+        {(Program, None): arena_program},
+        DE_ARENA_COMPOUND_TYPE_LOOKUP,
+        fail_de_arena,
+    )(t)
+
+
+FROM_ARENA_CACHE: SerdeCache[FromArena] = SerdeCache(build_from_arena_for_type)
+
+
+def from_arena_for_type(t: type) -> FromArena:
+    """
+    Return a function `f(arena, index)` that deserializes a value of type `t`
+    from node `index` of a `NodeArena`.
+    """
+    return FROM_ARENA_CACHE(t)
+
+
+def from_bytes_via_arena(t: type, blob: bytes) -> Any:
+    """
+    Deserialize a value of type `t` from `blob` by way of a `NodeArena`.
+    """
+    return from_arena_for_type(t)(NodeArena.from_bytes(blob), 0)
@@ -0,0 +1,421 @@
+"""
+Generate flat python source for serializing and deserializing a type.
+
+`to_program_for_type` and `from_program_for_type` build a tree of closures, so
+every field of every object costs a few python call frames. The functions here
+walk the same type tree once, up front, and emit one specialized function per
+dataclass (plus one for the top-level type) with every list, tuple and optional
+unrolled inline. Nested dataclasses are the only thing that costs a call.
+
+The output is byte-for-byte identical to the closure-based encoder.
+"""
+
+from dataclasses import MISSING, fields, is_dataclass
+from typing import Any, Dict, List, Tuple, Union, get_args, get_origin, get_type_hints
+
+from klvm_rs import Program  # type: ignore
+
+from . import (
+    EncodingError,
+    Frugal,
+    FromProgram,
+    ToProgram,
+    tuple_frugal,
+)
+from .serde_cache import SerdeCache
+
+
+def _raise_encoding_error(message: str):
+    raise EncodingError(message)
+
+
+class _Source:
+    """
+    Accumulates python source for a group of generated functions, along with
+    the namespace they are executed in.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.namespace: Dict[str, Any] = dict(
+            Program=Program,
+            EncodingError=EncodingError,
+            MISSING=MISSING,
+            _raise=_raise_encoding_error,
+            _int_from_bytes=Program.int_from_bytes,
+            _wrap=Program.wrap,
+        )
+        self.dataclass_functions: Dict[type, str] = {}
+        self.todo: List[type] = []
+        self.chunks: List[str] = []
+        self.counter = 0
+
+    def var(self, hint: str = "v") -> str:
+        self.counter += 1
+        return f"{hint}_{self.counter}"
+
+    def const(self, obj: Any, hint: str = "c") -> str:
+        name = self.var(f"_{hint}")
+        self.namespace[name] = obj
+        return name
+
+    def function_for_dataclass(self, t: type) -> str:
+        name = self.dataclass_functions.get(t)
+        if name is None:
+            # register the name before generating the body so recursive
+            # dataclasses just call themselves
+            name = self.var(f"{self.prefix}_{t.__name__}")
+            self.dataclass_functions[t] = name
+            self.todo.append(t)
+        return name
+
+    def build(self, top_level_name: str, filename: str):
+        source = "\n".join(self.chunks)
+        exec(compile(source, filename, "exec"), self.namespace)
+        f = self.namespace[top_level_name]
+        f.__source__ = source
+        return f
+
+
+def _schema_for_dataclass(t: type):
+    """
+    Split the fields of dataclass `t` into location-based and key-based fields,
+    mirroring `types_for_fields`, but keeping the types rather than building
+    callables.
+    """
+    location_based = []
+    key_based = []
+    type_hints = get_type_hints(t)
+    for f in fields(t):
+        type_hint = type_hints[f.name]
+        key = f.metadata.get("key")
+        if key is None:
+            location_based.append((f.name, type_hint))
+            continue
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            storage_type, from_storage, to_storage = alt_serde_type
+        else:
+            storage_type, from_storage, to_storage = type_hint, None, None
+        key_based.append((key, f, storage_type, from_storage, to_storage))
+    is_frugal = bool(key_based) or issubclass(t, Frugal)
+    return location_based, key_based, is_frugal
+
+
+def _optional_arg(args) -> type:
+    if len(args) == 2 and type(None) is args[1]:
+        return args[0]
+    raise ValueError("No serialization support for Union types (besides Optional)")
+
+
+def _emit_nested_pairs(items: List[str]) -> str:
+    # `(a, (b, c))` with no nil terminator, like `ser_for_tuple_frugal`
+    if not items:
+        raise ValueError("can't serialize an empty frugal tuple")
+    r = items[-1]
+    for item in reversed(items[:-1]):
+        r = f"({item}, {r})"
+    return r
+
+
+class _SerCompiler:
+    """
+    Emits statements that convert a python value into a `Program.to`-castable
+    value of nested lists, pairs and atoms.
+    """
+
+    def __init__(self):
+        self.src = _Source("ser")
+
+    def emit(self, t, src: str, lines: List[str], indent: str) -> str:
+        """
+        Emit statements into `lines` that compute the castable value of `src`
+        (a local variable name) of type `t`. Return an expression for it.
+        """
+        if t is Program:
+            return src
+
+        origin = get_origin(t)
+        if origin is not None:
+            args = get_args(t)
+            if origin is list:
+                dst, item = self.src.var("items"), self.src.var("item")
+                body: List[str] = []
+                expr = self.emit(args[0], item, body, indent + "    ")
+                if expr == item and not body:
+                    # the items are castable as they are
+                    lines.append(f"{indent}{dst} = list({src})")
+                    return dst
+                lines.append(f"{indent}{dst} = []")
+                lines.append(f"{indent}for {item} in {src}:")
+                lines.extend(body)
+                lines.append(f"{indent}    {dst}.append({expr})")
+                return dst
+            if origin in (tuple, tuple_frugal):
+                return self.emit_tuple(args, origin is tuple_frugal, src, lines, indent)
+            if origin is Union:
+                inner = _optional_arg(args)
+                dst = self.src.var("opt")
+                lines.append(f"{indent}if {src} is None:")
+                lines.append(f'{indent}    {dst} = (b"", b"")')
+                lines.append(f"{indent}else:")
+                body = []
+                expr = self.emit(inner, src, body, indent + "    ")
+                lines.extend(body)
+                lines.append(f"{indent}    {dst} = (1, {expr})")
+                return dst
+
+        if isinstance(t, type):
+            if issubclass(t, (str, bytes, int)):
+                return src
+            if is_dataclass(t):
+                return f"{self.src.function_for_dataclass(t)}({src})"
+            if hasattr(t, "__bytes__"):
+                return f"bytes({src})"
+
+        raise ValueError(f"unable to handle type {t}")
+
+    def emit_tuple(self, args, is_frugal: bool, src: str, lines, indent) -> str:
+        count = len(args)
+        lines.append(f"{indent}if len({src}) != {count}:")
+        lines.append(f'{indent}    _raise("incorrect number of items in tuple")')
+        exprs = []
+        for idx, arg in enumerate(args):
+            item = self.src.var("item")
+            lines.append(f"{indent}{item} = {src}[{idx}]")
+            exprs.append(self.emit(arg, item, lines, indent))
+        if is_frugal:
+            return _emit_nested_pairs(exprs)
+        return f"[{', '.join(exprs)}]"
+
+    def emit_dataclass(self, t: type):
+        name = self.src.dataclass_functions[t]
+        location_based, key_based, is_frugal = _schema_for_dataclass(t)
+        lines = [f"def {name}(item):"]
+        exprs = []
+        for field_name, type_hint in location_based:
+            v = self.src.var(field_name)
+            lines.append(f"    {v} = item.{field_name}")
+            exprs.append(self.emit(type_hint, v, lines, "    "))
+        if key_based:
+            d = self.src.var("d")
+            lines.append(f"    {d} = []")
+            for key, f, storage_type, from_storage, _to_storage in key_based:
+                v = self.src.var(f.name)
+                lines.append(f"    {v} = item.{f.name}")
+                indent = "    "
+                if f.default is not MISSING or f.default_factory is not MISSING:
+                    default = (
+                        f.default
+                        if f.default_factory is MISSING
+                        else f.default_factory()
+                    )
+                    lines.append(
+                        f"    if not ({v} == {self.src.const(default, 'default')}):"
+                    )
+                    indent = "        "
+                if from_storage is not None:
+                    from_storage_f = self.src.const(from_storage, "from_storage")
+                    lines.append(f"{indent}{v} = {from_storage_f}({v})")
+                body: List[str] = []
+                expr = self.emit(storage_type, v, body, indent)
+                lines.extend(body)
+                lines.append(f"{indent}{d}.append(({key!r}, {expr}))")
+            exprs.append(d)
+        if is_frugal:
+            lines.append(f"    return {_emit_nested_pairs(exprs)}")
+        else:
+            lines.append(f"    return [{', '.join(exprs)}]")
+        self.src.chunks.append("\n".join(lines) + "\n")
+
+    def compile(self, t) -> ToProgram:
+        lines = ["def to_program(item):"]
+        expr = self.emit(t, "item", lines, "    ")
+        lines.append(f"    return Program.to({expr})")
+        self.src.chunks.append("\n".join(lines) + "\n")
+        while self.src.todo:
+            self.emit_dataclass(self.src.todo.pop())
+        return self.src.build("to_program", f"<klvm_serde to_program for {t}>")
+
+
+class _DeCompiler:
+    """
+    Emits statements that walk a `Program` and build the python value.
+    """
+
+    def __init__(self):
+        self.src = _Source("de")
+
+    def emit_atom(self, src: str, lines: List[str], indent: str) -> str:
+        atom = self.src.var("atom")
+        lines.append(f"{indent}{atom} = {src}.atom")
+        lines.append(f"{indent}if {atom} is None:")
+        lines.append(f'{indent}    _raise("expected atom")')
+        return atom
+
+    def emit_pair(
+        self, src: str, lines: List[str], indent: str, message: str = "expected pair"
+    ) -> Tuple[str, str]:
+        pair, first, rest = self.src.var("pair"), self.src.var("f"), self.src.var("r")
+        lines.append(f"{indent}{pair} = {src}.pair")
+        lines.append(f"{indent}if {pair} is None:")
+        lines.append(f"{indent}    _raise({message!r})")
+        lines.append(f"{indent}{first}, {rest} = {pair}")
+        return first, rest
+
+    def emit(self, t, src: str, lines: List[str], indent: str) -> str:
+        """
+        Emit statements into `lines` that decode the `Program` in local
+        variable `src` as type `t`. Return an expression for the result.
+        """
+        if t is Program:
+            return f"_wrap({src})"
+
+        origin = get_origin(t)
+        if origin is not None:
+            args = get_args(t)
+            if origin is list:
+                dst, cursor = self.src.var("items"), self.src.var("cursor")
+                pair, item = self.src.var("pair"), self.src.var("item")
+                lines.append(f"{indent}{dst} = []")
+                lines.append(f"{indent}{cursor} = {src}")
+                lines.append(f"{indent}while True:")
+                lines.append(f"{indent}    {pair} = {cursor}.pair")
+                lines.append(f"{indent}    if {pair} is None:")
+                lines.append(f"{indent}        break")
+                lines.append(f"{indent}    {item}, {cursor} = {pair}")
+                expr = self.emit(args[0], item, lines, indent + "    ")
+                lines.append(f"{indent}    {dst}.append({expr})")
+                return dst
+            if origin is tuple:
+                exprs = []
+                cursor = src
+                for arg in args:
+                    first, cursor = self.emit_pair(
+                        cursor, lines, indent, "wrong size program"
+                    )
+                    exprs.append(self.emit(arg, first, lines, indent))
+                lines.append(f"{indent}if {cursor}.pair is not None:")
+                lines.append(f'{indent}    _raise("wrong size program")')
+                return f"({''.join(_ + ', ' for _ in exprs)})"
+            if origin is tuple_frugal:
+                exprs = self.emit_frugal(args, src, lines, indent)
+                return f"({''.join(_ + ', ' for _ in exprs)})"
+            if origin is Union:
+                inner = _optional_arg(args)
+                dst = self.src.var("opt")
+                first, rest = self.emit_pair(src, lines, indent)
+                lines.append(f'{indent}if {first}.atom == b"":')
+                lines.append(f"{indent}    {dst} = None")
+                lines.append(f"{indent}else:")
+                body: List[str] = []
+                expr = self.emit(inner, rest, body, indent + "    ")
+                lines.extend(body)
+                lines.append(f"{indent}    {dst} = {expr}")
+                return dst
+
+        if isinstance(t, type):
+            if issubclass(t, int):
+                return f"_int_from_bytes({self.emit_atom(src, lines, indent)})"
+            if issubclass(t, bytes):
+                return self.emit_atom(src, lines, indent)
+            if issubclass(t, str):
+                return f"{self.emit_atom(src, lines, indent)}.decode()"
+            if is_dataclass(t):
+                return f"{self.src.function_for_dataclass(t)}({src})"
+            if hasattr(t, "from_bytes"):
+                from_bytes = self.src.const(t.from_bytes, "from_bytes")
+                return f"{from_bytes}({self.emit_atom(src, lines, indent)})"
+
+        raise ValueError(f"unable to handle type {t}")
+
+    def emit_frugal(self, args, src: str, lines: List[str], indent: str) -> List[str]:
+        exprs = []
+        cursor = src
+        for arg in args[:-1]:
+            first, cursor = self.emit_pair(cursor, lines, indent)
+            exprs.append(self.emit(arg, first, lines, indent))
+        exprs.append(self.emit(args[-1], cursor, lines, indent))
+        return exprs
+
+    def emit_dataclass(self, t: type):
+        name = self.src.dataclass_functions[t]
+        location_based, key_based, is_frugal = _schema_for_dataclass(t)
+        cls = self.src.const(t, "cls")
+        lines = [f"def {name}(p):"]
+        arg_types = [type_hint for _name, type_hint in location_based]
+        if key_based:
+            arg_types.append(List[Program])
+        if is_frugal:
+            exprs = self.emit_frugal(arg_types, "p", lines, "    ")
+        else:
+            items = self.src.var("items")
+            expr = self.emit(Tuple[tuple(arg_types)], "p", lines, "    ")
+            lines.append(f"    {items} = {expr}")
+            exprs = [f"{items}[{idx}]" for idx in range(len(arg_types))]
+        args = exprs[: len(location_based)]
+        if key_based:
+            d, entry = self.src.var("d"), self.src.var("entry")
+            lines.append(f"    {d} = {{}}")
+            lines.append(f"    for {entry} in {exprs[-1]}:")
+            first, rest = self.emit_pair(entry, lines, "        ")
+            atom = self.emit_atom(first, lines, "        ")
+            lines.append(f"        {d}[{atom}] = {rest}")
+            for key, f, storage_type, _from_storage, to_storage in key_based:
+                v = self.src.var(f.name)
+                lines.append(f"    {v} = {d}.get({key.encode()!r})")
+                lines.append(f"    if {v} is None:")
+                if f.default_factory is not MISSING:
+                    factory = self.src.const(f.default_factory, "default_factory")
+                    lines.append(f"        {v} = {factory}()")
+                elif f.default is not MISSING:
+                    lines.append(
+                        f"        {v} = {self.src.const(f.default, 'default')}"
+                    )
+                else:
+                    message = f"missing required field for {f.name} with key {key}"
+                    lines.append(f"        _raise({message!r})")
+                lines.append("    else:")
+                body: List[str] = []
+                expr = self.emit(storage_type, v, body, "        ")
+                lines.extend(body)
+                if to_storage is not None:
+                    expr = f"{self.src.const(to_storage, 'to_storage')}({expr})"
+                lines.append(f"        {v} = {expr}")
+                args.append(f"{f.name}={v}")
+        lines.append(f"    return {cls}({', '.join(args)})")
+        self.src.chunks.append("\n".join(lines) + "\n")
+
+    def compile(self, t) -> FromProgram:
+        # walk the unwrapped storage nodes rather than `Program` objects, which
+        # allocate a new wrapper for every `pair` visited. Only values that are
+        # themselves typed as `Program` get wrapped.
+        lines = ["def from_program(p):", '    p = getattr(p, "_unwrapped", p)']
+        expr = self.emit(t, "p", lines, "    ")
+        lines.append(f"    return {expr}")
+        self.src.chunks.append("\n".join(lines) + "\n")
+        while self.src.todo:
+            self.emit_dataclass(self.src.todo.pop())
+        return self.src.build("from_program", f"<klvm_serde from_program for {t}>")
+
+
+COMPILED_TO_PROGRAM_CACHE: SerdeCache[ToProgram] = SerdeCache(
+    lambda t: _SerCompiler().compile(t)
+)
+COMPILED_FROM_PROGRAM_CACHE: SerdeCache[FromProgram] = SerdeCache(
+    lambda t: _DeCompiler().compile(t)
+)
+
+
+def compiled_to_program_for_type(t: type) -> ToProgram:
+    """
+    Like `to_program_for_type`, but generates and compiles specialized source.
+    """
+    return COMPILED_TO_PROGRAM_CACHE(t)
+
+
+def compiled_from_program_for_type(t: type) -> FromProgram:
+    """
+    Like `from_program_for_type`, but generates and compiles specialized source.
+    """
+    return COMPILED_FROM_PROGRAM_CACHE(t)
@@ -0,0 +1,453 @@
+"""
+Serialize and deserialize with an explicit stack rather than the python one.
+
+The closures built by `to_program_for_type` and `from_program_for_type` call
+each other once per level of nesting, so a deeply nested value (like a long
+chain of a dataclass that refers to itself) can hit the recursion limit.
+
+Here, the type is first compiled into a tree of schema nodes. The functions
+built by `iterative_to_program_for_type` and `iterative_from_program_for_type`
+then walk the value (writing the serialization as they go) or the `Program`
+(building values bottom-up on a value stack) in a single loop, so the python
+stack depth doesn't depend on the input.
+"""
+
+from dataclasses import MISSING, fields, is_dataclass
+from typing import Any, Callable, List, Optional, Tuple, Type, Union, get_type_hints
+
+from chik_base.meta.type_tree import ArgsType, CompoundLookup, TypeTree
+
+from klvm_rs import Program  # type: ignore
+
+from . import (
+    EncodingError,
+    FromProgram,
+    Frugal,
+    ToProgram,
+    tuple_frugal,
+)
+from .serde_cache import SerdeCache
+from .stream import CONS_BOX, NULL, write_atom
+
+ATOM, PROGRAM, LIST, TUPLE, OPTIONAL, ALT, DATACLASS = range(7)
+
+
+class Schema:
+    kind: int
+
+
+class AtomSchema(Schema):
+    kind = ATOM
+
+    def __init__(self, to_atom: Callable[[Any], bytes], from_atom: Callable):
+        self.to_atom = to_atom
+        self.from_atom = from_atom
+
+
+class ProgramSchema(Schema):
+    kind = PROGRAM
+
+
+class ListSchema(Schema):
+    kind = LIST
+
+    def __init__(self, item: Schema):
+        self.item = item
+
+
+class TupleSchema(Schema):
+    kind = TUPLE
+
+    def __init__(self, items: List[Schema], is_frugal: bool, args: tuple = ()):
+        self.items = items
+        self.is_frugal = is_frugal
+        self.args = args
+
+
+class OptionalSchema(Schema):
+    kind = OPTIONAL
+
+    def __init__(self, item: Schema):
+        self.item = item
+
+
+class AltSchema(Schema):
+    kind = ALT
+
+    def __init__(self, storage: Schema, from_storage: Callable, to_storage: Callable):
+        self.storage = storage
+        self.from_storage = from_storage
+        self.to_storage = to_storage
+
+
+class DataclassSchema(Schema):
+    """
+    Created empty, then filled in by `fill_dataclass_schema`, so a dataclass
+    that refers to itself finds its own (unfinished) schema.
+    """
+
+    kind = DATACLASS
+
+    def __init__(self, origin: type):
+        self.origin = origin
+        self.names: List[str] = []
+        self.items: List[Schema] = []
+        # (key, serialized key atom, name, schema, field)
+        self.key_based: List[Tuple[bytes, bytes, str, Schema, Any]] = []
+        self.is_frugal = False
+
+
+def schema_for_list(origin, args, type_tree: TypeTree) -> Schema:
+    return ListSchema(type_tree(args[0]))
+
+
+def schema_for_tuple(origin, args, type_tree: TypeTree) -> Schema:
+    return TupleSchema([type_tree(_) for _ in args], False, args)
+
+
+def schema_for_tuple_frugal(origin, args, type_tree: TypeTree) -> Schema:
+    return TupleSchema([type_tree(_) for _ in args], True, args)
+
+
+def schema_for_optional(origin, args, type_tree: TypeTree) -> Schema:
+    if len(args) == 2 and type(None) is args[1]:
+        return OptionalSchema(type_tree(args[0]))
+    else:
+        raise ValueError("No serialization support for Union types (besides Optional)")
+
+
+SCHEMA_COMPOUND_TYPE_LOOKUP: CompoundLookup[Schema] = {
+    list: schema_for_list,
+    tuple: schema_for_tuple,
+    tuple_frugal: schema_for_tuple_frugal,
+    Union: schema_for_optional,
+}
+
+
+def serialized_atom(blob: bytes) -> bytes:
+    b = bytearray()
+    write_atom(blob, b.extend)
+    return bytes(b)
+
+
+def fill_dataclass_schema(schema: DataclassSchema, type_tree: TypeTree) -> None:
+    origin = schema.origin
+    type_hints = get_type_hints(origin)
+    for f in fields(origin):
+        type_hint = type_hints[f.name]
+        key = f.metadata.get("key")
+        if key is None:
+            schema.names.append(f.name)
+            schema.items.append(type_tree(type_hint))
+            continue
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            storage_type, from_storage, to_storage = alt_serde_type
+            field_schema: Schema = AltSchema(
+                type_tree(storage_type), from_storage, to_storage
+            )
+        else:
+            field_schema = type_tree(type_hint)
+        key_blob = key.encode()
+        schema.key_based.append(
+            (key_blob, serialized_atom(key_blob), f.name, field_schema, f)
+        )
+    schema.is_frugal = bool(schema.key_based) or issubclass(origin, Frugal)
+
+
+def fail_schema(
+    origin: Type, args_type: ArgsType, type_tree: TypeTree
+) -> Optional[Schema]:
+    if issubclass(origin, int):
+        return AtomSchema(Program.int_to_bytes, Program.int_from_bytes)
+
+    if issubclass(origin, bytes):
+        return AtomSchema(bytes, bytes)
+
+    if issubclass(origin, str):
+        return AtomSchema(str.encode, bytes.decode)
+
+    if is_dataclass(origin):
+        schema = DataclassSchema(origin)
+        type_tree.simple_type_lookup[(origin, args_type)] = schema
+        fill_dataclass_schema(schema, type_tree)
+        return schema
+
+    if hasattr(origin, "from_bytes") and hasattr(origin, "__bytes__"):
+        return AtomSchema(bytes, origin.from_bytes)
+
+    return None
+
+
+def schema_for_type(t: type) -> Schema:
+    return TypeTree(
+        {(Program, None): ProgramSchema()},
+        SCHEMA_COMPOUND_TYPE_LOOKUP,
+        fail_schema,
+    )(t)
+
+
+def default_for_field(f) -> Any:
+    if f.default_factory is not MISSING:
+        return f.default_factory()
+    return f.default
+
+
+def serialize(schema: Schema, value: Any) -> bytes:
+    out = bytearray()
+    write = out.extend
+    # entries are `(schema, value)`, or `(None, blob)` for bytes to write as-is
+    todo: List[Tuple[Optional[Schema], Any]] = [(schema, value)]
+    pop = todo.pop
+    push = todo.append
+    while todo:
+        schema, value = pop()
+        if schema is None:
+            write(value)
+            continue
+        kind = schema.kind
+        if kind == ATOM:
+            write_atom(schema.to_atom(value), write)
+        elif kind == PROGRAM:
+            write(bytes(value))
+        elif kind == LIST:
+            item = schema.item
+            push((None, NULL))
+            for v in reversed(value):
+                push((item, v))
+                push((None, CONS_BOX))
+        elif kind == TUPLE:
+            items = schema.items
+            if len(value) != len(items):
+                raise EncodingError("wrong size tuple")
+            push_sequence(push, list(zip(items, value)), schema.is_frugal)
+        elif kind == OPTIONAL:
+            if value is None:
+                write(b"\xff\x80\x80")
+            else:
+                write(b"\xff\x01")
+                push((schema.item, value))
+        elif kind == ALT:
+            push((schema.storage, schema.from_storage(value)))
+        elif kind == DATACLASS:
+            entries: List[Tuple[Optional[Schema], Any]] = [
+                (item, getattr(value, name))
+                for item, name in zip(schema.items, schema.names)
+            ]
+            if schema.key_based:
+                key_value_pairs = []
+                for _key, key_atom, name, field_schema, f in schema.key_based:
+                    v = getattr(value, name)
+                    if v == default_for_field(f):
+                        continue
+                    key_value_pairs.append((field_schema, v, key_atom))
+                entries.append((None, key_value_pairs))
+            push_sequence(push, entries, schema.is_frugal)
+        else:
+            raise AssertionError("unknown schema kind")
+    return bytes(out)
+
+
+def push_sequence(push, entries: list, is_frugal: bool) -> None:
+    """
+    Push entries to be written as a list, or as nested pairs if `is_frugal`.
+    An entry `(None, key_value_pairs)` is written as a list of
+    `(key . value)` pairs.
+    """
+    if is_frugal:
+        entries = list(entries)
+        last = entries.pop()
+        push_entry(push, last)
+    else:
+        push((None, NULL))
+    for entry in reversed(entries):
+        push_entry(push, entry)
+        push((None, CONS_BOX))
+
+
+def push_entry(push, entry) -> None:
+    schema, value = entry
+    if schema is not None:
+        push(entry)
+        return
+    push((None, NULL))
+    for field_schema, v, key_atom in reversed(value):
+        push((field_schema, v))
+        push((None, CONS_BOX + key_atom))
+        push((None, CONS_BOX))
+
+
+def expect_pair(node, message: str = "expected pair"):
+    pair = node.pair
+    if pair is None:
+        raise EncodingError(message)
+    return pair
+
+
+def items_for_sequence(node, count: int, is_frugal: bool) -> list:
+    """
+    Split `node` into `count` items, laid out as a list, or as nested pairs
+    if `is_frugal`.
+    """
+    items = []
+    if is_frugal:
+        for _ in range(count - 1):
+            first, node = expect_pair(node)
+            items.append(first)
+        items.append(node)
+        return items
+    for _ in range(count):
+        first, node = expect_pair(node, "wrong size program")
+        items.append(first)
+    if node.pair is not None:
+        raise EncodingError("wrong size program")
+    return items
+
+
+DECODE, BUILD_LIST, BUILD_TUPLE, BUILD_ALT, BUILD_DATACLASS = range(5)
+
+
+def deserialize(schema: Schema, p: Program) -> Any:
+    wrap = Program.wrap
+    values: List[Any] = []
+    todo: List[Tuple[int, Any, Any]] = [(DECODE, schema, getattr(p, "_unwrapped", p))]
+    pop = todo.pop
+    push = todo.append
+    while todo:
+        op, schema, arg = pop()
+        if op == BUILD_LIST:
+            count = arg
+            if count:
+                items = values[-count:]
+                del values[-count:]
+            else:
+                items = []
+            values.append(items)
+            continue
+        if op == BUILD_TUPLE:
+            count = arg
+            items = values[-count:]
+            del values[-count:]
+            values.append(tuple(items))
+            continue
+        if op == BUILD_ALT:
+            values[-1] = schema.to_storage(values[-1])
+            continue
+        if op == BUILD_DATACLASS:
+            present, kwargs = arg
+            count = len(schema.items) + len(present)
+            args = values[-count:] if count else []
+            if count:
+                del values[-count:]
+            location_count = len(schema.items)
+            for name, v in zip(present, args[location_count:]):
+                kwargs[name] = v
+            values.append(schema.origin(*args[:location_count], **kwargs))
+            continue
+
+        # op == DECODE
+        node = arg
+        kind = schema.kind
+        if kind == ATOM:
+            atom = node.atom
+            if atom is None:
+                raise EncodingError("expected atom")
+            values.append(schema.from_atom(atom))
+        elif kind == PROGRAM:
+            values.append(wrap(node))
+        elif kind == LIST:
+            items = []
+            while True:
+                pair = node.pair
+                if pair is None:
+                    break
+                item, node = pair
+                items.append(item)
+            push((BUILD_LIST, schema, len(items)))
+            item_schema = schema.item
+            for item in reversed(items):
+                push((DECODE, item_schema, item))
+        elif kind == TUPLE:
+            item_schemas = schema.items
+            items = items_for_sequence(node, len(item_schemas), schema.is_frugal)
+            push((BUILD_TUPLE, schema, len(items)))
+            for item_schema, item in zip(reversed(item_schemas), reversed(items)):
+                push((DECODE, item_schema, item))
+        elif kind == OPTIONAL:
+            first, rest = expect_pair(node)
+            if first.atom == b"":
+                values.append(None)
+            else:
+                push((DECODE, schema.item, rest))
+        elif kind == ALT:
+            push((BUILD_ALT, schema, None))
+            push((DECODE, schema.storage, node))
+        elif kind == DATACLASS:
+            count = len(schema.items) + (1 if schema.key_based else 0)
+            items = items_for_sequence(node, count, schema.is_frugal)
+            to_decode = list(zip(schema.items, items))
+            present = []
+            kwargs = {}
+            if schema.key_based:
+                d = {}
+                key_list = items.pop()
+                for entry in iter_list(key_list):
+                    key, value = expect_pair(entry)
+                    if key.atom is None:
+                        raise EncodingError("expected atom")
+                    d[key.atom] = value
+                for key, _key_atom, name, field_schema, f in schema.key_based:
+                    if key in d:
+                        present.append(name)
+                        to_decode.append((field_schema, d[key]))
+                        continue
+                    default_value = default_for_field(f)
+                    if default_value is MISSING:
+                        raise EncodingError(
+                            f"missing required field for {name}"
+                            f" with key {key.decode()}"
+                        )
+                    kwargs[name] = default_value
+            push((BUILD_DATACLASS, schema, (present, kwargs)))
+            for item_schema, item in reversed(to_decode):
+                push((DECODE, item_schema, item))
+        else:
+            raise AssertionError("unknown schema kind")
+
+    return values[0]
+
+
+def iter_list(node):
+    while True:
+        pair = node.pair
+        if pair is None:
+            return
+        item, node = pair
+        yield item
+
+
+SCHEMA_CACHE: SerdeCache[Schema] = SerdeCache(schema_for_type)
+
+
+def iterative_to_bytes_for_type(t: type) -> Callable[[Any], bytes]:
+    """
+    Serialize straight to bytes, skipping the `Program`.
+    """
+    schema = SCHEMA_CACHE(t)
+    return lambda value: serialize(schema, value)
+
+
+def iterative_to_program_for_type(t: type) -> ToProgram:
+    """
+    Like `to_program_for_type`, but at a constant python stack depth.
+    """
+    schema = SCHEMA_CACHE(t)
+    return lambda value: Program.from_bytes(serialize(schema, value))
+
+
+def iterative_from_program_for_type(t: type) -> FromProgram:
+    """
+    Like `from_program_for_type`, but at a constant python stack depth.
+    """
+    schema = SCHEMA_CACHE(t)
+    return lambda p: deserialize(schema, p)
@@ -0,0 +1,257 @@
+"""
+Lazily deserialize dataclasses from a `Program`.
+
+`lazy_from_program_for_type` returns objects that only locate the `Program`
+subtree for each field up front. A field is decoded the first time it's
+accessed, then memoized as a plain instance attribute. List fields become a
+`LazyList`, which decodes each element on first access in the same way, and
+acts like a read-only `list` (see its docstring for where it differs).
+
+The objects are instances of a subclass of the requested dataclass, so
+`isinstance`, `dataclasses.fields`, `repr` and `==` (in either direction) work
+just as they do with eagerly deserialized objects. Decoding errors inside a
+field surface when that field is first accessed.
+"""
+
+from collections.abc import Sequence
+from dataclasses import MISSING, fields, is_dataclass
+from typing import Any, Callable, Dict, List, get_args, get_origin, get_type_hints
+
+from klvm_rs import Program  # type: ignore
+
+from . import EncodingError, FromProgram, Frugal, from_program_for_type
+from .serde_cache import SerdeCache
+
+_UNSET = object()
+
+
+class LazyList(Sequence):
+    """
+    A read-only list whose items are deserialized on first access.
+
+    Its length is known up front, without decoding any item. It compares
+    equal (and orders) like the `list` of its items, slices to a plain `list`,
+    and concatenates with a `list` to a `list`. It is not a `list` instance
+    though, and can't be changed, so call `list()` on it before mutating it
+    or passing it to code that checks for `list` (`json`, say).
+    """
+
+    __hash__ = None  # type: ignore
+
+    def __init__(self, items: List[Program], read_item: FromProgram):
+        self._items = items
+        self._values: List[Any] = [_UNSET] * len(items)
+        self._read_item = read_item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_] for _ in range(*index.indices(len(self)))]
+        v = self._values[index]
+        if v is _UNSET:
+            v = self._read_item(self._items[index])
+            self._values[index] = v
+        return v
+
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyList)):
+            # items are decoded only until one differs
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return list(self) < list(other)
+        return NotImplemented
+
+    def __le__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return list(self) <= list(other)
+        return NotImplemented
+
+    def __gt__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return list(self) > list(other)
+        return NotImplemented
+
+    def __ge__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return list(self) >= list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return list(self) + list(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + list(self)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class LazyField:
+    """
+    A non-data descriptor: once the decoded value is stored in the instance
+    `__dict__`, it shadows this descriptor and attribute access is direct.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        read, p = obj._klvm_sources.pop(self.name)
+        value = read(p)
+        obj.__dict__[self.name] = value
+        return value
+
+
+LAZY_CLASSES: Dict[type, type] = {}
+
+
+def lazy_class_for_dataclass(origin: type) -> type:
+    cls = LAZY_CLASSES.get(origin)
+    if cls is not None:
+        return cls
+
+    names = [f.name for f in fields(origin)]
+
+    def __eq__(self, other):
+        if isinstance(other, origin):
+            return all(getattr(self, name) == getattr(other, name) for name in names)
+        return NotImplemented
+
+    def __reduce__(self):
+        # pickle and copy as the plain dataclass
+        values = (getattr(self, name) for name in names)
+        return (
+            origin,
+            tuple(list(_) if isinstance(_, LazyList) else _ for _ in values),
+        )
+
+    namespace: Dict[str, Any] = {name: LazyField(name) for name in names}
+    namespace.update(
+        __eq__=__eq__,
+        __hash__=origin.__hash__,
+        __reduce__=__reduce__,
+        __module__=origin.__module__,
+        __qualname__=origin.__qualname__,
+    )
+    cls = type(origin.__name__, (origin,), namespace)
+    LAZY_CLASSES[origin] = cls
+    return cls
+
+
+def lazy_reader_for_type(t, readers: Dict[type, FromProgram]) -> FromProgram:
+    if isinstance(t, type) and is_dataclass(t):
+        read = readers.get(t)
+        if read is None:
+            # a forwarding stub handles dataclasses that refer to themselves
+            resolved: List[FromProgram] = []
+            readers[t] = lambda p: resolved[0](p)
+            read = lazy_deser_dataclass(t, readers)
+            readers[t] = read
+            resolved.append(read)
+        return read
+    if get_origin(t) is list:
+        read_item = lazy_reader_for_type(get_args(t)[0], readers)
+        return lambda p: LazyList(list(p.as_iter()), read_item)
+    return from_program_for_type(t)
+
+
+def lazy_reader_for_alt_serde(storage_type, to_storage: Callable) -> FromProgram:
+    if get_origin(storage_type) is list:
+        # convert one item at a time, assuming `to_storage` maps list to list
+        read_storage_item = from_program_for_type(get_args(storage_type)[0])
+
+        def read_item(p: Program):
+            return to_storage([read_storage_item(p)])[0]
+
+        return lambda p: LazyList(list(p.as_iter()), read_item)
+
+    read_storage = from_program_for_type(storage_type)
+    return lambda p: to_storage(read_storage(p))
+
+
+def lazy_deser_dataclass(origin: type, readers: Dict[type, FromProgram]) -> FromProgram:
+    cls = lazy_class_for_dataclass(origin)
+
+    location_based = []
+    key_based = []
+    type_hints = get_type_hints(origin)
+    for f in fields(origin):
+        type_hint = type_hints[f.name]
+        key = f.metadata.get("key")
+        if key is None:
+            location_based.append((f.name, lazy_reader_for_type(type_hint, readers)))
+            continue
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            storage_type, _from_storage, to_storage = alt_serde_type
+            read = lazy_reader_for_alt_serde(storage_type, to_storage)
+        else:
+            read = lazy_reader_for_type(type_hint, readers)
+        key_based.append((key.encode(), f, read))
+
+    is_frugal = bool(key_based) or issubclass(origin, Frugal)
+    item_count = len(location_based) + (1 if key_based else 0)
+
+    def de(p: Program):
+        # locate the subtree for each field, without decoding any of them
+        if is_frugal:
+            items = []
+            for _ in range(item_count - 1):
+                if p.pair is None:
+                    raise EncodingError("expected pair")
+                items.append(p.pair[0])
+                p = p.pair[1]
+            items.append(p)
+        else:
+            items = list(p.as_iter())
+            if len(items) != item_count:
+                raise EncodingError("wrong size program")
+
+        obj = cls.__new__(cls)
+        sources = {}
+        for (name, read), item in zip(location_based, items):
+            sources[name] = (read, item)
+        if key_based:
+            d = {}
+            for entry in items[-1].as_iter():
+                if entry.pair is None or entry.pair[0].atom is None:
+                    raise EncodingError("expected pair")
+                d[entry.pair[0].atom] = entry.pair[1]
+            for key, f, read in key_based:
+                if key in d:
+                    sources[f.name] = (read, d[key])
+                elif f.default_factory is not MISSING:
+                    obj.__dict__[f.name] = f.default_factory()
+                elif f.default is not MISSING:
+                    obj.__dict__[f.name] = f.default
+                else:
+                    raise EncodingError(
+                        f"missing required field for {f.name} with key {key.decode()}"
+                    )
+        obj.__dict__["_klvm_sources"] = sources
+        return obj
+
+    return de
+
+
+LAZY_FROM_PROGRAM_CACHE: SerdeCache[FromProgram] = SerdeCache(
+    lambda t: lazy_reader_for_type(t, {})
+)
+
+
+def lazy_from_program_for_type(t: type) -> FromProgram:
+    """
+    Like `from_program_for_type`, but dataclasses and lists are decoded lazily.
+    """
+    return LAZY_FROM_PROGRAM_CACHE(t)
@@ -0,0 +1,96 @@
+"""
+Helpers shared by the serde targets for building serializers and
+deserializers: a cache of what has been built, per type, and support for
+dataclasses that refer to themselves.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Generic, NamedTuple, Type, TypeVar
+
+import threading
+
+from chik_base.meta.type_tree import ArgsType, TypeTree
+
+T = TypeVar("T")
+
+
+class SerdeCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class SerdeCache(Generic[T]):
+    """
+    A bounded, thread-safe LRU cache of serde callables keyed by type.
+
+    `build` is called outside the lock, so two threads missing on the same type
+    at the same time may both build it. The results are equivalent, and the
+    last one stored wins.
+    """
+
+    def __init__(self, build: Callable[[Any], T], maxsize: int = 256):
+        self.build = build
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, t) -> T:
+        try:
+            hash(t)
+        except TypeError:
+            # some type arguments can't be hashed; don't cache those
+            return self.build(t)
+        with self.lock:
+            f = self.entries.get(t)
+            if f is not None:
+                self.entries.move_to_end(t)
+                self.hits += 1
+                return f
+            self.misses += 1
+        f = self.build(t)
+        with self.lock:
+            self.entries[t] = f
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return f
+
+    def cache_info(self) -> SerdeCacheInfo:
+        with self.lock:
+            return SerdeCacheInfo(
+                self.hits, self.misses, self.maxsize, len(self.entries)
+            )
+
+    def cache_clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def allow_recursion(handler):
+    """
+    Wrap a `TypeTree` handler for dataclasses so that a dataclass that refers
+    to itself, directly or through other types, resolves to the handler under
+    construction rather than recursing forever.
+    """
+
+    def f(origin: Type, args_type: ArgsType, type_tree: TypeTree):
+        type_pair = (origin, args_type)
+        resolved = []
+
+        def forward(*args):
+            return resolved[0](*args)
+
+        type_tree.simple_type_lookup[type_pair] = forward
+        try:
+            r = handler(origin, args_type, type_tree)
+        finally:
+            del type_tree.simple_type_lookup[type_pair]
+        resolved.append(r)
+        return r
+
+    return f
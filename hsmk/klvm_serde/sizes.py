@@ -0,0 +1,202 @@
+"""
+Account for how much of a serialized value each of its parts takes up.
+
+`size_report_for_type(t)` returns a function that breaks a value of type `t`
+down the way it's serialized: into dataclass fields (using the storage form
+of fields with an `alt_serde_type`), list items and tuple items. Each part
+gets its raw serialized size and its share of the whole, zlib-compressed.
+
+The whole is compressed as one stream, and a part's share is how much the
+compressed size of the stream grows over the part's bytes. So a small field
+isn't charged zlib's header and trailer, a repeated part costs little after
+its first appearance, and shares add up to the compressed size of the whole.
+The difference between a node's size and the sum of its children is the
+framing (cons boxes, keys and so on), and for the whole, zlib's overhead too.
+As zlib can hold bytes back until it sees what follows, a tiny part's share
+can be off by a byte or two, even below zero.
+"""
+
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import zlib
+
+from .iterative import (
+    ALT,
+    DATACLASS,
+    LIST,
+    OPTIONAL,
+    TUPLE,
+    SCHEMA_CACHE,
+    Schema,
+    default_for_field,
+    serialize,
+)
+
+
+@dataclass
+class SizeReport:
+    name: str
+    raw: int
+    compressed: int
+    children: List["SizeReport"] = field(default_factory=list)
+    # where this part starts in the serialized whole
+    start: int = 0
+
+    def walk(self, path: str = "") -> Iterator[Tuple[str, "SizeReport"]]:
+        path = (
+            f"{path}.{self.name}" if path and self.name[0] != "[" else path + self.name
+        )
+        yield path, self
+        for child in self.children:
+            yield from child.walk(path)
+
+    def totals(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Sum raw and compressed sizes over the parts with the same path once
+        list indices are replaced with `[*]`, so (for example) the sizes of
+        every coin's puzzle reveal are added together.
+        """
+        totals: Dict[str, Tuple[int, int]] = {}
+        for path, report in self.walk():
+            generic_path = generic_path_for_path(path)
+            raw, compressed = totals.get(generic_path, (0, 0))
+            totals[generic_path] = (raw + report.raw, compressed + report.compressed)
+        return totals
+
+    def lines(self, max_depth: Optional[int] = None) -> List[str]:
+        total = self.raw or 1
+        lines = [f"{'raw':>10} {'zlib':>10} {'raw %':>7}  part"]
+
+        def add_lines(report: SizeReport, depth: int) -> None:
+            lines.append(
+                f"{report.raw:>10} {report.compressed:>10}"
+                f" {100 * report.raw / total:>6.1f}%  {'  ' * depth}{report.name}"
+            )
+            if max_depth is None or depth < max_depth:
+                for child in report.children:
+                    add_lines(child, depth + 1)
+
+        add_lines(self, 0)
+        return lines
+
+
+def compressed_sizes_at(blob: bytes, offsets: Iterable[int]) -> Dict[int, int]:
+    """
+    Return the zlib-compressed size of `blob[:offset]` for each offset, with
+    `blob` compressed as one stream.
+    """
+    sizes = {}
+    compressor = zlib.compressobj(level=9)
+    compressed = 0
+    cursor = 0
+    for offset in sorted(set(offsets)):
+        compressed += len(compressor.compress(blob[cursor:offset]))
+        cursor = offset
+        # finishing a copy leaves the stream itself open
+        sizes[offset] = compressed + len(compressor.copy().flush())
+    return sizes
+
+
+def generic_path_for_path(path: str) -> str:
+    parts = []
+    for part in path.split("["):
+        if "]" in part:
+            index, rest = part.split("]", 1)
+            if index.isdigit():
+                part = "*]" + rest
+        parts.append(part)
+    return "[".join(parts)
+
+
+def size_report_for_type(
+    t: type, labels: Optional[Dict[Any, Sequence[str]]] = None
+) -> Callable[..., SizeReport]:
+    """
+    `labels` names the items of tuple types, like
+    `{Tuple[bytes, int]: ["id", "amount"]}`. Unnamed tuple items are
+    reported by index, as `#0`, `#1` and so on.
+    """
+    schema = SCHEMA_CACHE(t)
+    labels_for_args = {
+        tuple(_.__args__): list(names) for _, names in (labels or {}).items()
+    }
+
+    def report_for(
+        schema: Schema, value: Any, name: str, start: int, reports: List[SizeReport]
+    ) -> SizeReport:
+        if schema.kind == ALT:
+            storage_value = schema.from_storage(value)
+            return report_for(schema.storage, storage_value, name, start, reports)
+        report = SizeReport(name, len(serialize(schema, value)), 0, start=start)
+        reports.append(report)
+        children = report.children
+        kind = schema.kind
+        # `cursor` follows each child through `report`'s serialization, past
+        # the framing in front of it
+        cursor = start
+        if kind == LIST:
+            for idx, item in enumerate(value):
+                child = report_for(schema.item, item, f"[{idx}]", cursor + 1, reports)
+                children.append(child)
+                cursor = child.start + child.raw
+        elif kind == TUPLE:
+            names = labels_for_args.get(schema.args) or []
+            last = len(schema.items) - 1
+            for idx, (item_schema, item) in enumerate(zip(schema.items, value)):
+                item_name = names[idx] if idx < len(names) else f"#{idx}"
+                # the last item of a frugal tuple isn't in a cons box
+                cursor += 0 if schema.is_frugal and idx == last else 1
+                child = report_for(item_schema, item, item_name, cursor, reports)
+                children.append(child)
+                cursor = child.start + child.raw
+        elif kind == OPTIONAL:
+            if value is not None:
+                # after `(1 .`
+                child = report_for(schema.item, value, name, start + 2, reports)
+                report.children = child.children
+        elif kind == DATACLASS:
+            last = len(schema.items) - (0 if schema.key_based else 1)
+            for idx, (item_schema, field_name) in enumerate(
+                zip(schema.items, schema.names)
+            ):
+                cursor += 0 if schema.is_frugal and idx == last else 1
+                v = getattr(value, field_name)
+                child = report_for(item_schema, v, field_name, cursor, reports)
+                children.append(child)
+                cursor = child.start + child.raw
+            # a dataclass with key-based fields is frugal, so their list is
+            # last, and each is in a cons box as `(key . value)`
+            for _key, key_atom, field_name, field_schema, f in schema.key_based:
+                v = getattr(value, field_name)
+                if v != default_for_field(f):
+                    cursor += 2 + len(key_atom)
+                    child = report_for(field_schema, v, field_name, cursor, reports)
+                    children.append(child)
+                    cursor = child.start + child.raw
+        return report
+
+    def size_report(value: Any, name: Optional[str] = None) -> SizeReport:
+        if name is None:
+            name = getattr(t, "__name__", None) or str(t)
+        reports: List[SizeReport] = []
+        report = report_for(schema, value, name, 0, reports)
+        offsets = [_.start for _ in reports] + [_.start + _.raw for _ in reports]
+        sizes = compressed_sizes_at(serialize(schema, value), offsets)
+        # zlib's header is charged to the whole, not the first part
+        sizes[0] = 0
+        for _ in reports:
+            _.compressed = sizes[_.start + _.raw] - sizes[_.start]
+        return report
+
+    return size_report
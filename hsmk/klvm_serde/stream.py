@@ -0,0 +1,649 @@
+"""
+Serialize straight to and from the klvm wire format without building a
+`Program` tree.
+
+`to_program_for_type` creates a `Program` for every node of the output, which
+is then serialized in a second pass. The functions built by `to_stream_for_type`
+write bytes to a sink (`bytearray.extend` or a file's `write`) as they walk the
+object, so the only memory used is the output itself. The bytes written are
+identical to `bytes(to_program_for_type(t)(item))`.
+
+Going the other way, `from_stream_for_type` parses the serialized bytes
+directly from a `Reader`, building values as it goes. Only the values typed as
+`Program` are turned into `Program` objects, one subtree at a time, so decoding
+a file needs no more memory than the largest such subtree (plus the result).
+"""
+
+from dataclasses import MISSING, is_dataclass
+from typing import Any, BinaryIO, Callable, Optional, Tuple, Type, Union
+
+from chik_base.meta.type_tree import ArgsType, CompoundLookup, TypeTree
+from chik_base.meta.typing import GenericAlias
+
+from klvm_rs import Program  # type: ignore
+from klvm_rs.ser import size_blob_for_blob  # type: ignore
+
+from . import (
+    EncodingError,
+    Frugal,
+    tuple_frugal,
+    types_for_fields,
+)
+from .serde_cache import SerdeCache, allow_recursion
+
+Write = Callable[[bytes], Any]
+ToStream = Callable[[Any, Write], None]
+
+CONS_BOX = b"\xff"
+NULL = b"\x80"
+
+
+def program_for_blob(blob: bytes) -> Program:
+    """
+    Parse `blob` into a `Program` that remembers its serialization, so
+    `bytes(program)` (and `hsmk.klvm.tree_hash`) don't have to serialize it
+    again.
+    """
+    program = Program.from_bytes(blob)
+    program._cached_serialization = blob
+    return program
+
+
+CONS_BOX_MARKER = 0xFF
+BACK_REFERENCE_MARKER = 0xFE
+MAX_SINGLE_BYTE = 0x7F
+
+
+def atom_size_byte_count(b: int) -> int:
+    """
+    Return how many bytes, the first byte `b` included, hold the size of an
+    atom serialized starting with `b` (which must be over 0x80).
+    """
+    byte_count = 0
+    bit_mask = 0x80
+    while b & bit_mask:
+        byte_count += 1
+        bit_mask >>= 1
+    if byte_count > 5:
+        raise EncodingError("bad encoding")
+    return byte_count
+
+
+def atom_size_for_blob(blob: bytes, cursor: int, b: int) -> Tuple[int, int]:
+    """
+    Decode the size of an atom serialized starting with `b`, whose remaining
+    size bytes (if any) start at `cursor` in `blob`. Return the size, and the
+    offset of the atom's contents. `blob` is read in place, never copied.
+    """
+    byte_count = atom_size_byte_count(b)
+    end = cursor + byte_count - 1
+    if end > len(blob):
+        raise EncodingError("bad encoding")
+    size = b & (0xFF >> byte_count)
+    while cursor < end:
+        size = (size << 8) | blob[cursor]
+        cursor += 1
+    return size, cursor
+
+
+def write_atom(blob: bytes, write: Write) -> None:
+    size = len(blob)
+    if size == 0:
+        write(NULL)
+        return
+    if size == 1 and blob[0] <= 0x7F:
+        write(blob)
+        return
+    write(size_blob_for_blob(blob))
+    write(blob)
+
+
+def stream_bytes(item: bytes, write: Write) -> None:
+    write_atom(item, write)
+
+
+def stream_str(item: str, write: Write) -> None:
+    write_atom(item.encode(), write)
+
+
+def stream_int(item: int, write: Write) -> None:
+    write_atom(Program.int_to_bytes(item), write)
+
+
+def stream_program(item: Program, write: Write) -> None:
+    write(bytes(item))
+
+
+def stream_for_list(origin, args, type_tree: TypeTree) -> ToStream:
+    write_item = type_tree(args[0])
+
+    def stream_list(items, write: Write) -> None:
+        for item in items:
+            write(CONS_BOX)
+            write_item(item, write)
+        write(NULL)
+
+    return stream_list
+
+
+def stream_for_optional(origin, args, type_tree: TypeTree) -> ToStream:
+    if len(args) == 2 and type(None) is args[1]:
+        write_item = type_tree(args[0])
+
+        def stream_optional(item, write: Write) -> None:
+            if item is None:
+                write(CONS_BOX + NULL + NULL)
+            else:
+                write(CONS_BOX + b"\x01")
+                write_item(item, write)
+
+        return stream_optional
+    else:
+        raise ValueError("No serialization support for Union types (besides Optional)")
+
+
+def stream_for_tuple(origin, args, type_tree: TypeTree) -> ToStream:
+    write_items = [type_tree(_) for _ in args]
+
+    def stream_tuple(items, write: Write) -> None:
+        item_list = list(items)
+        if len(item_list) != len(write_items):
+            raise EncodingError("incorrect number of items in tuple")
+        for write_f, item in zip(write_items, item_list):
+            write(CONS_BOX)
+            write_f(item, write)
+        write(NULL)
+
+    return stream_tuple
+
+
+def stream_for_tuple_frugal(origin, args, type_tree: TypeTree) -> ToStream:
+    write_items = [type_tree(_) for _ in args]
+    last_write_f = write_items[-1]
+    first_write_items = write_items[:-1]
+
+    def stream_tuple_frugal(items, write: Write) -> None:
+        if len(items) != len(write_items):
+            raise EncodingError("incorrect number of items in tuple")
+        for write_f, item in zip(first_write_items, items):
+            write(CONS_BOX)
+            write_f(item, write)
+        last_write_f(items[-1], write)
+
+    return stream_tuple_frugal
+
+
+STREAM_COMPOUND_TYPE_LOOKUP: CompoundLookup[ToStream] = {
+    list: stream_for_list,
+    tuple: stream_for_tuple,
+    tuple_frugal: stream_for_tuple_frugal,
+    Union: stream_for_optional,
+}
+
+
+@allow_recursion
+def stream_dataclass(origin: Type, args_type: ArgsType, type_tree: TypeTree):
+    def morph_call(call, f):
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            _type, from_storage, _to_storage = alt_serde_type
+
+            def f(x, write: Write) -> None:
+                call(from_storage(x), write)
+
+            return f
+        return call
+
+    location_based, key_based = types_for_fields(origin, morph_call, type_tree)
+
+    names = tuple(name for name, type_hint in location_based)
+    types = tuple(type_hint for name, type_hint in location_based)
+    is_frugal = bool(key_based) or issubclass(origin, Frugal)
+    if key_based:
+        # the key-value list is the final item of a frugal tuple, written below
+        write_items = [type_tree(_) for _ in types]
+    else:
+        tuple_type = GenericAlias(tuple_frugal if is_frugal else tuple, types)
+        write_tuple = type_tree(tuple_type)
+
+    def stream(item, write: Write) -> None:
+        if not key_based:
+            write_tuple([getattr(item, name) for name in names], write)
+            return
+        for write_f, name in zip(write_items, names):
+            write(CONS_BOX)
+            write_f(getattr(item, name), write)
+        for key, name, call, default_value in key_based:
+            a = getattr(item, name)
+            if a == default_value:
+                continue
+            write(CONS_BOX + CONS_BOX)
+            write_atom(key.encode(), write)
+            call(a, write)
+        write(NULL)
+
+    return stream
+
+
+def fail_stream(
+    origin: Type, args_type: ArgsType, type_tree: TypeTree
+) -> Optional[ToStream]:
+    if issubclass(origin, bytes):
+        return stream_bytes
+
+    if issubclass(origin, str):
+        return stream_str
+
+    if issubclass(origin, int):
+        return stream_int
+
+    if is_dataclass(origin):
+        return stream_dataclass(origin, args_type, type_tree)
+
+    if hasattr(origin, "__bytes__"):
+        return lambda x, write: write_atom(bytes(x), write)
+
+    return None
+
+
+def build_to_stream_for_type(t: type) -> ToStream:
+    return TypeTree(
+        {(Program, None): stream_program},
+        STREAM_COMPOUND_TYPE_LOOKUP,
+        fail_stream,
+    )(t)
+
+
+TO_STREAM_CACHE: SerdeCache[ToStream] = SerdeCache(build_to_stream_for_type)
+
+
+def to_stream_for_type(t: type) -> ToStream:
+    """
+    Return a function `f(item, write)` that serializes `item` of type `t`
+    by calling `write` with successive chunks of bytes.
+    """
+    return TO_STREAM_CACHE(t)
+
+
+def write_for_sink(sink: Union[bytearray, BinaryIO]) -> Write:
+    """
+    Accept a `bytearray` or a file-like object with a `write` method.
+    """
+    if isinstance(sink, bytearray):
+        return sink.extend
+    return sink.write
+
+
+# deserialization
+
+
+class BackReferenceError(EncodingError):
+    pass
+
+
+class Reader:
+    """
+    Sequential access to a serialized klvm stream. Subclasses implement
+    `read_byte`, `peek_byte`, `read` and `read_program`.
+    """
+
+    def read_byte(self) -> int:
+        raise NotImplementedError
+
+    def peek_byte(self) -> int:
+        raise NotImplementedError
+
+    def read(self, size: int) -> bytes:
+        raise NotImplementedError
+
+    def read_program(self) -> Program:
+        raise NotImplementedError
+
+    def read_atom_for_first_byte(self, b: int) -> bytes:
+        if b == 0x80:
+            return b""
+        if b <= MAX_SINGLE_BYTE:
+            return bytes([b])
+        return self.read(self.atom_size_for_first_byte(b))
+
+    def atom_size_for_first_byte(self, b: int) -> int:
+        if b == CONS_BOX_MARKER:
+            raise EncodingError("expected atom")
+        if b == BACK_REFERENCE_MARKER:
+            raise BackReferenceError("back references can't be streamed")
+        extra_bytes = self.read(atom_size_byte_count(b) - 1)
+        return atom_size_for_blob(extra_bytes, 0, b)[0]
+
+    def read_atom(self) -> bytes:
+        return self.read_atom_for_first_byte(self.read_byte())
+
+    def skip(self) -> None:
+        """
+        Skip over one complete subtree.
+        """
+        to_skip = 1
+        while to_skip:
+            b = self.read_byte()
+            if b == CONS_BOX_MARKER:
+                to_skip += 1
+                continue
+            if b > MAX_SINGLE_BYTE:
+                self.read(self.atom_size_for_first_byte(b))
+            to_skip -= 1
+
+
+class BufferReader(Reader):
+    """
+    Read from `bytes`, `bytearray` or `memoryview` without copying the buffer.
+    """
+
+    def __init__(self, buffer, cursor: int = 0):
+        if not isinstance(buffer, bytes):
+            buffer = memoryview(buffer).cast("B")
+        self.buffer = buffer
+        self.cursor = cursor
+
+    def read_byte(self) -> int:
+        cursor = self.cursor
+        if cursor >= len(self.buffer):
+            raise EncodingError("bad encoding")
+        self.cursor = cursor + 1
+        return self.buffer[cursor]
+
+    def peek_byte(self) -> int:
+        if self.cursor >= len(self.buffer):
+            raise EncodingError("bad encoding")
+        return self.buffer[self.cursor]
+
+    def read(self, size: int) -> bytes:
+        start = self.cursor
+        end = start + size
+        if end > len(self.buffer):
+            raise EncodingError("bad encoding")
+        self.cursor = end
+        return bytes(self.buffer[start:end])
+
+    def read_program(self) -> Program:
+        start = self.cursor
+        self.skip()
+        return program_for_blob(bytes(self.buffer[start : self.cursor]))
+
+
+class FileReader(Reader):
+    """
+    Read from a binary file-like object, one node at a time.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.lookahead: Optional[int] = None
+        self.capture: Optional[bytearray] = None
+
+    def read_byte(self) -> int:
+        b = self.lookahead
+        if b is None:
+            blob = self.f.read(1)
+            if len(blob) == 0:
+                raise EncodingError("bad encoding")
+            b = blob[0]
+        else:
+            self.lookahead = None
+        if self.capture is not None:
+            self.capture.append(b)
+        return b
+
+    def peek_byte(self) -> int:
+        if self.lookahead is None:
+            blob = self.f.read(1)
+            if len(blob) == 0:
+                raise EncodingError("bad encoding")
+            self.lookahead = blob[0]
+        return self.lookahead
+
+    def read(self, size: int) -> bytes:
+        blob = b""
+        if size > 0 and self.lookahead is not None:
+            blob = bytes([self.lookahead])
+            self.lookahead = None
+        blob += self.f.read(size - len(blob))
+        if len(blob) != size:
+            raise EncodingError("bad encoding")
+        if self.capture is not None:
+            self.capture.extend(blob)
+        return blob
+
+    def read_program(self) -> Program:
+        self.capture = bytearray()
+        try:
+            self.skip()
+            return program_for_blob(bytes(self.capture))
+        finally:
+            self.capture = None
+
+
+def reader_for_source(source) -> Reader:
+    """
+    Accept a `Reader`, a buffer (`bytes`, `bytearray` or `memoryview`) or a
+    binary file-like object with a `read` method.
+    """
+    if isinstance(source, Reader):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BufferReader(source)
+    return FileReader(source)
+
+
+FromStream = Callable[[Reader], Any]
+
+
+def expect_cons_box(reader: Reader, message: str = "expected pair") -> None:
+    b = reader.peek_byte()
+    if b != CONS_BOX_MARKER:
+        if b == BACK_REFERENCE_MARKER:
+            raise BackReferenceError("back references can't be streamed")
+        raise EncodingError(message)
+    reader.read_byte()
+
+
+def read_bytes(reader: Reader) -> bytes:
+    return reader.read_atom()
+
+
+def read_str(reader: Reader) -> str:
+    return reader.read_atom().decode()
+
+
+def read_int(reader: Reader) -> int:
+    return Program.int_from_bytes(reader.read_atom())
+
+
+def read_program(reader: Reader) -> Program:
+    return reader.read_program()
+
+
+def read_list_items(reader: Reader, read_item: FromStream) -> list:
+    items = []
+    while reader.peek_byte() == CONS_BOX_MARKER:
+        reader.read_byte()
+        items.append(read_item(reader))
+    # like `Program.as_iter`, ignore the value of the terminating atom
+    reader.read_atom()
+    return items
+
+
+def read_keys(reader: Reader) -> list:
+    """
+    Read the keys of a list of `(key . value)` pairs, skipping over the values.
+    """
+
+    def read_key(reader: Reader) -> bytes:
+        expect_cons_box(reader)
+        key = reader.read_atom()
+        reader.skip()
+        return key
+
+    return read_list_items(reader, read_key)
+
+
+def de_stream_for_list(origin, args, type_tree: TypeTree) -> FromStream:
+    read_item = type_tree(args[0])
+
+    def read_list(reader: Reader) -> list:
+        return read_list_items(reader, read_item)
+
+    return read_list
+
+
+def de_stream_for_tuple(origin, args, type_tree: TypeTree) -> FromStream:
+    read_items = [type_tree(_) for _ in args]
+
+    def read_tuple(reader: Reader) -> Tuple[Any, ...]:
+        values = []
+        for read_item in read_items:
+            expect_cons_box(reader, "wrong size program")
+            values.append(read_item(reader))
+        if reader.peek_byte() == CONS_BOX_MARKER:
+            raise EncodingError("wrong size program")
+        reader.read_atom()
+        return tuple(values)
+
+    return read_tuple
+
+
+def de_stream_for_tuple_frugal(origin, args, type_tree: TypeTree) -> FromStream:
+    read_items = [type_tree(_) for _ in args]
+    first_read_items = read_items[:-1]
+    last_read_item = read_items[-1]
+
+    def read_tuple_frugal(reader: Reader) -> Tuple[Any, ...]:
+        values = []
+        for read_item in first_read_items:
+            expect_cons_box(reader)
+            values.append(read_item(reader))
+        values.append(last_read_item(reader))
+        return tuple(values)
+
+    return read_tuple_frugal
+
+
+def de_stream_for_optional(origin, args, type_tree: TypeTree) -> FromStream:
+    if len(args) == 2 and type(None) is args[1]:
+        read_item = type_tree(args[0])
+
+        def read_optional(reader: Reader):
+            expect_cons_box(reader)
+            if reader.peek_byte() == 0x80:
+                reader.read_byte()
+                reader.skip()
+                return None
+            reader.skip()
+            return read_item(reader)
+
+        return read_optional
+    else:
+        raise ValueError("No serialization support for Union types (besides Optional)")
+
+
+DE_STREAM_COMPOUND_TYPE_LOOKUP: CompoundLookup[FromStream] = {
+    list: de_stream_for_list,
+    tuple: de_stream_for_tuple,
+    tuple_frugal: de_stream_for_tuple_frugal,
+    Union: de_stream_for_optional,
+}
+
+
+@allow_recursion
+def de_stream_dataclass(origin: Type, args_type: ArgsType, type_tree: TypeTree):
+    def morph_call(call, f):
+        alt_serde_type = f.metadata.get("alt_serde_type")
+        if alt_serde_type:
+            _type, _from_storage, to_storage = alt_serde_type
+
+            def f(reader: Reader):
+                return to_storage(call(reader))
+
+            return f
+        return call
+
+    location_based, key_based = types_for_fields(origin, morph_call, type_tree)
+
+    types = tuple(type_hint for name, type_hint in location_based)
+    is_frugal = bool(key_based) or issubclass(origin, Frugal)
+    if not key_based:
+        tuple_type = GenericAlias(tuple_frugal if is_frugal else tuple, types)
+        read_tuple = type_tree(tuple_type)
+
+        def de(reader: Reader):
+            return origin(*read_tuple(reader))
+
+        return de
+
+    read_items = [type_tree(_) for _ in types]
+    key_lookup = {key.encode(): (name, call) for key, name, call, _ in key_based}
+
+    def de_with_keys(reader: Reader):
+        args = []
+        for read_item in read_items:
+            expect_cons_box(reader)
+            args.append(read_item(reader))
+        kwargs = {}
+        while reader.peek_byte() == CONS_BOX_MARKER:
+            reader.read_byte()
+            expect_cons_box(reader)
+            key = reader.read_atom()
+            if key in key_lookup:
+                name, call = key_lookup[key]
+                kwargs[name] = call(reader)
+            else:
+                reader.skip()
+        reader.read_atom()
+        for key, name, call, default_value in key_based:
+            if name not in kwargs:
+                if default_value == MISSING:
+                    raise EncodingError(
+                        f"missing required field for {name} with key {key}"
+                    )
+                kwargs[name] = default_value
+        return origin(*args, **kwargs)
+
+    return de_with_keys
+
+
+def fail_de_stream(
+    origin: Type, args_type: ArgsType, type_tree: TypeTree
+) -> Optional[FromStream]:
+    if issubclass(origin, int):
+        return read_int
+
+    if issubclass(origin, bytes):
+        return read_bytes
+
+    if issubclass(origin, str):
+        return read_str
+
+    if is_dataclass(origin):
+        return de_stream_dataclass(origin, args_type, type_tree)
+
+    if hasattr(origin, "from_bytes"):
+        return lambda reader: origin.from_bytes(reader.read_atom())
+
+    return None
+
+
+def build_from_stream_for_type(t: type) -> FromStream:
+    return TypeTree(
+        {(Program, None): read_program},
+        DE_STREAM_COMPOUND_TYPE_LOOKUP,
+        fail_de_stream,
+    )(t)
+
+
+FROM_STREAM_CACHE: SerdeCache[FromStream] = SerdeCache(build_from_stream_for_type)
+
+
+def from_stream_for_type(t: type) -> FromStream:
+    """
+    Return a function `f(reader)` that parses a value of type `t` from
+    a `Reader`.
+    """
+    return FROM_STREAM_CACHE(t)
@@ -0,0 +1,340 @@
+"""
+A content-addressed cache of puzzle execution results.
+
+Running a puzzle is a pure function of the puzzle and its solution, so its
+cost and output can be cached by `(puzzle tree hash, solution tree hash)`.
+Results are kept in a bounded in-memory LRU, and optionally in a sqlite file,
+so examining or signing the same spend again, even from another process,
+doesn't run klvm at all.
+
+Results are stored serialized, and each caller gets its own `Program` for
+one. A klvm_rs `Program` can only be used on the thread that created it, so
+this is what lets one cache be shared by several threads.
+
+Each row on disk carries a sha256 checksum of its contents, and a row that
+fails it is dropped and recomputed. The checksum catches corruption, not
+tampering: whatever can write the cache file can change what a spend appears
+to do, so keep it somewhere only the signer can write.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import hashlib
+import sqlite3
+import threading
+
+from chik_base.atoms import bytes32
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.consensus.conditions import MAX_COST
+from hsmk.klvm.tree_hash import tree_hash
+from hsmk.klvm_serde.stream import program_for_blob
+
+from .standard_spend import run_standard_spend
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS conditions ("
+    "key BLOB PRIMARY KEY, cost INTEGER NOT NULL, "
+    "result BLOB NOT NULL, checksum BLOB NOT NULL)"
+)
+
+# the start of the `EvalError` message klvm raises when a run costs too much
+COST_EXCEEDED = "cost exceeded"
+
+# sqlite connections inherited across `fork()`, which must never be closed
+INHERITED_CONNECTIONS: List[sqlite3.Connection] = []
+
+
+class CostBudgetExceeded(ValueError):
+    """
+    Raised when coin spend `coin_name` costs `cost` (or, if `stopped`, more
+    than `cost`, as its run was stopped there), with `total` of the budget of
+    `max_cost` already charged to other coin spends.
+    """
+
+    def __init__(
+        self,
+        coin_name: bytes32,
+        cost: int,
+        total: int,
+        max_cost: int,
+        stopped: bool = False,
+    ):
+        self.coin_name = coin_name
+        self.cost = cost
+        self.total = total
+        self.max_cost = max_cost
+        self.stopped = stopped
+        more_than = "more than " if stopped else ""
+        super().__init__(
+            f"coin spend {coin_name.hex()} costs {more_than}{cost}, with {total}"
+            f" of the budget of {max_cost} already spent"
+        )
+
+    def __reduce__(self):
+        args = (self.coin_name, self.cost, self.total, self.max_cost, self.stopped)
+        return type(self), args
+
+
+class CostBudget:
+    """
+    A klvm cost budget shared by all the coin spends of a request, so the time
+    a request can take is bounded however many heavy spends it has.
+
+    Each coin spend is charged once, by coin id, however many times its
+    puzzle is run or found in a cache; `costs` has what each was charged.
+    """
+
+    def __init__(self, max_cost: int):
+        self.max_cost = max_cost
+        self.lock = threading.Lock()
+        self.costs: Dict[bytes32, int] = {}
+        self.total = 0
+
+    def max_cost_for(self, coin_name: bytes32) -> int:
+        with self.lock:
+            cost = self.costs.get(coin_name)
+            if cost is not None:
+                return cost
+            return max(0, self.max_cost - self.total)
+
+    def charge(self, coin_name: bytes32, cost: int) -> None:
+        with self.lock:
+            if coin_name in self.costs:
+                return
+            # a charge over the budget isn't made, so the total never exceeds
+            # it, even with several threads charging at once
+            if self.total + cost > self.max_cost:
+                raise CostBudgetExceeded(coin_name, cost, self.total, self.max_cost)
+            self.costs[coin_name] = cost
+            self.total += cost
+
+    def stopped(self, coin_name: bytes32, limit: int) -> CostBudgetExceeded:
+        with self.lock:
+            total = self.total
+        return CostBudgetExceeded(coin_name, limit, total, self.max_cost, stopped=True)
+
+    def run(
+        self,
+        coin_name: bytes32,
+        run_for_blob: Callable[[int], Tuple[int, bytes]],
+        max_cost: int = MAX_COST,
+    ) -> Tuple[int, bytes]:
+        """
+        Call `run_for_blob(limit)`, where `limit` is `max_cost` or what's left
+        of the budget, whichever is less, and charge the cost.
+
+        Raises `CostBudgetExceeded` if what's left isn't enough.
+        """
+        limit = min(max_cost, self.max_cost_for(coin_name))
+        # to klvm, a `max_cost` of 0 means no limit at all
+        if limit <= 0:
+            raise self.stopped(coin_name, 0)
+        try:
+            cost, blob = run_for_blob(limit)
+        except ValueError as ex:
+            if limit < max_cost and str(ex.args[0]).startswith(COST_EXCEEDED):
+                raise self.stopped(coin_name, limit) from ex
+            raise
+        self.charge(coin_name, cost)
+        return cost, blob
+
+
+class ConditionsCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class ConditionsCache:
+    """
+    A bounded, thread-safe LRU cache of `(cost, result)` for puzzle runs, backed
+    by an optional sqlite file at `path`. Hits from the file count as hits.
+
+    A run that fails, or exceeds its `max_cost`, isn't cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # the disk tier has its own lock, so threads using the in-memory tier
+        # don't wait on sqlite
+        self.db_lock = threading.Lock()
+        self.db: Optional[sqlite3.Connection] = None
+        self.path: Optional[str] = None
+        if path is not None:
+            self.attach(path)
+
+    def attach(self, path: str) -> None:
+        """
+        Use the sqlite file at `path` (creating it if needed) as the disk tier.
+        """
+        db = sqlite3.connect(path, check_same_thread=False)
+        # a lost write is just a miss next time, so don't wait on fsync for it
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(SCHEMA)
+        db.commit()
+        with self.db_lock:
+            if self.db is not None:
+                self.db.close()
+            self.db = db
+            self.path = path
+
+    def close(self) -> None:
+        with self.db_lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+                self.path = None
+
+    def reopen(self, path: Optional[str]) -> None:
+        """
+        Call this first in a worker process, which may have been forked with
+        this cache's sqlite file open, then use the file at `path`, if any.
+
+        A sqlite connection mustn't be used, or even closed, across `fork()`,
+        so an inherited one is kept, unused, for the life of the process.
+        """
+        # another thread may have held these when the process forked
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        if self.db is not None:
+            INHERITED_CONNECTIONS.append(self.db)
+            self.db = None
+            self.path = None
+        if path is not None:
+            self.attach(path)
+
+    def run(
+        self, puzzle: Program, solution: Program, max_cost: int = MAX_COST
+    ) -> Tuple[int, Program]:
+        """
+        Return `puzzle.run_with_cost(solution, max_cost=max_cost)`, from the
+        cache if possible.
+        """
+        cost, blob = self.run_for_blob(puzzle, solution, max_cost)
+        return cost, program_for_blob(blob)
+
+    def run_for_blob(
+        self, puzzle: Program, solution: Program, max_cost: int = MAX_COST
+    ) -> Tuple[int, bytes]:
+        """
+        Like `run`, but return the result serialized.
+
+        Standard spends are answered by `run_standard_spend` without running
+        klvm at all, or touching the cache.
+        """
+        # this is cheaper than even working out the key, so it's not cached
+        standard = run_standard_spend(bytes(puzzle), bytes(solution))
+        if standard is not None and standard[0] <= max_cost:
+            return standard
+        key = tree_hash(puzzle) + solution.tree_hash()
+        cached = self.lookup(key)
+        if cached is not None and cached[0] <= max_cost:
+            return cached
+        cost, result = puzzle.run_with_cost(solution, max_cost=max_cost)
+        blob = bytes(result)
+        self.add(key, cost, blob)
+        return cost, blob
+
+    def lookup(self, key: bytes) -> Optional[Tuple[int, bytes]]:
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached
+        cached = self.lookup_db(key)
+        with self.lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.add_entry(key, cached)
+            return cached
+
+    def lookup_db(self, key: bytes) -> Optional[Tuple[int, bytes]]:
+        with self.db_lock:
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                "SELECT cost, result, checksum FROM conditions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            cost, result, checksum = row
+            if checksum != checksum_for_row(key, cost, result):
+                self.db.execute("DELETE FROM conditions WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            return cost, result
+
+    def add(self, key: bytes, cost: int, blob: bytes) -> None:
+        with self.lock:
+            self.add_entry(key, (cost, blob))
+        with self.db_lock:
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO conditions VALUES (?, ?, ?, ?)",
+                    (key, cost, blob, checksum_for_row(key, cost, blob)),
+                )
+                self.db.commit()
+
+    def add_entry(self, key: bytes, value: Tuple[int, bytes]) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def cache_info(self) -> ConditionsCacheInfo:
+        with self.lock:
+            return ConditionsCacheInfo(
+                self.hits, self.misses, self.maxsize, len(self.entries)
+            )
+
+    def cache_clear(self) -> None:
+        """
+        Clear the in-memory tier. The sqlite file, if any, is left alone.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def checksum_for_row(key: bytes, cost: int, result: bytes) -> bytes:
+    return hashlib.sha256(key + cost.to_bytes(8, "big") + result).digest()
+
+
+CONDITIONS_CACHE = ConditionsCache()
+
+
+def run_puzzle(
+    puzzle: Program, solution: Program, max_cost: int = MAX_COST
+) -> Tuple[int, Program]:
+    return CONDITIONS_CACHE.run(puzzle, solution, max_cost)
+
+
+def run_puzzle_for_blob(
+    puzzle: Program, solution: Program, max_cost: int = MAX_COST
+) -> Tuple[int, bytes]:
+    return CONDITIONS_CACHE.run_for_blob(puzzle, solution, max_cost)
+
+
+def run_serialized_puzzle(
+    puzzle_blob: bytes, solution_blob: bytes, max_cost: int = MAX_COST
+) -> Tuple[int, bytes]:
+    """
+    Like `run_puzzle_for_blob`, but with the puzzle and solution serialized
+    too, so it can be called from any thread.
+    """
+    return CONDITIONS_CACHE.run_for_blob(
+        program_for_blob(puzzle_blob), program_for_blob(solution_blob), max_cost
+    )
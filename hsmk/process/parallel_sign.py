@@ -0,0 +1,144 @@
+"""
+Sign the coin spends of an `UnsignedSpend` across a pool of processes.
+
+Running each puzzle, deriving keys, and BLS signing are all CPU-bound, so
+threads don't help. `sign_in_parallel` splits the coin spends, in order, into
+chunks, and signs each chunk with `sign_for_coin_spend` in a worker process.
+The results are concatenated in chunk order, so the `SignatureInfo` list is
+exactly what `sign` returns.
+
+Keys and programs can't be pickled, so everything crosses process boundaries
+serialized. The wallet and the hints are sent once per worker, when it starts;
+each job is just a chunk of coin spends. Each worker opens the conditions
+cache file again rather than use a connection inherited across `fork()`.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import os
+
+from chik_base.bls12_381 import BLSSecretExponent
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.core.unsigned_spend import SignatureInfo, UnsignedSpend
+from hsmk.klvm_serde import from_program_for_type, to_program_for_type
+
+from .conditions_cache import CONDITIONS_CACHE, CostBudget
+from .sign import (
+    Wallet,
+    build_path_hints_lookup,
+    build_sum_hints_lookup,
+    conditions_for_coin_spends,
+    sign,
+    sign_for_coin_spend,
+    wallet_index_for_wallet,
+)
+from .wallet_index import (
+    FROM_PROGRAM_STORED_INDEX,
+    TO_PROGRAM_STORED_INDEX,
+    WalletIndex,
+)
+
+# more chunks than workers, so a worker that gets slow coin spends doesn't
+# hold up the others
+CHUNKS_PER_WORKER = 4
+
+TO_PROGRAM_SIGNATURE_INFOS = to_program_for_type(List[SignatureInfo])
+FROM_PROGRAM_SIGNATURE_INFOS = from_program_for_type(List[SignatureInfo])
+
+# set in each worker process by `init_worker`
+WORKER_STATE: Dict[str, Any] = {}
+
+
+def init_worker(
+    secret_blobs: List[bytes],
+    stored_index_blob: bytes,
+    hints_blob: bytes,
+    conditions_cache_path: Optional[str],
+) -> None:
+    CONDITIONS_CACHE.reopen(conditions_cache_path)
+    secrets = [BLSSecretExponent.from_bytes(_) for _ in secret_blobs]
+    gap, indexed_keys = FROM_PROGRAM_STORED_INDEX(Program.from_bytes(stored_index_blob))
+    hints = UnsignedSpend.from_bytes(hints_blob)
+    WORKER_STATE.update(
+        wallet_index=WalletIndex(secrets, gap, indexed_keys),
+        sum_hints=build_sum_hints_lookup(hints.sum_hints),
+        path_hints=build_path_hints_lookup(hints.path_hints),
+        agg_sig_me_network_suffix=hints.agg_sig_me_network_suffix,
+        signatures={},
+    )
+
+
+def sign_chunk(coin_spends_blob: bytes) -> bytes:
+    chunk = UnsignedSpend.from_bytes(coin_spends_blob)
+    sigs: List[SignatureInfo] = []
+    for coin_spend in chunk.coin_spends:
+        sigs.extend(
+            sign_for_coin_spend(
+                coin_spend,
+                WORKER_STATE["wallet_index"],
+                WORKER_STATE["sum_hints"],
+                WORKER_STATE["path_hints"],
+                WORKER_STATE["agg_sig_me_network_suffix"],
+                WORKER_STATE["signatures"],
+            )
+        )
+    return bytes(TO_PROGRAM_SIGNATURE_INFOS(sigs))
+
+
+def sign_in_parallel(
+    us: UnsignedSpend,
+    wallet: Wallet,
+    workers: Optional[int] = None,
+    max_cost: Optional[int] = None,
+) -> List[SignatureInfo]:
+    """
+    Return the same list as `sign(us, wallet, max_cost)`, signing with up to
+    `workers` processes (by default, one per cpu).
+
+    With one worker, or only one coin spend, this just calls `sign`. With
+    `max_cost`, the puzzles are first run here against the budget, so a
+    request over it is rejected before any worker starts.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    coin_spends = us.coin_spends
+    workers = min(workers, len(coin_spends))
+    if workers <= 1:
+        return sign(us, wallet, max_cost)
+    if max_cost is not None:
+        conditions_for_coin_spends(coin_spends, budget=CostBudget(max_cost))
+
+    wallet_index = wallet_index_for_wallet(wallet)
+    secret_blobs = [bytes(_) for _ in wallet_index.secrets]
+    stored_index_blob = bytes(
+        TO_PROGRAM_STORED_INDEX((wallet_index.gap, wallet_index.indexed_keys()))
+    )
+    suffix = us.agg_sig_me_network_suffix
+    hints_blob = bytes(UnsignedSpend([], us.sum_hints, us.path_hints, suffix))
+
+    chunk_count = min(workers * CHUNKS_PER_WORKER, len(coin_spends))
+    chunk_size, remainder = divmod(len(coin_spends), chunk_count)
+    chunk_blobs = []
+    start = 0
+    for idx in range(chunk_count):
+        end = start + chunk_size + (1 if idx < remainder else 0)
+        chunk_blobs.append(bytes(UnsignedSpend(coin_spends[start:end], [], [], suffix)))
+        start = end
+
+    sigs: List[SignatureInfo] = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(
+            secret_blobs,
+            stored_index_blob,
+            hints_blob,
+            CONDITIONS_CACHE.path,
+        ),
+    ) as executor:
+        for sigs_blob in executor.map(sign_chunk, chunk_blobs):
+            sigs.extend(FROM_PROGRAM_SIGNATURE_INFOS(Program.from_bytes(sigs_blob)))
+    return sigs
@@ -0,0 +1,144 @@
+"""
+Split an `UnsignedSpend` that's too large to handle comfortably into shards,
+each a smaller `UnsignedSpend` that can be signed on its own.
+
+Each shard carries only the sum hints and path hints its own coin spends need.
+Since BLS signatures just add up, the signatures from every shard (and the
+synthetic offset signatures for each) can be summed into one `SpendBundle`
+afterwards, as `hsmmerge` does.
+"""
+
+from typing import Dict, List
+
+from chik_base.core import CoinSpend
+
+from hsmk.core.signing_hints import PathHint, SumHint
+from hsmk.core.unsigned_spend import CSTuple, UnsignedSpend, from_storage
+from hsmk.klvm_serde.stream import to_stream_for_type
+
+from .sign import build_path_hints_lookup, build_sum_hints_lookup, generate_verify_pairs
+
+TO_STREAM_CS_TUPLE = to_stream_for_type(CSTuple)
+TO_STREAM_SUM_HINT = to_stream_for_type(SumHint)
+TO_STREAM_PATH_HINT = to_stream_for_type(PathHint)
+
+# the `(key . value)` entry for a non-empty list: two cons boxes, a one byte
+# key, and the list's terminator
+KEY_OVERHEAD = 4
+
+
+def serialized_size(to_stream, item) -> int:
+    size = 0
+
+    def write(blob: bytes) -> None:
+        nonlocal size
+        size += len(blob)
+
+    to_stream(item, write)
+    return size
+
+
+class Shard:
+    """
+    A shard being filled. `size` is always `len(bytes(self.unsigned_spend()))`.
+    """
+
+    def __init__(self, agg_sig_me_network_suffix: bytes):
+        self.agg_sig_me_network_suffix = agg_sig_me_network_suffix
+        self.coin_spends: List[CoinSpend] = []
+        self.sum_hints: Dict[int, SumHint] = {}
+        self.path_hints: Dict[int, PathHint] = {}
+        self.size = len(bytes(UnsignedSpend([], [], [], agg_sig_me_network_suffix)))
+
+    def size_with(
+        self,
+        coin_spend_size: int,
+        sum_hints: Dict[int, SumHint],
+        path_hints: Dict[int, PathHint],
+        sizes: Dict[int, int],
+    ) -> int:
+        # coin spends have no default, so their entry is always there
+        size = self.size + 1 + coin_spend_size
+        new_sum_hints = [_ for _ in sum_hints if _ not in self.sum_hints]
+        if new_sum_hints and not self.sum_hints:
+            size += KEY_OVERHEAD
+        new_path_hints = [_ for _ in path_hints if _ not in self.path_hints]
+        if new_path_hints and not self.path_hints:
+            size += KEY_OVERHEAD
+        for _ in new_sum_hints + new_path_hints:
+            size += 1 + sizes[_]
+        return size
+
+    def add(
+        self,
+        coin_spend: CoinSpend,
+        sum_hints: Dict[int, SumHint],
+        path_hints: Dict[int, PathHint],
+        size: int,
+    ) -> None:
+        self.coin_spends.append(coin_spend)
+        self.sum_hints.update(sum_hints)
+        self.path_hints.update(path_hints)
+        self.size = size
+
+    def unsigned_spend(self) -> UnsignedSpend:
+        return UnsignedSpend(
+            self.coin_spends,
+            list(self.sum_hints.values()),
+            list(self.path_hints.values()),
+            self.agg_sig_me_network_suffix,
+        )
+
+
+def split_unsigned_spend(
+    unsigned_spend: UnsignedSpend, max_size: int
+) -> List[UnsignedSpend]:
+    """
+    Partition the coin spends of `unsigned_spend`, in order, into as few
+    `UnsignedSpend` objects as fit, each at most `max_size` bytes serialized.
+
+    Raises `ValueError` if a coin spend doesn't fit in `max_size` even alone.
+    """
+    suffix = unsigned_spend.agg_sig_me_network_suffix
+    sum_hints_lookup = build_sum_hints_lookup(unsigned_spend.sum_hints)
+    path_hints_lookup = build_path_hints_lookup(unsigned_spend.path_hints)
+    # hints are identified by `id`, so a hint used by several coin spends is
+    # only counted once per shard
+    sizes: Dict[int, int] = {}
+    for hint in unsigned_spend.sum_hints:
+        sizes[id(hint)] = serialized_size(TO_STREAM_SUM_HINT, hint)
+    for hint in unsigned_spend.path_hints:
+        sizes[id(hint)] = serialized_size(TO_STREAM_PATH_HINT, hint)
+
+    shards: List[UnsignedSpend] = []
+    shard = Shard(suffix)
+    for coin_spend in unsigned_spend.coin_spends:
+        sum_hints: Dict[int, SumHint] = {}
+        path_hints: Dict[int, PathHint] = {}
+        for final_public_key, _message in generate_verify_pairs(coin_spend, suffix):
+            partial_public_keys = [final_public_key]
+            sum_hint = sum_hints_lookup.get(final_public_key)
+            if sum_hint is not None:
+                sum_hints[id(sum_hint)] = sum_hint
+                partial_public_keys = sum_hint.public_keys
+            for public_key in partial_public_keys:
+                path_hint = path_hints_lookup.get(public_key)
+                if path_hint is not None:
+                    path_hints[id(path_hint)] = path_hint
+        coin_spend_size = serialized_size(
+            TO_STREAM_CS_TUPLE, from_storage([coin_spend])[0]
+        )
+        size = shard.size_with(coin_spend_size, sum_hints, path_hints, sizes)
+        if size > max_size and shard.coin_spends:
+            shards.append(shard.unsigned_spend())
+            shard = Shard(suffix)
+            size = shard.size_with(coin_spend_size, sum_hints, path_hints, sizes)
+        if size > max_size:
+            raise ValueError(
+                f"coin spend {coin_spend.coin.name().hex()} needs {size} bytes,"
+                f" more than {max_size}"
+            )
+        shard.add(coin_spend, sum_hints, path_hints, size)
+    if shard.coin_spends or not shards:
+        shards.append(shard.unsigned_spend())
+    return shards
@@ -1,19 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 from weakref import WeakKeyDictionary
 
-from chik_base.atoms import hexbytes
-from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent
+import os
+import threading
+
+from chik_base.atoms import bytes32, hexbytes
+from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent, BLSSignature
 from chik_base.core import CoinSpend
 
 from klvm_rs import Program  # type: ignore
 
-from hsmk.core.signing_hints import SumHint, SumHints, PathHint, PathHints
+from hsmk.core.signing_hints import (
+    SumHint,
+    SumHints,
+    PathHint,
+    PathHints,
+    final_public_keys_for_sum_hints,
+)
 from hsmk.core.unsigned_spend import SignatureInfo, UnsignedSpend
-from hsmk.consensus.conditions import conditions_by_opcode
+from hsmk.consensus.conditions import MAX_COST, conditions_by_opcode
+from hsmk.klvm_serde.stream import program_for_blob
 from hsmk.puzzles.conlang import AGG_SIG_ME, AGG_SIG_UNSAFE
 
-MAX_COST = 1 << 34
+from .conditions_cache import (
+    CostBudget,
+    run_puzzle_for_blob,
+    run_serialized_puzzle,
+)
+from .wallet_index import WalletIndex
+
+Wallet = Union[WalletIndex, List[BLSSecretExponent]]
+
+# signatures already made, by `(partial_public_key, final_public_key, message)`
+Signatures = Dict[Tuple[BLSPublicKey, BLSPublicKey, bytes], BLSSignature]
 
 
 @dataclass
@@ -23,45 +44,173 @@ class SignatureMetadata:
     message: bytes
 
 
-CONDITIONS_FOR_COIN_SPEND: WeakKeyDictionary = WeakKeyDictionary()
-
+# how many threads `conditions_for_coin_spends` runs puzzles on by default
+CONDITIONS_WORKERS = min(8, os.cpu_count() or 1)
 
-def conditions_for_coin_spend(coin_spend: CoinSpend) -> Program:
-    if coin_spend not in CONDITIONS_FOR_COIN_SPEND:
-        _cost, r = coin_spend.puzzle_reveal.run_with_cost(
-            coin_spend.solution, max_cost=MAX_COST
-        )
-        CONDITIONS_FOR_COIN_SPEND[coin_spend] = r
-    return CONDITIONS_FOR_COIN_SPEND[coin_spend]
+# the cost and serialized conditions for each coin spend, as a `Program` can
+# only be used on the thread that created it
+CONDITIONS_FOR_COIN_SPEND: WeakKeyDictionary = WeakKeyDictionary()
+CONDITIONS_LOCK = threading.Lock()
+
+
+def conditions_for_coin_spend(
+    coin_spend: CoinSpend, budget: Optional[CostBudget] = None
+) -> Program:
+    """
+    Each puzzle may cost up to `MAX_COST`, and with a `budget`, the cost is
+    charged to it as well (see `CostBudget`).
+
+    This is thread-safe. The puzzle is run outside the lock, so two threads
+    asking for the same coin spend at once may both run it; the first result
+    stored wins.
+    """
+    with CONDITIONS_LOCK:
+        cached = CONDITIONS_FOR_COIN_SPEND.get(coin_spend)
+    if cached is None:
+        puzzle, solution = coin_spend.puzzle_reveal, coin_spend.solution
+
+        def run(max_cost: int) -> Tuple[int, bytes]:
+            return run_puzzle_for_blob(puzzle, solution, max_cost)
+
+        cached = run_with_budget(coin_spend.coin.name(), run, budget)
+        with CONDITIONS_LOCK:
+            cached = CONDITIONS_FOR_COIN_SPEND.setdefault(coin_spend, cached)
+    elif budget is not None:
+        budget.charge(coin_spend.coin.name(), cached[0])
+    return program_for_blob(cached[1])
+
+
+def conditions_for_coin_spends(
+    coin_spends: Iterable[CoinSpend],
+    workers: Optional[int] = None,
+    budget: Optional[CostBudget] = None,
+) -> List[Program]:
+    """
+    Return the conditions for each coin spend, in order, running the puzzles
+    not already run on up to `workers` threads (by default,
+    `CONDITIONS_WORKERS`). klvm runs in native code, so puzzles can run on
+    several cores at once.
+
+    Only serialized puzzles, solutions and results cross to the pool threads.
+    With a `budget`, each puzzle run is limited to what's left of it when the
+    run starts, and once it's exceeded, runs not yet started are cancelled.
+    """
+    coin_spends = list(coin_spends)
+    if workers is None:
+        workers = CONDITIONS_WORKERS
+    with CONDITIONS_LOCK:
+        missing = [_ for _ in coin_spends if _ not in CONDITIONS_FOR_COIN_SPEND]
+    workers = min(workers, len(missing))
+    if workers > 1:
+        jobs = [
+            (_.coin.name(), bytes(_.puzzle_reveal), bytes(_.solution)) for _ in missing
+        ]
+
+        def run_job(job: Tuple[bytes32, bytes, bytes]) -> Tuple[int, bytes]:
+            coin_name, puzzle_blob, solution_blob = job
+
+            def run(max_cost: int) -> Tuple[int, bytes]:
+                return run_serialized_puzzle(puzzle_blob, solution_blob, max_cost)
+
+            return run_with_budget(coin_name, run, budget)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            results = list(executor.map(run_job, jobs))
+        finally:
+            executor.shutdown(cancel_futures=True)
+        with CONDITIONS_LOCK:
+            for coin_spend, cached in zip(missing, results):
+                CONDITIONS_FOR_COIN_SPEND.setdefault(coin_spend, cached)
+    return [conditions_for_coin_spend(_, budget) for _ in coin_spends]
+
+
+def run_with_budget(
+    coin_name: bytes32,
+    run: Callable[[int], Tuple[int, bytes]],
+    budget: Optional[CostBudget],
+) -> Tuple[int, bytes]:
+    if budget is None:
+        return run(MAX_COST)
+    return budget.run(coin_name, run, MAX_COST)
 
 
 def build_sum_hints_lookup(sum_hints: List[SumHint]) -> SumHints:
-    return {_.final_public_key(): _ for _ in sum_hints}
+    return dict(zip(final_public_keys_for_sum_hints(sum_hints), sum_hints))
 
 
 def build_path_hints_lookup(path_hints: List[PathHint]) -> PathHints:
     return {_.public_key(): _ for _ in path_hints}
 
 
-def sign(us: UnsignedSpend, secrets: List[BLSSecretExponent]) -> List[SignatureInfo]:
-    sigs = []
-    sum_hints = build_sum_hints_lookup(us.sum_hints)
-    path_hints = build_path_hints_lookup(us.path_hints)
-    for coin_spend in us.coin_spends:
-        more_sigs = sign_for_coin_spend(
-            coin_spend, secrets, sum_hints, path_hints, us.agg_sig_me_network_suffix
-        )
-        sigs.extend(more_sigs)
-    return sigs
+def wallet_index_for_wallet(wallet: Wallet) -> WalletIndex:
+    if isinstance(wallet, WalletIndex):
+        return wallet
+    return WalletIndex.for_secrets(wallet)
+
+
+def sign(
+    us: UnsignedSpend, wallet: Wallet, max_cost: Optional[int] = None
+) -> List[SignatureInfo]:
+    return sign_batch([us], wallet, max_cost)[0]
+
+
+def sign_batch(
+    unsigned_spends: Iterable[UnsignedSpend],
+    wallet: Wallet,
+    max_cost: Optional[int] = None,
+) -> List[List[SignatureInfo]]:
+    """
+    Sign many `UnsignedSpend` objects in one pass, returning the list `sign`
+    would for each.
+
+    With `max_cost`, the puzzles of each request may cost at most that in
+    total, and `CostBudgetExceeded` is raised as soon as they cost more.
+
+    A `(partial_public_key, final_public_key, message)` job that comes up more
+    than once, in one request or across several, is signed once and the
+    signature reused. Each request still gets an entry for every time the job
+    comes up, as consensus requires a signature per `AGG_SIG_*` condition.
+    """
+    wallet_index = wallet_index_for_wallet(wallet)
+    signatures: Signatures = {}
+    results = []
+    for us in unsigned_spends:
+        sigs = []
+        # run all the puzzles up front, concurrently
+        budget = None if max_cost is None else CostBudget(max_cost)
+        conditions_for_coin_spends(us.coin_spends, budget=budget)
+        sum_hints = build_sum_hints_lookup(us.sum_hints)
+        path_hints = build_path_hints_lookup(us.path_hints)
+        for coin_spend in us.coin_spends:
+            more_sigs = sign_for_coin_spend(
+                coin_spend,
+                wallet_index,
+                sum_hints,
+                path_hints,
+                us.agg_sig_me_network_suffix,
+                signatures,
+            )
+            sigs.extend(more_sigs)
+        results.append(sigs)
+    return results
 
 
 def sign_for_coin_spend(
     coin_spend: CoinSpend,
-    secrets: List[BLSSecretExponent],
+    wallet: Wallet,
     sum_hints: SumHints,
     path_hints: PathHints,
     agg_sig_me_network_suffix: bytes,
+    signatures: Optional[Signatures] = None,
 ) -> List[SignatureInfo]:
+    """
+    `signatures` remembers the signatures already made for each job, so
+    repeated jobs are only signed once.
+    """
+    wallet_index = wallet_index_for_wallet(wallet)
+    if signatures is None:
+        signatures = {}
     conditions = conditions_for_coin_spend(coin_spend)
     agg_sig_me_message_suffix = coin_spend.coin.name() + agg_sig_me_network_suffix
     sigs = []
@@ -71,16 +220,21 @@ def sign_for_coin_spend(
         partial_public_key = signature_metadata.partial_public_key
         final_public_key = signature_metadata.final_public_key
         message = signature_metadata.message
-        path_hint = path_hints.get(partial_public_key) or PathHint(
-            partial_public_key, []
-        )
-        secret_key = secret_key_for_public_key(
-            secrets, path_hint.path, path_hint.root_public_key, partial_public_key
-        )
-        if secret_key is None:
-            continue
+        job = (partial_public_key, final_public_key, bytes(message))
+        signature = signatures.get(job)
+        if signature is None:
+            path_hint = path_hints.get(partial_public_key) or PathHint(
+                partial_public_key, []
+            )
+            secret_key = wallet_index.secret_for_public_key(
+                partial_public_key, path_hint.root_public_key, path_hint.path
+            )
+            if secret_key is None:
+                continue
+            signature = secret_key.sign(message, final_public_key)
+            signatures[job] = signature
         sig_info = SignatureInfo(
-            secret_key.sign(message, final_public_key),
+            signature,
             partial_public_key,
             final_public_key,
             message,
@@ -92,6 +246,7 @@ def sign_for_coin_spend(
 
 def generate_synthetic_offset_signatures(us: UnsignedSpend) -> List[SignatureInfo]:
     sig_infos = []
+    conditions_for_coin_spends(us.coin_spends)
     sum_hints = build_sum_hints_lookup(us.sum_hints)
     for coin_spend in us.coin_spends:
         for final_public_key, message in generate_verify_pairs(
@@ -140,14 +295,11 @@ def verify_pairs_for_conditions(
 
 
 def secret_key_for_public_key(
-    secrets: List[BLSSecretExponent], path, root_public_key, public_key
+    wallet: Wallet, path, root_public_key, public_key
 ) -> Optional[BLSSecretExponent]:
-    for secret in secrets:
-        if secret.public_key() == root_public_key:
-            s = secret.child_for_path(path)
-            if s.public_key() == public_key:
-                return s
-    return None
+    return wallet_index_for_wallet(wallet).secret_for_public_key(
+        public_key, root_public_key, path
+    )
 
 
 def partial_signature_metadata_for_hsm(
@@ -0,0 +1,229 @@
+"""
+A fast path for running the standard puzzle.
+
+Nearly every coin spend is a `p2_delegated_puzzle_or_hidden_puzzle` curried
+with a synthetic public key, solved with `(() (q . conditions) solution)`: the
+delegated puzzle path, with a `p2_conditions` delegated puzzle. What that
+returns is known without running it:
+
+    ((AGG_SIG_ME synthetic_public_key (sha256tree delegated_puzzle)) . conditions)
+
+`run_standard_spend` recognizes exactly this shape in the serialized puzzle
+and solution, and builds the serialized result directly, which costs a
+fraction of running klvm and serializing its output. Anything else (another
+puzzle, the hidden puzzle path, another delegated puzzle, a non-canonical
+serialization, back references) returns `None`, for the caller to run as usual.
+
+The puzzle is recognized by its exact serialization, which pins down the mod
+and so its tree hash too.
+
+The cost of the run is part of the result. For this path, it's linear in the
+number of pairs and the number of atom bytes in the delegated puzzle, as
+`sha256tree` hashes each node once. The coefficients are measured with klvm
+when this module is loaded, and checked against a few more runs; if the check
+fails (say, with a `klvm_rs` that costs operators differently), the fast path
+is turned off.
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.consensus.conditions import MAX_COST
+from hsmk.klvm_serde.stream import (
+    BACK_REFERENCE_MARKER,
+    CONS_BOX_MARKER,
+    MAX_SINGLE_BYTE,
+    atom_size_for_blob,
+)
+from hsmk.puzzles.conlang import AGG_SIG_ME
+from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import MOD
+
+PUBLIC_KEY_SIZE = 48
+
+PAIR = bytes([CONS_BOX_MARKER])
+NIL = b"\x80"
+QUOTE = b"\x01"
+PUBLIC_KEY_ATOM_PREFIX = bytes([0x80 | PUBLIC_KEY_SIZE])
+HASH_ATOM_PREFIX = bytes([0x80 | 32])
+
+# `(() (q . ` at the start of the solution
+SOLUTION_PREFIX = PAIR + NIL + PAIR + PAIR + QUOTE
+
+# `((AGG_SIG_ME ` at the start of the result
+RESULT_PREFIX = PAIR + PAIR + bytes(Program.to(AGG_SIG_ME)) + PAIR
+
+
+class CostModel(NamedTuple):
+    base_cost: int
+    pair_cost: int
+    byte_cost: int
+
+
+def curried_puzzle_template() -> Tuple[bytes, bytes]:
+    """
+    Return the serialization of the curried standard puzzle before and after
+    the synthetic public key atom.
+    """
+    marker = PUBLIC_KEY_ATOM_PREFIX + bytes(PUBLIC_KEY_SIZE)
+    blob = bytes(MOD.curry(bytes(PUBLIC_KEY_SIZE)))
+    assert blob.count(marker) == 1
+    prefix, suffix = blob.split(marker)
+    return prefix, suffix
+
+
+PUZZLE_PREFIX, PUZZLE_SUFFIX = curried_puzzle_template()
+PUZZLE_SIZE = len(PUZZLE_PREFIX) + 1 + PUBLIC_KEY_SIZE + len(PUZZLE_SUFFIX)
+
+
+def canonical_header_size(size: int) -> int:
+    for header_size, limit in enumerate([0x3F, 0x1FFF, 0xFFFFF, 0x7FFFFFF], 1):
+        if size <= limit:
+            return header_size
+    return 5
+
+
+def walk_canonical(blob: bytes, cursor: int) -> Tuple[int, int, int]:
+    """
+    Walk the tree serialized at `cursor`, returning the offset just past it,
+    its pair count, and its total atom size.
+
+    Raises `ValueError` unless the tree is serialized exactly as klvm would
+    serialize it, with no back references.
+    """
+    blob_size = len(blob)
+    pair_count = 0
+    atom_bytes = 0
+    # nodes still to walk
+    pending = 1
+    while pending:
+        if cursor >= blob_size:
+            raise ValueError("bad encoding")
+        b = blob[cursor]
+        cursor += 1
+        if b == CONS_BOX_MARKER:
+            pair_count += 1
+            pending += 1
+            continue
+        pending -= 1
+        if b <= MAX_SINGLE_BYTE:
+            atom_bytes += 1
+        elif b == BACK_REFERENCE_MARKER:
+            raise ValueError("back reference")
+        elif b != NIL[0]:
+            start = cursor - 1
+            size, cursor = atom_size_for_blob(blob, cursor, b)
+            if cursor - start != canonical_header_size(size):
+                raise ValueError("non-canonical atom size")
+            if size == 1 and cursor < blob_size and blob[cursor] <= MAX_SINGLE_BYTE:
+                raise ValueError("non-canonical single byte atom")
+            atom_bytes += size
+            cursor += size
+    if cursor > blob_size:
+        raise ValueError("bad encoding")
+    return cursor, pair_count, atom_bytes
+
+
+def run_standard_spend_with_cost_model(
+    puzzle_blob: bytes, solution_blob: bytes, cost_model: CostModel
+) -> Optional[Tuple[int, bytes]]:
+    if (
+        len(puzzle_blob) != PUZZLE_SIZE
+        or not puzzle_blob.startswith(PUZZLE_PREFIX)
+        or not puzzle_blob.endswith(PUZZLE_SUFFIX)
+        or puzzle_blob[len(PUZZLE_PREFIX)] != PUBLIC_KEY_ATOM_PREFIX[0]
+        or not solution_blob.startswith(SOLUTION_PREFIX)
+    ):
+        return None
+    key_start = len(PUZZLE_PREFIX) + 1
+    synthetic_public_key = puzzle_blob[key_start : key_start + PUBLIC_KEY_SIZE]
+
+    # `(() (q . conditions) solution)`, and nothing after it
+    delegated_puzzle_start = len(SOLUTION_PREFIX) - 2
+    conditions_start = len(SOLUTION_PREFIX)
+    try:
+        conditions_end, pair_count, atom_bytes = walk_canonical(
+            solution_blob, conditions_start
+        )
+        if solution_blob[conditions_end : conditions_end + 1] != PAIR:
+            return None
+        solution_end, _, _ = walk_canonical(solution_blob, conditions_end + 1)
+    except ValueError:
+        return None
+    if solution_blob[solution_end:] != NIL:
+        return None
+
+    # the delegated puzzle has one more pair, and the one byte `q` atom
+    cost = (
+        cost_model.base_cost
+        + cost_model.pair_cost * (pair_count + 1)
+        + cost_model.byte_cost * (atom_bytes + 1)
+    )
+    # this is part of the solution, so not worth caching
+    delegated_puzzle_hash = Program.from_bytes(
+        solution_blob[delegated_puzzle_start:conditions_end]
+    ).tree_hash()
+    result = b"".join(
+        [
+            RESULT_PREFIX,
+            PUBLIC_KEY_ATOM_PREFIX,
+            synthetic_public_key,
+            PAIR,
+            HASH_ATOM_PREFIX,
+            delegated_puzzle_hash,
+            NIL,
+            solution_blob[conditions_start:conditions_end],
+        ]
+    )
+    return cost, result
+
+
+def measure_cost_model() -> Optional[CostModel]:
+    """
+    Measure the cost model with klvm, and check it (and the whole fast path)
+    against a few more runs. Return `None` if the check fails.
+    """
+    puzzle = MOD.curry(bytes(PUBLIC_KEY_SIZE))
+
+    def solution_for_conditions(conditions) -> Program:
+        return Program.to([0, (1, conditions), 0])
+
+    def cost_for_conditions(conditions) -> int:
+        solution = solution_for_conditions(conditions)
+        return puzzle.run_with_cost(solution, max_cost=MAX_COST)[0]
+
+    # `(q)` has one pair, and one atom byte
+    cost = cost_for_conditions(0)
+    pair_cost = cost_for_conditions((0, 0)) - cost
+    byte_cost = (cost_for_conditions(bytes(64)) - cost) // 64
+    cost_model = CostModel(cost - pair_cost - byte_cost, pair_cost, byte_cost)
+
+    checks: List = [
+        [[51, bytes(32), 1000], [50, bytes(48), b"message"]],
+        [[[1], 2], b"x" * 100, 300, -1],
+        ((1, 2), 3),
+    ]
+    for conditions in checks:
+        solution = solution_for_conditions(conditions)
+        expected_cost, result = puzzle.run_with_cost(solution, max_cost=MAX_COST)
+        if run_standard_spend_with_cost_model(
+            bytes(puzzle), bytes(solution), cost_model
+        ) != (expected_cost, bytes(result)):
+            return None
+    return cost_model
+
+
+COST_MODEL = measure_cost_model()
+
+
+def run_standard_spend(
+    puzzle_blob: bytes, solution_blob: bytes
+) -> Optional[Tuple[int, bytes]]:
+    """
+    Return what `run_with_cost` would, as `(cost, serialized result)`, for a
+    standard spend through a `p2_conditions` delegated puzzle, or `None` for
+    anything else.
+    """
+    if COST_MODEL is None:
+        return None
+    return run_standard_spend_with_cost_model(puzzle_blob, solution_blob, COST_MODEL)
@@ -0,0 +1,197 @@
+"""
+An index from public keys to the secret exponents of a signing wallet.
+
+Finding the secret for a partial public key used to mean a scalar
+multiplication (`secret.public_key()`) for every secret in the wallet, for
+every signature. `WalletIndex` does those once, when the wallet is loaded, and
+also indexes the children at paths `[0]` to `[gap - 1]` of each root key, so
+keys in that window are found without a path hint. Keys with a path hint
+outside the window are found through their root, and derived with the
+derivation tries of `hsmk.core.signing_hints`.
+
+The index can be saved next to the key file. It's encrypted and authenticated
+with keys derived from the wallet's secrets, so it reveals nothing without
+them, and an index for a different wallet (or a tampered one) is rejected
+rather than trusted.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import hashlib
+import hmac
+import os
+
+from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent
+
+from klvm_rs import Program  # type: ignore
+
+from hsmk.core.signing_hints import public_child_for_path, secret_child_for_path
+from hsmk.klvm_serde import Frugal, from_program_for_type, to_program_for_type
+
+MAGIC = b"hsmkidx1"
+NONCE_SIZE = 16
+TAG_SIZE = 32
+
+INDEX_FILE_SUFFIX = ".index"
+
+
+@dataclass
+class IndexedKey(Frugal):
+    public_key: BLSPublicKey
+    secret_index: int
+    path: List[int]
+
+
+StoredIndex = Tuple[int, List[IndexedKey]]
+
+TO_PROGRAM_STORED_INDEX = to_program_for_type(StoredIndex)
+FROM_PROGRAM_STORED_INDEX = from_program_for_type(StoredIndex)
+
+
+class WalletIndex:
+    def __init__(
+        self,
+        secrets: Sequence[BLSSecretExponent],
+        gap: int,
+        indexed_keys: Iterable[IndexedKey],
+    ):
+        self.secrets = list(secrets)
+        self.gap = gap
+        self.keys: Dict[BLSPublicKey, Tuple[int, Tuple[int, ...]]] = {}
+        self.roots: Dict[BLSPublicKey, int] = {}
+        for indexed_key in indexed_keys:
+            path = tuple(indexed_key.path)
+            self.keys.setdefault(
+                indexed_key.public_key, (indexed_key.secret_index, path)
+            )
+            if not path:
+                self.roots.setdefault(indexed_key.public_key, indexed_key.secret_index)
+
+    @classmethod
+    def for_secrets(
+        cls, secrets: Sequence[BLSSecretExponent], gap: int = 0
+    ) -> "WalletIndex":
+        indexed_keys = []
+        for secret_index, secret in enumerate(secrets):
+            root_public_key = secret.public_key()
+            indexed_keys.append(IndexedKey(root_public_key, secret_index, []))
+            for index in range(gap):
+                indexed_keys.append(
+                    IndexedKey(root_public_key.child(index), secret_index, [index])
+                )
+        return cls(secrets, gap, indexed_keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def indexed_keys(self) -> List[IndexedKey]:
+        return [
+            IndexedKey(public_key, secret_index, list(path))
+            for public_key, (secret_index, path) in self.keys.items()
+        ]
+
+    def secret_for_public_key(
+        self,
+        public_key: BLSPublicKey,
+        root_public_key: Optional[BLSPublicKey] = None,
+        path: Sequence[int] = (),
+    ) -> Optional[BLSSecretExponent]:
+        """
+        Return the secret for `public_key`, or `None` if it's not in this wallet.
+
+        `root_public_key` and `path` are a path hint, used for keys outside the
+        indexed window.
+        """
+        entry = self.keys.get(public_key)
+        if entry is not None:
+            secret_index, key_path = entry
+            return secret_child_for_path(self.secrets[secret_index], key_path)
+        if root_public_key is None:
+            return None
+        secret_index = self.roots.get(root_public_key)
+        if secret_index is None:
+            return None
+        # unhardened derivation, so the public path gives the same key
+        if public_child_for_path(root_public_key, path) != public_key:
+            return None
+        return secret_child_for_path(self.secrets[secret_index], path)
+
+    def to_bytes(self) -> bytes:
+        """
+        Return this index encrypted and authenticated with keys derived from
+        its secrets.
+        """
+        plaintext = bytes(TO_PROGRAM_STORED_INDEX((self.gap, self.indexed_keys())))
+        encryption_key, authentication_key = keys_for_secrets(self.secrets)
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = xor(plaintext, keystream(encryption_key, nonce, len(plaintext)))
+        body = MAGIC + nonce + ciphertext
+        return body + tag_for_blob(authentication_key, body)
+
+    @classmethod
+    def from_bytes(
+        cls, blob: bytes, secrets: Sequence[BLSSecretExponent]
+    ) -> "WalletIndex":
+        """
+        Raises `ValueError` if `blob` isn't an index saved for `secrets`.
+        """
+        if len(blob) < len(MAGIC) + NONCE_SIZE + TAG_SIZE or not blob.startswith(MAGIC):
+            raise ValueError("not a wallet index")
+        encryption_key, authentication_key = keys_for_secrets(secrets)
+        body, tag = blob[:-TAG_SIZE], blob[-TAG_SIZE:]
+        if not hmac.compare_digest(tag, tag_for_blob(authentication_key, body)):
+            raise ValueError("wallet index is for other secrets, or corrupt")
+        nonce = body[len(MAGIC) : len(MAGIC) + NONCE_SIZE]
+        ciphertext = body[len(MAGIC) + NONCE_SIZE :]
+        plaintext = xor(ciphertext, keystream(encryption_key, nonce, len(ciphertext)))
+        gap, indexed_keys = FROM_PROGRAM_STORED_INDEX(Program.from_bytes(plaintext))
+        for indexed_key in indexed_keys:
+            if not 0 <= indexed_key.secret_index < len(secrets):
+                raise ValueError("wallet index is for other secrets, or corrupt")
+        return cls(secrets, gap, indexed_keys)
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+
+def load_or_build_wallet_index(
+    path: str, secrets: Sequence[BLSSecretExponent], gap: int = 0
+) -> Tuple[WalletIndex, bool]:
+    """
+    Load the index saved at `path` if it's for `secrets` and `gap`, or build a
+    new one. Return the index and whether it was built (and so should be saved).
+    """
+    try:
+        with open(path, "rb") as f:
+            wallet_index = WalletIndex.from_bytes(f.read(), secrets)
+        if wallet_index.gap == gap:
+            return wallet_index, False
+    except (OSError, ValueError):
+        pass
+    return WalletIndex.for_secrets(secrets, gap), True
+
+
+def keys_for_secrets(secrets: Sequence[BLSSecretExponent]) -> Tuple[bytes, bytes]:
+    master_key = hashlib.sha256(
+        b"hsmk wallet index" + b"".join(bytes(_) for _ in secrets)
+    ).digest()
+    return (
+        hmac.new(master_key, b"encrypt", hashlib.sha256).digest(),
+        hmac.new(master_key, b"authenticate", hashlib.sha256).digest(),
+    )
+
+
+def keystream(key: bytes, nonce: bytes, size: int) -> bytes:
+    return hashlib.shake_256(key + nonce).digest(size)
+
+
+def tag_for_blob(key: bytes, blob: bytes) -> bytes:
+    return hmac.new(key, blob, hashlib.sha256).digest()
+
+
+def xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(len(a), "big")
@@ -66,6 +66,8 @@ from chik_base.bls12_381 import BLSPublicKey, BLSSecretExponent
 
 from chiklisp_puzzles import load_puzzle  # type: ignore
 
+from hsmk.klvm.tree_hash import tree_hash
+
 from .p2_conditions import puzzle_for_conditions
 
 DEFAULT_HIDDEN_PUZZLE = Program.from_bytes(
@@ -125,7 +127,7 @@ def puzzle_for_public_key_and_hidden_puzzle(
     public_key: BLSPublicKey, hidden_puzzle: Program
 ) -> Program:
     return puzzle_for_public_key_and_hidden_puzzle_hash(
-        public_key, hidden_puzzle.tree_hash()
+        public_key, tree_hash(hidden_puzzle)
     )
 
 
@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import io
+import pickle
+import sqlite3
+
+from klvm_rs import Program
+
+import pytest
+
+from chik_base.core import Coin, CoinSpend
+
+from hsmk.cmds.hsmk import print_costs
+from hsmk.process.conditions_cache import (
+    INHERITED_CONNECTIONS,
+    ConditionsCache,
+    CostBudget,
+    CostBudgetExceeded,
+)
+from hsmk.process.sign import conditions_for_coin_spends
+
+
+def test_conditions_cache(tmp_path):
+    # `(c 2 5)`: the first argument consed onto the third
+    puzzle = Program.fromhex("ff04ff02ff0580")
+    solutions = [Program.to([idx, 0, [idx + 1]]) for idx in range(4)]
+    expected = [puzzle.run_with_cost(_, max_cost=1 << 20) for _ in solutions]
+
+    cache = ConditionsCache(maxsize=3)
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    assert cache.cache_info() == (0, 4, 3, 3)
+    assert cache.run(puzzle, Program.to([3, 0, [4]])) == expected[3]
+    assert cache.cache_info() == (1, 4, 3, 3)
+    assert cache.run(puzzle, solutions[0]) == expected[0]
+    assert cache.cache_info() == (1, 5, 3, 3)
+
+    # a cached run that costs more than is allowed still fails
+    with pytest.raises(ValueError):
+        cache.run(puzzle, solutions[0], max_cost=1)
+
+    # failures aren't cached
+    bad_puzzle = Program.to([8])
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.run(bad_puzzle, solutions[0])
+    assert cache.cache_info().currsize == 3
+
+    path = str(tmp_path / "conditions.sqlite")
+    cache = ConditionsCache(path=path)
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    cache.close()
+
+    # another process finds them on disk
+    cache = ConditionsCache(path=path)
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    assert cache.cache_info() == (4, 0, 1024, 4)
+
+    # a corrupt row is dropped and recomputed
+    cache.cache_clear()
+    db = sqlite3.connect(path)
+    db.execute("UPDATE conditions SET cost = cost + 1")
+    db.commit()
+    db.close()
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    assert cache.cache_info() == (0, 4, 1024, 4)
+    cache.cache_clear()
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    assert cache.cache_info() == (4, 0, 1024, 4)
+    cache.close()
+
+    # a worker process opens the file again, and leaves the connection it
+    # inherited alone
+    cache = ConditionsCache(path=path)
+    inherited = cache.db
+    cache.reopen(path)
+    assert cache.db is not inherited and cache.path == path
+    assert inherited in INHERITED_CONNECTIONS
+    assert [cache.run(puzzle, _) for _ in solutions] == expected
+    assert cache.cache_info() == (4, 0, 1024, 4)
+    cache.reopen(None)
+    assert cache.db is None and cache.path is None
+
+
+def identity_coin_spends(count: int, tag: bytes = b"") -> list:
+    # `1` returns its solution, so each coin spend's conditions are its solution
+    puzzle = Program.to(1)
+    return [
+        CoinSpend(
+            Coin(bytes([idx]) * 32, puzzle.tree_hash(), idx),
+            puzzle,
+            Program.to([[51, bytes([idx]) * 32, idx], tag]),
+        )
+        for idx in range(count)
+    ]
+
+
+def test_conditions_for_coin_spends():
+    coin_spends = identity_coin_spends(40)
+    expected = [_.solution for _ in coin_spends]
+    assert conditions_for_coin_spends(coin_spends, workers=4) == expected
+    assert conditions_for_coin_spends(coin_spends, workers=1) == expected
+    assert conditions_for_coin_spends([], workers=4) == []
+
+    # many threads asking at once all get the same answers (serialized, as a
+    # `Program` can only be used on the thread that created it)
+    def serialized_conditions(_):
+        return [bytes(_) for _ in conditions_for_coin_spends(coin_spends, workers=3)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(serialized_conditions, range(16)))
+    assert results == [[bytes(_) for _ in expected]] * 16
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_cost_budget(workers):
+    tag = b"budget %d" % workers
+    coin_spends = identity_coin_spends(10, tag)
+    costs = {
+        _.coin.name(): _.puzzle_reveal.run_with_cost(_.solution, max_cost=1000)[0]
+        for _ in coin_spends
+    }
+    total = sum(costs.values())
+
+    budget = CostBudget(total)
+    conditions_for_coin_spends(coin_spends, workers, budget)
+    assert budget.costs == costs
+    assert budget.total == total
+    # asking again charges nothing more
+    conditions_for_coin_spends(coin_spends, workers, budget)
+    assert budget.total == total
+
+    # cached results are charged too
+    with pytest.raises(CostBudgetExceeded) as info:
+        conditions_for_coin_spends(coin_spends, workers, CostBudget(total - 1))
+    ex = info.value
+    assert not ex.stopped and ex.cost == costs[ex.coin_name]
+    assert ex.total + ex.cost > ex.max_cost == total - 1
+    assert pickle.loads(pickle.dumps(ex)).args == ex.args
+
+    # a puzzle run is stopped once it costs more than what's left
+    coin_spends = identity_coin_spends(10, tag + b" again")
+    budget = CostBudget(total // 2)
+    with pytest.raises(CostBudgetExceeded) as info:
+        conditions_for_coin_spends(coin_spends, workers, budget)
+    assert budget.total <= total // 2
+    ex = info.value
+    assert ex.total <= total // 2
+
+    # each coin spend's cost is reported, ending with the one over budget
+    f = io.StringIO()
+    print_costs(budget, ex, f)
+    lines = f.getvalue().splitlines()
+    assert lines[0] == "cost of each coin spend run so far:"
+    assert len(lines) == 2 + len(budget.costs)
+    assert lines[-1].startswith(f"  {ex.coin_name.hex()}: ")
+    assert lines[-1].endswith(" (over budget)")
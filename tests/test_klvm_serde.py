@@ -1,7 +1,12 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields as dataclass_fields
 from typing import List, Optional, Union, Tuple
 
+import copy
+import io
 import random
+import sys
+import threading
+import zlib
 
 import pytest
 
@@ -17,12 +22,46 @@ from hsmk.klvm_serde import (
     EncodingError,
     Frugal,
 )
+from hsmk.klvm_serde.arena import NodeArena, from_arena_for_type, from_bytes_via_arena
+from hsmk.klvm_serde.codegen import (
+    compiled_from_program_for_type,
+    compiled_to_program_for_type,
+)
+from hsmk.klvm_serde.iterative import (
+    iterative_from_program_for_type,
+    iterative_to_bytes_for_type,
+    iterative_to_program_for_type,
+)
+from hsmk.klvm_serde.lazy import LazyList, lazy_from_program_for_type
+from hsmk.klvm_serde.serde_cache import SerdeCache
+from hsmk.klvm_serde.sizes import size_report_for_type
+from hsmk.klvm_serde.stream import (
+    BackReferenceError,
+    BufferReader,
+    from_stream_for_type,
+    reader_for_source,
+    to_stream_for_type,
+)
 from hsmk.core.signing_hints import SumHint, PathHint
 from hsmk.core.unsigned_spend import (
+    CompactHintsUnsignedSpend,
+    CompactUnsignedSpend,
+    ModTableUnsignedSpend,
     UnsignedSpend,
+    amount_for_compact_amount,
+    compact_amount,
+    compact_hints_from_storage,
+    compact_hints_to_storage,
     from_storage,
+    iter_unsigned_spend,
+    mod_table_from_storage,
+    stream_unsigned_spend,
     to_storage,
     TO_PROGRAM,
+    TUPLE_LABELS,
+)
+from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    puzzle_for_synthetic_public_key,
 )
 from .legacy.signing_hints import (
     SumHint as LegacySH,
@@ -31,6 +70,13 @@ from .legacy.signing_hints import (
 from .legacy.unsigned_spend import UnsignedSpend as LegacyUS
 
 
+@dataclass
+class Tree:
+    value: int
+    children: List["Tree"]
+    parent_hint: Optional["Tree"] = field(default=None, metadata=dict(key="p"))
+
+
 def test_ser():
     tpb = to_program_for_type(bytes)
     fpb = from_program_for_type(bytes)
@@ -403,3 +449,599 @@ def test_failures():
     fp = from_program_for_type(Foo)
     with pytest.raises(EncodingError):
         fp(Program.to([]))
+
+
+def sample_unsigned_spend(coin_spend_count: int = 5) -> UnsignedSpend:
+    cs_list = [rnd_coin_spend(_) for _ in range(coin_spend_count)]
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    synthetic_offset = BLSSecretExponent.from_int(3**70 & ((1 << 256) - 1))
+    return UnsignedSpend(
+        cs_list,
+        [SumHint(public_keys, synthetic_offset)],
+        [PathHint(public_keys[0], [1, 5, 91])],
+        b"a" * 32,
+    )
+
+
+@dataclass
+class Item:
+    a: int
+    b: str = field(default="foo", metadata=dict(key="bob"))
+
+
+@dataclass
+class Frame(Frugal):
+    a: Optional[List[int]]
+    b: Tuple[bytes, Item]
+    c: List[Item]
+    d: Program
+
+
+@dataclass
+class Keyed:
+    a: int = field(
+        metadata=dict(alt_serde_type=(str, str, int), key="a"),
+    )
+    b: Optional[Frame] = field(default=None, metadata=dict(key="b"))
+
+
+FRAME = Frame(
+    [5, -1000, 0, 127, 128],
+    (b"h" * 100, Item(7)),
+    [Item(1, "one"), Item(2)],
+    Program.to([1, (2, 3)]),
+)
+LEAF = Tree(3, [])
+
+# every serde target must encode these exactly as `to_program_for_type`
+# does, and decode them back
+ROUND_TRIP_CASES = [
+    (bytes, [b"", b"\x00", b"\x7f", b"\x80", b"x" * 0x40, b"y" * 0x2000]),
+    (str, ["", "foo"]),
+    (int, [0, 1, -1, 127, 128, 1 << 100]),
+    (List[Tuple[int, str]], [[], [(100, "hundred"), (-3, "")]]),
+    (GenericAlias(tuple_frugal, (int, str, bytes)), [(1000, "hello", b"bob")]),
+    (Tuple[int, Optional[str], List[bytes]], [(5, None, [b"a", b"bc"])]),
+    (Tuple[int, Optional[str]], [(-1000, "foo")]),
+    (List[Program], [[Program.to([1, 2]), Program.to(0)]]),
+    (Item, [Item(100, "boss"), Item(100)]),
+    (Frame, [FRAME, Frame(None, (b"", Item(0)), [], Program.to(0))]),
+    (Keyed, [Keyed(1000), Keyed(-5, FRAME)]),
+    (List[SumHint], [[SumHint([], BLSSecretExponent.from_int(5))]]),
+    (Tree, [Tree(1, [Tree(2, [LEAF]), Tree(4, [], LEAF)])]),
+    (UnsignedSpend, [sample_unsigned_spend(), UnsignedSpend([rnd_coin_spend(0)])]),
+]
+
+
+@pytest.mark.parametrize(
+    "t,v", [(t, v) for t, values in ROUND_TRIP_CASES for v in values]
+)
+def test_round_trip(t, v):
+    p = to_program_for_type(t)(v)
+    blob = bytes(p)
+
+    assert bytes(compiled_to_program_for_type(t)(v)) == blob
+    b = bytearray()
+    to_stream_for_type(t)(v, b.extend)
+    assert bytes(b) == blob
+    assert iterative_to_program_for_type(t)(v) == p
+    assert iterative_to_bytes_for_type(t)(v) == blob
+
+    for read in [
+        from_program_for_type(t),
+        compiled_from_program_for_type(t),
+        iterative_from_program_for_type(t),
+        lazy_from_program_for_type(t),
+    ]:
+        assert read(p) == v
+        assert read(Program.from_bytes(blob)) == v
+    assert from_bytes_via_arena(t, blob) == v
+
+    read_stream = from_stream_for_type(t)
+    for source in [blob, memoryview(blob), bytearray(blob), io.BytesIO(blob)]:
+        assert read_stream(reader_for_source(source)) == v
+    # a buffer is read up to the end of the value, and no further
+    reader = BufferReader(blob + b"\x01")
+    read_stream(reader)
+    assert reader.cursor == len(blob)
+
+
+def test_codegen():
+    tfi = GenericAlias(tuple_frugal, (int,))
+    with pytest.raises(EncodingError):
+        compiled_to_program_for_type(tfi)((1, 2))
+    with pytest.raises(EncodingError):
+        compiled_from_program_for_type(tfi)(Program.to((1, 2)))
+    with pytest.raises(EncodingError):
+        compiled_from_program_for_type(Tuple[int])(Program.to([1, 2]))
+    with pytest.raises(EncodingError):
+        compiled_from_program_for_type(Keyed)(Program.to([]))
+    with pytest.raises(ValueError):
+        compiled_to_program_for_type(object)
+    with pytest.raises(ValueError):
+        compiled_from_program_for_type(Union[int, str])
+
+
+def test_stream():
+    with pytest.raises(EncodingError):
+        to_stream_for_type(Tuple[int])((1, 2), bytearray().extend)
+
+    us = sample_unsigned_spend()
+    blob = bytes(TO_PROGRAM(us))
+    assert bytes(us) == blob
+    f = io.BytesIO()
+    us.stream(f)
+    assert f.getvalue() == blob
+    b = bytearray()
+    us.stream(b)
+    assert b == blob
+
+
+def test_de_stream():
+    # unknown keys are skipped
+    fs = from_stream_for_type(Item)
+    p = Program.to([100, ("zzz", [1, 2, (3, 4)]), ("bob", "boss")])
+    assert fs(BufferReader(bytes(p))) == Item(100, "boss")
+
+    for t, p in [
+        (bytes, Program.to([1, 2])),
+        (GenericAlias(tuple_frugal, (int,)), Program.to((1, 2))),
+        (Tuple[int], Program.to([1, 2])),
+        (Tuple[int, int], Program.to([1])),
+        (Item, Program.to([])),
+    ]:
+        with pytest.raises(EncodingError):
+            from_stream_for_type(t)(BufferReader(bytes(p)))
+    with pytest.raises(EncodingError):
+        from_stream_for_type(List[int])(BufferReader(bytes.fromhex("ff01ff02")))
+
+    us = sample_unsigned_spend()
+    blob = bytes(us)
+    assert UnsignedSpend.from_bytes(blob) == us
+    assert UnsignedSpend.from_bytes(memoryview(blob)) == us
+    assert UnsignedSpend.parse(io.BytesIO(blob)) == us
+
+
+def test_lazy():
+    us = sample_unsigned_spend()
+    cs_list = us.coin_spends
+    sum_hint = us.sum_hints[0]
+    blob = bytes(us)
+
+    lus = UnsignedSpend.from_bytes(blob, lazy=True)
+    assert isinstance(lus, UnsignedSpend)
+    assert "coin_spends" not in vars(lus)
+    assert isinstance(lus.coin_spends, LazyList)
+    assert lus.coin_spends[2] == cs_list[2]
+    assert len(lus.coin_spends) == 5
+    assert "sum_hints" not in vars(lus)
+
+    assert lus == us
+    assert us == lus
+    assert lus.coin_spends == cs_list
+    assert cs_list == lus.coin_spends
+    assert lus.coin_spends[1:3] == cs_list[1:3]
+    assert isinstance(lus.sum_hints[0], SumHint)
+
+    # a `LazyList` acts like a read-only `list`
+    lazy_list = UnsignedSpend.from_bytes(blob, lazy=True).coin_spends
+    assert len(lazy_list) == 5
+    assert lazy_list != cs_list[:4] and lazy_list != cs_list[::-1]
+    assert lazy_list[::-2] == cs_list[::-2] and lazy_list[-1] == cs_list[-1]
+    assert lazy_list + cs_list[:1] == cs_list + cs_list[:1]
+    assert cs_list[:1] + lazy_list == cs_list[:1] + cs_list
+    assert lazy_list != tuple(cs_list)
+    assert lazy_list <= lazy_list
+    with pytest.raises(TypeError):
+        hash(lazy_list)
+    with pytest.raises(IndexError):
+        lazy_list[5]
+    assert lus.sum_hints[0].final_public_key() == sum_hint.final_public_key()
+    assert [_.name for _ in dataclass_fields(lus)] == [
+        _.name for _ in dataclass_fields(us)
+    ]
+    assert repr(lus) == repr(us)
+    assert type(copy.copy(lus)) is UnsignedSpend
+    assert copy.copy(lus) == us
+    assert bytes(lus) == blob
+
+    # defaults
+    us = UnsignedSpend(cs_list[:1])
+    lus = UnsignedSpend.from_bytes(bytes(us), lazy=True)
+    assert lus.sum_hints == [] and lus.agg_sig_me_network_suffix == b""
+    assert lus == us
+
+    @dataclass
+    class Foo:
+        a: int
+        b: str
+
+    fp = lazy_from_program_for_type(Foo)
+    assert fp(Program.to([100, "boss"])) == Foo(100, "boss")
+    with pytest.raises(EncodingError):
+        fp(Program.to([100]))
+    with pytest.raises(EncodingError):
+        UnsignedSpend.from_bytes(bytes(Program.to([])), lazy=True)
+
+
+def test_serde_cache():
+    built = []
+
+    def build(t):
+        built.append(t)
+        return lambda x: (t, x)
+
+    cache = SerdeCache(build, maxsize=2)
+    assert cache(int) is cache(int)
+    assert cache.cache_info() == (1, 1, 2, 1)
+    cache(str)
+    cache(bytes)
+    assert cache.cache_info().currsize == 2
+    # `int` was least recently used, so it was evicted
+    cache(int)
+    assert built == [int, str, bytes, int]
+    cache.cache_clear()
+    assert cache.cache_info() == (0, 0, 2, 0)
+
+    results = []
+
+    def worker():
+        for _ in range(100):
+            results.append(cache(List[int]))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    info = cache.cache_info()
+    assert info.hits + info.misses == 400
+    assert info.currsize == 1
+
+    assert to_program_for_type(Tuple[int, str]) is to_program_for_type(Tuple[int, str])
+
+
+def test_recursive_dataclass():
+    # every target round trips `Tree` in `test_round_trip`
+    tree = Tree(1, [Tree(2, [LEAF]), Tree(4, [], LEAF)])
+    p = to_program_for_type(Tree)(tree)
+    assert p.at("rfrfrrf") == Program.to(("p", (1, [3, []])))
+
+
+def test_backrefs():
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    coin_spends = []
+    for idx, public_key in enumerate(public_keys):
+        puzzle = puzzle_for_synthetic_public_key(public_key)
+        coin = Coin(bytes([idx] * 32), puzzle.tree_hash(), 1000 * idx)
+        coin_spends.append(CoinSpend(coin, puzzle, Program.to([0, [1, idx], 0])))
+    us = UnsignedSpend(coin_spends, agg_sig_me_network_suffix=b"a" * 32)
+
+    blob = us.to_bytes(backrefs=True)
+    assert us.to_bytes() == bytes(us)
+    # the shared puzzle mod is only serialized once
+    assert len(blob) < len(bytes(us)) * 2 // 3
+    assert Program.from_bytes(blob) == Program.from_bytes(bytes(us))
+    assert UnsignedSpend.from_bytes(blob) == us
+    assert UnsignedSpend.from_bytes(blob, lazy=True) == us
+
+
+def test_mod_table():
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    puzzles = [puzzle_for_synthetic_public_key(_) for _ in public_keys]
+    # not curried
+    puzzles.append(Program.to([1, 1]))
+    # curried with no arguments
+    puzzles.append(Program.to(1).curry())
+    coin_spends = [
+        CoinSpend(
+            Coin(bytes([idx] * 32), puzzle.tree_hash(), 1000 * idx),
+            puzzle,
+            Program.to([0, [1, idx], 0]),
+        )
+        for idx, puzzle in enumerate(puzzles)
+    ]
+    us = UnsignedSpend(coin_spends, agg_sig_me_network_suffix=b"a" * 32)
+
+    mods, coin_spend_tuples = mod_table_from_storage(coin_spends)
+    assert len(mods) == 3
+    assert [_[1] for _ in coin_spend_tuples] == [0, 0, 0, 1, 2]
+
+    blob = us.to_bytes(version=1)
+    assert len(blob) < len(bytes(us)) * 2 // 3
+    for b in [blob, us.to_bytes(backrefs=True, version=1)]:
+        for lazy in [False, True]:
+            us2 = UnsignedSpend.from_bytes(b, lazy=lazy)
+            assert us2 == us
+            assert not isinstance(us2, ModTableUnsignedSpend)
+            assert [_.coin.name() for _ in us2.coin_spends] == [
+                _.coin.name() for _ in coin_spends
+            ]
+
+    p = to_program_for_type(ModTableUnsignedSpend)(us)
+    assert p.first().first() == Program.to("m")
+    bad = Program.to([("m", ([puzzles[0]], [[b"a" * 32, 1, (1, []), 0, 0]]))])
+    with pytest.raises(EncodingError):
+        UnsignedSpend.from_bytes(bytes(bad))
+
+
+def test_compact_encoding():
+    for amount in [0, 1, 7, 10, 127, 128, 1000, 1001, 10**12, 3 * 10**20, 2**64 - 1]:
+        blob = compact_amount(amount)
+        assert amount_for_compact_amount(blob) == amount
+    assert compact_amount(10**12) == bytes([1 << 4 | 12])
+    with pytest.raises(EncodingError):
+        compact_amount(-1)
+
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 8)]
+    # coins created in pairs by the same parent, and one with a parent of its own
+    coin_spends = []
+    for idx, public_key in enumerate(public_keys):
+        puzzle = puzzle_for_synthetic_public_key(public_key)
+        coin = Coin(bytes([idx // 2] * 32), puzzle.tree_hash(), 10**12 * (idx + 1))
+        coin_spends.append(CoinSpend(coin, puzzle, Program.to([0, [1, idx], 0])))
+    us = UnsignedSpend(coin_spends, agg_sig_me_network_suffix=b"a" * 32)
+
+    blob = us.to_bytes(version=2)
+    assert len(blob) < len(us.to_bytes(version=1)) - 3 * 32
+    # with no parent shared, it's still no bigger than version 1
+    unshared = UnsignedSpend(coin_spends[::2], agg_sig_me_network_suffix=b"a" * 32)
+    assert len(unshared.to_bytes(version=2)) <= len(unshared.to_bytes(version=1))
+    assert UnsignedSpend.from_bytes(unshared.to_bytes(version=2)) == unshared
+    for b in [blob, us.to_bytes(backrefs=True, version=2)]:
+        for lazy in [False, True]:
+            us2 = UnsignedSpend.from_bytes(b, lazy=lazy)
+            assert us2 == us
+            assert not isinstance(us2, CompactUnsignedSpend)
+
+    p = to_program_for_type(CompactUnsignedSpend)(us)
+    assert p.first().first() == Program.to("t")
+    parents = p.first().rest().first()
+    # only parents of more than one coin spend are in the table
+    assert list(parents.as_iter()) == [Program.to(bytes([_] * 32)) for _ in range(3)]
+    coin_spend_tuples = list(p.first().rest().rest().rest().first().as_iter())
+    assert [_.first().atom for _ in coin_spend_tuples] == [
+        b"",
+        b"",
+        b"\x01",
+        b"\x01",
+        b"\x02",
+        b"\x02",
+        bytes([3] * 32),
+    ]
+    puzzle = coin_spends[0].puzzle_reveal
+    good = Program.to([("t", [[b"a" * 32], [puzzle], [[0, 0, (0, 0), b"", 0]]])])
+    assert UnsignedSpend.from_bytes(bytes(good)).coin_spends[0].puzzle_reveal == puzzle
+    # parent index 1 is out of range
+    bad = Program.to([("t", [[b"a" * 32], [puzzle], [[1, 0, (0, 0), b"", 0]]])])
+    with pytest.raises(EncodingError):
+        UnsignedSpend.from_bytes(bytes(bad))
+
+
+def test_compact_hints():
+    roots = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    paths = [[1, 5, idx, 7] for idx in range(4)]
+    path_hints = [PathHint(root, path) for path in paths for root in roots]
+    sum_hints = [
+        SumHint(
+            [root.child_for_path(path) for root in roots],
+            BLSSecretExponent.from_int(100 + idx),
+        )
+        for idx, path in enumerate(paths)
+    ]
+    # keys that no path hint derives are stored in the key table
+    sum_hints.append(SumHint(roots[:2], BLSSecretExponent.from_int(5)))
+    sum_hints.append(SumHint(roots[:1], BLSSecretExponent.from_int(6)))
+
+    keys, compact_path_hints, compact_sum_hints = compact_hints_from_storage(
+        (sum_hints, path_hints)
+    )
+    assert keys == roots
+    assert compact_path_hints[:4] == [
+        (0, 0, [1, 5, 0, 7]),
+        (1, 4, []),
+        (2, 4, []),
+        (0, 2, [1, 7]),
+    ]
+    assert compact_sum_hints[0][0] == [0, 1, 2]
+    assert compact_sum_hints[-2][0] == [12, 13]
+    assert compact_hints_to_storage((keys, compact_path_hints, compact_sum_hints)) == (
+        sum_hints,
+        path_hints,
+    )
+
+    puzzle = Program.to(1)
+    coin_spends = [
+        CoinSpend(Coin(bytes(32), puzzle.tree_hash(), 1), puzzle, Program.to(0))
+    ]
+    us = UnsignedSpend(coin_spends, sum_hints, path_hints, b"a" * 32)
+    blob = us.to_bytes(version=3)
+    assert len(blob) < len(us.to_bytes(version=2)) // 2
+    for b in [blob, us.to_bytes(backrefs=True, version=3)]:
+        for lazy in [False, True]:
+            assert UnsignedSpend.from_bytes(b, lazy=lazy) == us
+
+    us = UnsignedSpend(coin_spends)
+    assert UnsignedSpend.from_bytes(us.to_bytes(version=3)) == us
+    p = to_program_for_type(CompactHintsUnsignedSpend)(
+        CompactHintsUnsignedSpend.from_unsigned_spend(us)
+    )
+    # with no hints, the hints key is left out
+    assert [_.first().atom for _ in p.as_iter()] == [b"h"]
+    # each one gets its own default hints
+    compact = CompactHintsUnsignedSpend(coin_spends)
+    compact.hints[1].append(path_hints[0])
+    assert CompactHintsUnsignedSpend(coin_spends).hints == ([], [])
+
+    for bad in [
+        [[], [(0, 0, [])], []],
+        [roots, [(0, 1, [])], []],
+        [roots, [], [([3], 0)]],
+    ]:
+        with pytest.raises(EncodingError):
+            compact_hints_to_storage(bad)
+
+
+def test_stream_unsigned_spend():
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    coin_spends = [
+        CoinSpend(
+            Coin(bytes([idx] * 32), Program.to(idx).tree_hash(), 1000 * idx),
+            Program.to(idx),
+            Program.to([0, [1, idx], 0]),
+        )
+        for idx in range(5)
+    ]
+    header = UnsignedSpend(
+        [],
+        [SumHint(public_keys, BLSSecretExponent.from_int(5))],
+        [PathHint(public_keys[0], [1, 2, 3])],
+        b"a" * 32,
+    )
+    us = UnsignedSpend(
+        coin_spends,
+        *[
+            getattr(header, _)
+            for _ in ("sum_hints", "path_hints", "agg_sig_me_network_suffix")
+        ],
+    )
+
+    f = io.BytesIO()
+    # coin spends from the header come first, then the generator's
+    stream_unsigned_spend(
+        UnsignedSpend(
+            coin_spends[:1],
+            header.sum_hints,
+            header.path_hints,
+            header.agg_sig_me_network_suffix,
+        ),
+        (_ for _ in coin_spends[1:]),
+        f,
+    )
+    blob = f.getvalue()
+    assert len(blob) == len(bytes(us))
+    assert UnsignedSpend.from_bytes(blob) == us
+
+    # a buffer can have the coin spends anywhere; a file needs them last
+    for source in [blob, io.BytesIO(blob), bytes(us)]:
+        header2, coin_spends2 = iter_unsigned_spend(source)
+        assert header2 == header
+        assert list(coin_spends2) == coin_spends
+
+    header2, coin_spends2 = iter_unsigned_spend(io.BytesIO(bytes(us)))
+    with pytest.raises(EncodingError):
+        list(coin_spends2)
+
+    header2, coin_spends2 = iter_unsigned_spend(bytes(UnsignedSpend([])))
+    assert header2 == UnsignedSpend([]) and list(coin_spends2) == []
+
+
+def test_arena():
+    p = Program.to([b"foo", (1, 2), 1000])
+    arena = NodeArena.from_bytes(bytes(p) + b"trailing")
+    assert len(arena) == 9
+    assert arena.serialized(0) == bytes(p)
+    items = list(arena.as_iter(0))
+    assert [arena.atom(_) for _ in items] == [b"foo", None, Program.to(1000).atom]
+    first, rest = arena.pair(items[1])
+    assert (arena.atom(first), arena.atom(rest)) == (b"\x01", b"\x02")
+    assert arena.to_program(items[1]) == Program.to((1, 2))
+    assert arena.atom(0) is None and arena.pair(items[0]) is None
+
+    # deep trees don't recurse
+    deep = bytes([0xFF]) * 100000 + bytes([0x80]) * 100001
+    arena = NodeArena.from_bytes(deep)
+    assert len(arena) == 200001
+    assert arena.serialized(0) == deep
+
+    f = from_arena_for_type(Tuple[int, Optional[str], List[bytes]])
+    for bad in [b"", b"\xff\x80", b"\x82\x01", bytes([0xFC]) + bytes(5)]:
+        with pytest.raises(EncodingError):
+            NodeArena.from_bytes(bad)
+    with pytest.raises(BackReferenceError):
+        NodeArena.from_bytes(sample_unsigned_spend().to_bytes(backrefs=True))
+    with pytest.raises(EncodingError):
+        f(NodeArena.from_bytes(bytes(Program.to([5]))), 0)
+
+
+def test_iterative():
+    # far deeper than the recursion limit
+    depth = sys.getrecursionlimit() * 5
+    deep = Tree(0, [])
+    for _ in range(depth):
+        deep = Tree(0, [deep])
+    blob = iterative_to_bytes_for_type(Tree)(deep)
+    deep = iterative_from_program_for_type(Tree)(Program.from_bytes(blob))
+    count = 0
+    while deep.children:
+        deep = deep.children[0]
+        count += 1
+    assert count == depth
+
+    f = iterative_from_program_for_type(Tuple[int, str])
+    for bad in [Program.to([1]), Program.to([1, "a", 2]), Program.to([[1], "a"])]:
+        with pytest.raises(EncodingError):
+            f(bad)
+    with pytest.raises(EncodingError):
+        iterative_from_program_for_type(UnsignedSpend)(Program.to([]))
+
+
+def test_size_report():
+    cs_list = [rnd_coin_spend(_) for _ in range(3)]
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 4)]
+    sum_hint = SumHint(public_keys, BLSSecretExponent.from_int(3))
+    us = UnsignedSpend(cs_list, [sum_hint], [], b"a" * 32)
+    blob = bytes(us)
+
+    report = size_report_for_type(UnsignedSpend, TUPLE_LABELS)(us)
+    assert report.name == "UnsignedSpend"
+    assert report.raw == len(blob)
+    assert report.compressed == len(zlib.compress(blob, level=9))
+    # `path_hints` is the default, so it isn't serialized
+    assert [_.name for _ in report.children] == [
+        "coin_spends",
+        "sum_hints",
+        "agg_sig_me_network_suffix",
+    ]
+    coin_spends = report.children[0]
+    assert [_.name for _ in coin_spends.children] == ["[0]", "[1]", "[2]"]
+    first = coin_spends.children[0]
+    assert [_.name for _ in first.children] == [
+        "parent_coin_info",
+        "puzzle_reveal",
+        "amount",
+        "solution",
+    ]
+    assert first.children[1].raw == len(bytes(cs_list[0].puzzle_reveal))
+    # four cons boxes and a nil terminator
+    assert first.raw == sum(_.raw for _ in first.children) + 5
+    assert report.children[2].raw == 33
+
+    # each part is where its serialization is in the whole
+    for _path, part in report.walk():
+        tree = Program.from_bytes(blob[part.start : part.start + part.raw])
+        assert len(bytes(tree)) == part.raw
+    assert blob[first.children[1].start :].startswith(bytes(cs_list[0].puzzle_reveal))
+
+    # compressed sizes are shares of one stream, so a small field isn't
+    # charged zlib's overhead, and the parts add up to the whole
+    assert first.children[2].raw <= 9
+    assert first.children[2].compressed <= first.children[2].raw + 1
+    assert sum(_.compressed for _ in report.children) <= report.compressed
+
+    totals = report.totals()
+    assert totals["UnsignedSpend.coin_spends[*].solution"][0] == sum(
+        len(bytes(_.solution)) for _ in cs_list
+    )
+
+    lines = report.lines(max_depth=1)
+    assert len(lines) == 5
+    assert lines[1].split() == [
+        str(report.raw),
+        str(report.compressed),
+        "100.0%",
+        "UnsignedSpend",
+    ]
+
+    report = size_report_for_type(Tuple[int, str])((5, "hi"))
+    assert [_.name for _ in report.children] == ["#0", "#1"]
@@ -1,5 +1,7 @@
 import zlib
 
+import pytest
+
 from tests.generate import se_generate, bytes32_generate, uint256_generate
 
 from chik_base.core import Coin, CoinSpend, SpendBundle
@@ -14,7 +16,15 @@ from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
     solution_for_conditions,
     calculate_synthetic_offset,
 )
-from hsmk.process.sign import sign, generate_synthetic_offset_signatures
+from hsmk.cmds.hsmmerge import create_spend_bundle_for_shards
+from hsmk.process.conditions_cache import CONDITIONS_CACHE, CostBudgetExceeded
+from hsmk.process.parallel_sign import sign_in_parallel
+from hsmk.process.shard import split_unsigned_spend
+from hsmk.process.sign import (
+    generate_synthetic_offset_signatures,
+    sign,
+    sign_batch,
+)
 from hsmk.puzzles.conlang import CREATE_COIN
 from hsmk.util.byte_chunks import (
     ChunkAssembler,
@@ -22,7 +32,6 @@ from hsmk.util.byte_chunks import (
     create_chunks_for_blob,
 )
 
-
 AGG_SIG_ME_ADDITIONAL_DATA = bytes.fromhex(
     "ccd5bb71183532bff220ba46c268991a3ff07eb358e8255a65c30a2dce0e5fbb"
 )
@@ -162,6 +171,124 @@ def test_lifecycle():
     assert validates is True
 
 
+def sample_unsigned_spend(se_A, se_B, count: int) -> UnsignedSpend:
+    """
+    `count` standard coin spends, each locked by the sum of a child key of A and
+    a child key of B, with the hints to sign them
+    """
+    pk_A = se_A.public_key()
+    pk_B = se_B.public_key()
+
+    coin_spends = []
+    sum_hints = []
+    path_hints = []
+    for idx in range(count):
+        path = [idx, 1]
+        a_pk = se_A.child_for_path(path).public_key()
+        b_pk = se_B.child_for_path(path).public_key()
+        sum_pk = a_pk + b_pk
+        puzzle = puzzle_for_public_key_and_hidden_puzzle(sum_pk, DEFAULT_HIDDEN_PUZZLE)
+        coin = Coin(bytes32_generate(idx), puzzle.tree_hash(), 1000 + idx)
+        solution = solution_for_conditions(
+            [[CREATE_COIN, bytes32_generate(idx, "dest"), coin.amount]]
+        )
+        coin_spends.append(CoinSpend(coin, puzzle, solution))
+        synthetic_se = calculate_synthetic_offset(sum_pk, DEFAULT_HIDDEN_PUZZLE_HASH)
+        sum_hints.append(SumHint([a_pk, b_pk], synthetic_se))
+        path_hints.extend([PathHint(pk_A, path), PathHint(pk_B, path)])
+    return UnsignedSpend(coin_spends, sum_hints, path_hints, AGG_SIG_ME_ADDITIONAL_DATA)
+
+
+def test_sharded_lifecycle():
+    """
+    split an `UnsignedSpend` into shards, sign each shard separately, then
+    merge all the signatures into one `SpendBundle`
+    """
+    se_A = se_generate(100)
+    se_B = se_generate(200)
+
+    unsigned_spend = sample_unsigned_spend(se_A, se_B, 7)
+    coin_spends = unsigned_spend.coin_spends
+    # a hint no coin spend needs is dropped
+    unsigned_spend.path_hints.append(PathHint(se_A.public_key(), [1000]))
+
+    max_size = len(bytes(unsigned_spend)) // 3
+    shards = split_unsigned_spend(unsigned_spend, max_size)
+    assert len(shards) > 2
+    assert sum([_.coin_spends for _ in shards], start=[]) == coin_spends
+    for shard in shards:
+        assert len(bytes(shard)) <= max_size
+        count = len(shard.coin_spends)
+        assert len(shard.sum_hints) == count
+        assert len(shard.path_hints) == 2 * count
+
+    signatures = []
+    for shard in shards:
+        for se in [se_A, se_B]:
+            signatures.extend(_.signature for _ in sign(shard, [se]))
+    spend_bundle = create_spend_bundle_for_shards(shards, signatures)
+    assert spend_bundle.coin_spends == coin_spends
+    assert debug_spend_bundle(spend_bundle) is True
+
+    with pytest.raises(ValueError):
+        create_spend_bundle_for_shards(shards + shards[:1], signatures)
+
+    with pytest.raises(ValueError):
+        split_unsigned_spend(unsigned_spend, 100)
+
+
+def test_parallel_sign(tmp_path):
+    se_A = se_generate(100)
+    se_B = se_generate(200)
+    unsigned_spend = sample_unsigned_spend(se_A, se_B, 7)
+
+    signatures = sign(unsigned_spend, [se_A, se_B])
+    assert len(signatures) == 2 * 7
+    for workers in [1, 3, 20]:
+        assert sign_in_parallel(unsigned_spend, [se_A, se_B], workers) == signatures
+    assert sign_in_parallel(unsigned_spend, [se_B], 2) == sign(unsigned_spend, [se_B])
+
+    # workers open the conditions cache file themselves
+    CONDITIONS_CACHE.attach(str(tmp_path / "conditions.sqlite"))
+    try:
+        assert sign_in_parallel(unsigned_spend, [se_A, se_B], 3) == signatures
+    finally:
+        CONDITIONS_CACHE.close()
+
+    spend_bundle = create_spend_bundle(unsigned_spend, signatures)
+    assert debug_spend_bundle(spend_bundle) is True
+
+
+def test_sign_batch():
+    se_A = se_generate(100)
+    se_B = se_generate(200)
+    unsigned_spend = sample_unsigned_spend(se_A, se_B, 5)
+    shards = split_unsigned_spend(unsigned_spend, len(bytes(unsigned_spend)) // 2)
+    unsigned_spends = [unsigned_spend] + shards + [unsigned_spend]
+
+    results = sign_batch(unsigned_spends, [se_A, se_B])
+    assert results == [sign(_, [se_A, se_B]) for _ in unsigned_spends]
+    # repeated jobs are signed once
+    for first, again in zip(results[0], results[-1]):
+        assert first.signature is again.signature
+    shard_signatures = sum(results[1:-1], start=[])
+    for first, again in zip(results[0], shard_signatures):
+        assert first.signature is again.signature
+
+    assert sign_batch([], [se_A]) == []
+
+
+def test_sign_cost_budget():
+    se_A = se_generate(100)
+    unsigned_spend = sample_unsigned_spend(se_A, se_generate(200), 3)
+    signatures = sign(unsigned_spend, [se_A])
+    assert sign(unsigned_spend, [se_A], max_cost=1 << 34) == signatures
+    with pytest.raises(CostBudgetExceeded):
+        sign(unsigned_spend, [se_A], max_cost=10000)
+    with pytest.raises(CostBudgetExceeded):
+        sign_in_parallel(unsigned_spend, [se_A], 2, max_cost=10000)
+
+
 def create_spend_bundle(unsigned_spend, signatures):
     extra_signatures = generate_synthetic_offset_signatures(unsigned_spend)
 
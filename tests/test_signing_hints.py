@@ -0,0 +1,91 @@
+from chik_base.bls12_381 import BLSSecretExponent
+
+from hsmk.core.signing_hints import (
+    DerivationTrie,
+    FinalPublicKeyCache,
+    PathHint,
+    SumHint,
+)
+from hsmk.process.sign import build_sum_hints_lookup, secret_key_for_public_key
+
+
+def test_final_public_key_cache():
+    public_keys = [BLSSecretExponent.from_int(_).public_key() for _ in range(1, 5)]
+    offset = BLSSecretExponent.from_int(1000)
+    sum_hints = [
+        SumHint(public_keys[:2], offset),
+        SumHint(public_keys[2:], offset),
+        SumHint(public_keys[:2], BLSSecretExponent.from_int(1001)),
+        # equal to the first one
+        SumHint(list(public_keys[:2]), BLSSecretExponent.from_int(1000)),
+    ]
+    expected = [
+        sum(_.public_keys, start=_.synthetic_offset.public_key()) for _ in sum_hints
+    ]
+
+    cache = FinalPublicKeyCache(maxsize=3)
+    assert cache.final_public_keys(sum_hints) == expected
+    assert cache.cache_info() == (0, 4, 3, 3)
+    assert cache.final_public_keys(sum_hints[1:]) == expected[1:]
+    assert cache.cache_info() == (3, 4, 3, 3)
+    assert cache.final_public_keys([]) == []
+    cache.cache_clear()
+    assert cache.cache_info() == (0, 0, 3, 0)
+
+    assert [_.final_public_key() for _ in sum_hints] == expected
+    assert build_sum_hints_lookup(sum_hints) == {
+        expected[0]: sum_hints[3],
+        expected[1]: sum_hints[1],
+        expected[2]: sum_hints[2],
+    }
+
+
+def test_derivation_trie():
+    secret = BLSSecretExponent.from_int(100)
+    public_key = secret.public_key()
+    paths = [[1, 5, 10], [1, 5, 11], [1, 6], [1, 5, 10], []]
+
+    trie = DerivationTrie(maxsize=100)
+    for path in paths:
+        assert trie.child_for_path(public_key, path) == public_key.child_for_path(path)
+    # each node is derived once, and found by the longest cached prefix after
+    assert trie.cache_info() == (2 + 1 + 3, 3 + 1 + 1, 100, 5)
+
+    for path in paths:
+        assert trie.child_for_path(secret, path) == secret.child_for_path(path)
+    assert trie.cache_info().currsize == 10
+
+    trie.cache_clear()
+    assert trie.cache_info() == (0, 0, 100, 0)
+
+    # the least recently used nodes go first
+    trie = DerivationTrie(maxsize=3)
+    trie.child_for_path(public_key, [1, 2])
+    trie.child_for_path(public_key, [3])
+    trie.child_for_path(public_key, [1, 2])
+    trie.child_for_path(public_key, [4])
+    assert trie.child_for_path(public_key, [1, 2]) == public_key.child_for_path([1, 2])
+    assert trie.cache_info().hits == 2 + 2
+
+    # evicting nodes never leaves one cached without its parent
+    trie = DerivationTrie(maxsize=3)
+    for path in [[1, 5, 10], [2], [1, 5, 11], [1, 5, 10]]:
+        assert trie.child_for_path(public_key, path) == public_key.child_for_path(path)
+    trie = DerivationTrie(maxsize=10)
+    paths = [[idx, 0, 0] for idx in range(20)]
+    for path in paths + paths:
+        assert trie.child_for_path(public_key, path) == public_key.child_for_path(path)
+    assert trie.cache_info().currsize == 10
+
+    path_hint = PathHint(public_key, [1, 5, 10])
+    assert path_hint.public_key() == public_key.child_for_path([1, 5, 10])
+    assert secret_key_for_public_key(
+        [secret], [1, 5, 10], public_key, path_hint.public_key()
+    ) == secret.child_for_path([1, 5, 10])
+    # a path hint that doesn't lead to the key
+    assert (
+        secret_key_for_public_key(
+            [secret], [1, 5, 11], public_key, path_hint.public_key()
+        )
+        is None
+    )
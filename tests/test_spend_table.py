@@ -0,0 +1,123 @@
+from array import array
+
+import io
+
+import pytest
+
+from chik_base.core import Coin, CoinSpend
+from klvm_rs import Program
+
+from hsmk.cmds.hsmk import (
+    address_for_puzzle_hash,
+    summarize_spend_table,
+    summarize_unsigned_spend,
+)
+from hsmk.core import spend_table
+from hsmk.core.spend_table import SpendTable
+from hsmk.core.unsigned_spend import UnsignedSpend
+
+from .generate import bytes32_generate
+
+
+def coin_spends_for_amounts(amounts, puzzle_count):
+    puzzles = [Program.to(_) for _ in range(puzzle_count)]
+    return [
+        CoinSpend(
+            Coin(
+                bytes32_generate(idx // 2),
+                puzzles[idx % puzzle_count].tree_hash(),
+                amount,
+            ),
+            puzzles[idx % puzzle_count],
+            Program.to(0),
+        )
+        for idx, amount in enumerate(amounts)
+    ]
+
+
+def skip_without_numpy(use_numpy: bool) -> None:
+    if use_numpy and spend_table.numpy is None:
+        pytest.skip("numpy isn't installed")
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_spend_table(use_numpy):
+    skip_without_numpy(use_numpy)
+    # amounts near the top of the 64-bit range, so naive sums would overflow
+    amounts = [(1 << 64) - 1 - idx for idx in range(20)] + [0, 1, 10**12]
+    coin_spends = coin_spends_for_amounts(amounts, 3)
+    table = SpendTable.for_coin_spends(coin_spends, use_numpy=use_numpy)
+    assert isinstance(table.amounts, array) is not use_numpy
+
+    assert len(table) == len(coin_spends)
+    for index, coin_spend in enumerate(coin_spends):
+        coin = coin_spend.coin
+        assert table.parent_id(index) == coin.parent_coin_info
+        assert table.puzzle_hash(index) == coin.puzzle_hash
+        assert table.coin_id(index) == coin.name()
+        assert table.amount(index) == coin.amount
+        assert coin.name() in table
+        assert table.index_for_coin_id(coin.name()) == index
+    assert bytes32_generate(1000) not in table
+    with pytest.raises(IndexError):
+        table.coin_id(len(coin_spends))
+
+    assert table.total_amount() == sum(amounts)
+
+    totals = table.totals_by_puzzle_hash()
+    expected_totals = {}
+    for coin_spend in coin_spends:
+        coin = coin_spend.coin
+        expected_totals[coin.puzzle_hash] = (
+            expected_totals.get(coin.puzzle_hash, 0) + coin.amount
+        )
+    assert totals == expected_totals
+    assert list(totals) == list(expected_totals)
+
+    puzzle_hash = coin_spends[1].coin.puzzle_hash
+    assert table.indices_for_puzzle_hash(puzzle_hash) == list(
+        range(1, len(coin_spends), 3)
+    )
+    assert table.indices_for_puzzle_hash(bytes(32)) == []
+
+    empty = SpendTable.for_coin_spends([], use_numpy=use_numpy)
+    assert len(empty) == 0
+    assert empty.total_amount() == 0
+    assert empty.totals_by_puzzle_hash() == {}
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_summarize_spend_table(use_numpy):
+    skip_without_numpy(use_numpy)
+    amounts = [10**12, 2 * 10**12, 5 * 10**11, 1]
+    coin_spends = coin_spends_for_amounts(amounts, 2)
+    table = SpendTable.for_coin_spends(coin_spends, use_numpy=use_numpy)
+    f = io.StringIO()
+    summarize_spend_table(table, f)
+    addresses = [address_for_puzzle_hash(_.coin.puzzle_hash) for _ in coin_spends]
+    assert f.getvalue().splitlines() == [
+        "",
+        f"ADDRESS SPENT: 1.500000000000 xck at address {addresses[0]}",
+        f"ADDRESS SPENT: 2.000000000001 xck at address {addresses[1]}",
+        "TOTAL SPENT: 3.500000000001 xck in 4 coins at 2 addresses",
+    ]
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_spend_table_out_of_range(use_numpy):
+    skip_without_numpy(use_numpy)
+    # consensus rejects these, but a request can still carry them
+    amounts = [-5, 1 << 64, 7, -5]
+    coin_spends = coin_spends_for_amounts(amounts, 2)
+    table = SpendTable.for_coin_spends(coin_spends, use_numpy=use_numpy)
+    assert table.amounts == amounts
+    assert [table.amount(_) for _ in range(len(table))] == amounts
+    assert table.total_amount() == sum(amounts)
+    assert list(table.totals_by_puzzle_hash().values()) == [2, (1 << 64) - 5]
+
+    f = io.StringIO()
+    summarize_unsigned_spend(UnsignedSpend(coin_spends, [], [], bytes(32)), f)
+    lines = f.getvalue().splitlines()
+    assert lines[1].startswith("COIN SPENT: -0.000000000005 xck at address ")
+    assert lines[2].startswith("COIN SPENT: 18446744.073709551616 xck at address ")
+    assert "TOTAL SPENT: 18446744.073709551613 xck in 4 coins at 2 addresses" in lines
@@ -0,0 +1,117 @@
+import random
+
+from klvm_rs import Program
+
+import pytest
+
+from hsmk.consensus.conditions import MAX_COST
+from hsmk.process.conditions_cache import ConditionsCache
+from hsmk.process.standard_spend import COST_MODEL, run_standard_spend
+from hsmk.puzzles.p2_conditions import puzzle_for_conditions
+from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    MOD,
+    puzzle_for_synthetic_public_key,
+    solution_for_conditions,
+    solution_for_delegated_puzzle,
+    solution_for_hidden_puzzle,
+)
+
+from .generate import pk_generate
+
+
+def expected_run(puzzle: Program, solution: Program):
+    cost, result = puzzle.run_with_cost(solution, max_cost=MAX_COST)
+    return cost, bytes(result)
+
+
+def random_atom(r: random.Random) -> bytes:
+    # sizes either side of each serialized size boundary, and single bytes
+    # either side of the ones serialized as themselves
+    size = r.choice([0, 1, 1, 1, 2, 32, 48, 63, 64, 100, 0x1FFF, 0x2000])
+    if size == 1:
+        return bytes([r.choice([0, 1, 0x7F, 0x80, 0xFF])])
+    return bytes(r.getrandbits(8) for _ in range(size))
+
+
+def random_tree(r: random.Random, depth: int = 0):
+    choice = r.randrange(4 if depth < 4 else 2)
+    if choice == 0:
+        return random_atom(r)
+    if choice == 1:
+        return r.randint(-(1 << 70), 1 << 70)
+    if choice == 2:
+        return (random_tree(r, depth + 1), random_tree(r, depth + 1))
+    return [random_tree(r, depth + 1) for _ in range(r.randrange(5))]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_standard_spend_matches_klvm(seed):
+    assert COST_MODEL is not None
+    r = random.Random(seed)
+    for idx in range(25):
+        puzzle = puzzle_for_synthetic_public_key(pk_generate(seed * 100 + idx))
+        conditions = random_tree(r)
+        solution = Program.to(random_tree(r)) if r.randrange(2) else Program.to(0)
+        solution = solution_for_delegated_puzzle(
+            puzzle_for_conditions(conditions), solution
+        )
+        expected = expected_run(puzzle, solution)
+        assert run_standard_spend(bytes(puzzle), bytes(solution)) == expected
+
+
+def test_standard_spend_shapes():
+    puzzle = puzzle_for_synthetic_public_key(pk_generate(1))
+    conditions = [[51, bytes(32), 1000], [52, 1]]
+    solution = solution_for_conditions(conditions)
+    puzzle_blob = bytes(puzzle)
+    solution_blob = bytes(solution)
+    assert run_standard_spend(puzzle_blob, solution_blob) == expected_run(
+        puzzle, solution
+    )
+    assert run_standard_spend(puzzle_blob, bytes(solution_for_conditions([]))) == (
+        expected_run(puzzle, solution_for_conditions([]))
+    )
+
+    not_standard = [
+        # the hidden puzzle path
+        (puzzle, solution_for_hidden_puzzle(pk_generate(2), Program.to(1), 0)),
+        # a delegated puzzle that isn't `(q . conditions)`
+        (puzzle, solution_for_delegated_puzzle(Program.to(1), Program.to(conditions))),
+        # another puzzle
+        (MOD.curry(bytes(47)), solution),
+        (MOD.curry(bytes(48), 0), solution),
+        (Program.to((1, conditions)), solution),
+        # extra solution arguments
+        (puzzle, Program.to([0, (1, conditions), 0, 0])),
+    ]
+    for p, s in not_standard:
+        assert run_standard_spend(bytes(p), bytes(s)) is None
+
+    # truncated, or with trailing bytes
+    assert run_standard_spend(puzzle_blob, solution_blob[:-1]) is None
+    assert run_standard_spend(puzzle_blob, solution_blob + b"\x80") is None
+    assert run_standard_spend(puzzle_blob[:-1], solution_blob) is None
+
+    # `8105` is 5 serialized as it shouldn't be, and `fe` is a back reference
+    odd_solution = Program.to([0, (1, [5]), 0])
+    blob = bytes(odd_solution)
+    assert blob.count(b"\x05") == 1
+    assert run_standard_spend(puzzle_blob, blob.replace(b"\x05", b"\x81\x05")) is None
+    assert run_standard_spend(puzzle_blob, blob.replace(b"\x05", b"\xfe\x02")) is None
+    long_size = bytes(odd_solution).replace(b"\x05", b"\xc0\x01\x05")
+    assert run_standard_spend(puzzle_blob, long_size) is None
+
+
+def test_conditions_cache_standard_spend():
+    cache = ConditionsCache()
+    puzzle = puzzle_for_synthetic_public_key(pk_generate(3))
+    solution = solution_for_conditions([[51, bytes(32), 1000]])
+    expected = expected_run(puzzle, solution)
+    assert cache.run_for_blob(puzzle, solution) == expected
+    # answered without running klvm, so nothing is cached
+    assert cache.cache_info() == (0, 0, 1024, 0)
+
+    # too low a limit fails just as running it would
+    with pytest.raises(ValueError):
+        cache.run_for_blob(puzzle, solution, max_cost=expected[0] - 1)
+    assert cache.run_for_blob(puzzle, solution, max_cost=expected[0]) == expected
@@ -0,0 +1,91 @@
+from klvm_rs import Program
+
+import pytest
+
+from chik_base.bls12_381 import BLSSecretExponent
+
+from hsmk.klvm.tree_hash import TreeHashCache
+from hsmk.klvm_serde import EncodingError
+from hsmk.klvm_serde.stream import BackReferenceError, program_for_blob
+from hsmk.puzzles.p2_delegated_puzzle_or_hidden_puzzle import (
+    puzzle_for_synthetic_public_key,
+)
+
+
+def test_tree_hash_cache():
+    cache = TreeHashCache(maxsize=32)
+    for blob in ["80", "01", "8400000001", "ff01ff02ff0380"]:
+        p = Program.fromhex(blob)
+        assert cache.tree_hash_for_blob(bytes(p)) == p.tree_hash()
+
+    puzzles = [
+        puzzle_for_synthetic_public_key(BLSSecretExponent.from_int(_).public_key())
+        for _ in range(1, 6)
+    ]
+    for puzzle in puzzles:
+        blob = bytes(puzzle)
+        assert cache.tree_hash_for_blob(blob) == puzzle.tree_hash()
+        # trailing bytes are ignored
+        assert cache.tree_hash_for_blob(blob + b"\x80") == puzzle.tree_hash()
+    info = cache.cache_info()
+    # the mod is hashed for the first puzzle, then reused (twice per puzzle)
+    assert info.hits >= 2 * (len(puzzles) - 1) + 1
+    assert 0 < info.currsize <= 32
+
+    # a `Program` with a known serialization goes through the cache
+    p = program_for_blob(bytes(puzzles[0]))
+    hits = cache.cache_info().hits
+    assert cache.tree_hash(p) == puzzles[0].tree_hash()
+    assert cache.cache_info().hits > hits
+    # ... and others are hashed as usual
+    assert cache.tree_hash(Program.to([1, 2])) == Program.to([1, 2]).tree_hash()
+
+    cache.cache_clear()
+    assert cache.cache_info() == (0, 0, 32, 0)
+
+    # bounded memory
+    cache = TreeHashCache(maxsize=4)
+    for idx in range(20):
+        cache.tree_hash_for_blob(bytes(Program.to([idx, bytes(64)])))
+    assert cache.cache_info().currsize <= 4
+
+    with pytest.raises(EncodingError):
+        cache.tree_hash_for_blob(bytes.fromhex("ff01"))
+    with pytest.raises(EncodingError):
+        cache.tree_hash_for_blob(bytes.fromhex("8401"))
+    with pytest.raises(BackReferenceError):
+        cache.tree_hash_for_blob(bytes.fromhex("ff01fe02"))
+
+
+def retained_bytes(cache: TreeHashCache) -> int:
+    return sum(len(_[0]) for bucket in cache.buckets.values() for _ in bucket)
+
+
+def test_tree_hash_cache_retained_bytes():
+    # only whole blobs and curried mods are cached, not every suffix of a list
+    cache = TreeHashCache(max_bytes=10000, max_blob_size=5000)
+    items = Program.to([bytes([idx]) * 32 for idx in range(100)])
+    program = program_for_blob(bytes(items))
+    assert len(bytes(items)) < 5000
+    assert cache.tree_hash(program) == items.tree_hash()
+    assert cache.cache_info().currsize == 1
+    assert retained_bytes(cache) == cache.currbytes == len(bytes(items))
+
+    puzzle = puzzle_for_synthetic_public_key(BLSSecretExponent.from_int(1).public_key())
+    mod, _ = puzzle.uncurry()
+    assert cache.tree_hash_for_blob(bytes(puzzle)) == puzzle.tree_hash()
+    assert cache.cache_info().currsize == 3
+    assert cache.currbytes == len(bytes(items)) + len(bytes(puzzle)) + len(bytes(mod))
+
+    # bounded by bytes, as well as by entries
+    for idx in range(20):
+        items = Program.to([bytes([idx]) * 32, list(range(1000))])
+        assert cache.tree_hash_for_blob(bytes(items)) == items.tree_hash()
+    assert retained_bytes(cache) == cache.currbytes <= 10000
+
+    # and blobs too big to be worth caching are hashed natively
+    items = Program.to(list(range(2000)))
+    assert len(bytes(items)) > 5000
+    assert cache.tree_hash_for_blob(bytes(items)) == items.tree_hash()
+    assert cache.tree_hash(program_for_blob(bytes(items))) == items.tree_hash()
+    assert retained_bytes(cache) == cache.currbytes <= 10000
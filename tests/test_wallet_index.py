@@ -0,0 +1,67 @@
+import pytest
+
+from chik_base.bls12_381 import BLSSecretExponent
+
+from hsmk.process.wallet_index import WalletIndex, load_or_build_wallet_index
+
+
+def test_wallet_index():
+    secrets = [BLSSecretExponent.from_int(_) for _ in (100, 200)]
+    public_keys = [_.public_key() for _ in secrets]
+    wallet_index = WalletIndex.for_secrets(secrets, gap=3)
+    assert len(wallet_index) == 2 * (1 + 3)
+
+    # roots and the gap window need no path hint
+    for secret, public_key in zip(secrets, public_keys):
+        assert wallet_index.secret_for_public_key(public_key) == secret
+        for index in range(3):
+            assert wallet_index.secret_for_public_key(
+                public_key.child(index)
+            ) == secret.child(index)
+    assert wallet_index.secret_for_public_key(public_keys[0].child(3)) is None
+
+    # other keys need one
+    path = [3, 7]
+    child = public_keys[1].child_for_path(path)
+    assert wallet_index.secret_for_public_key(child) is None
+    secret = secrets[1].child_for_path(path)
+    assert wallet_index.secret_for_public_key(child, public_keys[1], path) == secret
+    assert wallet_index.secret_for_public_key(child, public_keys[0], path) is None
+    other = BLSSecretExponent.from_int(300).public_key()
+    assert wallet_index.secret_for_public_key(other.child(1), other, [1]) is None
+
+    blob = wallet_index.to_bytes()
+    # the public keys are encrypted
+    assert bytes(public_keys[0]) not in blob
+    restored = WalletIndex.from_bytes(blob, secrets)
+    assert restored.gap == 3
+    assert restored.keys == wallet_index.keys
+
+    with pytest.raises(ValueError):
+        WalletIndex.from_bytes(blob, secrets[:1])
+    with pytest.raises(ValueError):
+        WalletIndex.from_bytes(blob, secrets[::-1])
+    tampered = bytearray(blob)
+    tampered[30] ^= 1
+    with pytest.raises(ValueError):
+        WalletIndex.from_bytes(bytes(tampered), secrets)
+    with pytest.raises(ValueError):
+        WalletIndex.from_bytes(b"not an index", secrets)
+
+
+def test_load_or_build_wallet_index(tmp_path):
+    secrets = [BLSSecretExponent.from_int(_) for _ in (100, 200)]
+    path = str(tmp_path / "wallet.txt.index")
+
+    wallet_index, is_new = load_or_build_wallet_index(path, secrets, 2)
+    assert is_new
+    wallet_index.save(path)
+    wallet_index, is_new = load_or_build_wallet_index(path, secrets, 2)
+    assert not is_new
+    assert len(wallet_index) == 2 * 3
+
+    # a different gap or different secrets rebuild it
+    wallet_index, is_new = load_or_build_wallet_index(path, secrets, 1)
+    assert is_new and len(wallet_index) == 2 * 2
+    wallet_index, is_new = load_or_build_wallet_index(path, secrets[1:], 2)
+    assert is_new and len(wallet_index) == 3